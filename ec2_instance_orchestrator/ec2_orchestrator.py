@@ -1,13 +1,17 @@
 import httpx
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from mangum import Mangum
+import asyncio
 import boto3
+import json
 import logging
+import math
+import os
+import time
 import traceback
-from datetime import datetime
-from typing import List, Dict
-
+from datetime import datetime, timezone
+from typing import List, Dict, Optional
 
 # Configure logging
 logger = logging.getLogger()
@@ -19,19 +23,122 @@ def print_timestamp(message: str):
     logger.info(f"{ts} - {message}")
 
 
-def get_model_tag_value(ami_id: str) -> str:
-    ec2_client = boto3.client("ec2")
-    response = ec2_client.describe_images(ImageIds=[ami_id])
-    images = response.get("Images", [])
-    if images:
-        tags = images[0].get("Tags", [])
-        # Look for the tag with Key "Model"
-        model_tag = next((tag for tag in tags if tag.get("Key") == "Model"), None)
-        if model_tag:
-            return model_tag.get("Value")
+# Shared clients, reused across warm Lambda invocations. The httpx client pools
+# connections for the instances' health and stats checks; it is tied to the event
+# loop it was created on, so a new one is created when the loop changes, and
+# handlers that run their own loop close it before the loop ends.
+FLEET_CACHE_TTL_SECONDS = float(os.getenv("FLEET_CACHE_TTL_SECONDS", "30"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+ec2_client = None
+http_client: Optional[httpx.AsyncClient] = None
+http_client_loop = None
+
+
+def get_ec2_client():
+    global ec2_client
+    if ec2_client is None:
+        ec2_client = boto3.client("ec2")
+    return ec2_client
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global http_client, http_client_loop
+    loop = asyncio.get_running_loop()
+    if http_client is None or http_client_loop is not loop:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS)
+        )
+        http_client_loop = loop
+    return http_client
+
+
+async def close_http_client():
+    global http_client, http_client_loop
+    if http_client is not None and http_client_loop is asyncio.get_running_loop():
+        await http_client.aclose()
+        http_client = http_client_loop = None
+
+
+def get_tag(resource: Dict, key: str) -> Optional[str]:
+    for tag in resource.get("Tags", []):
+        if tag.get("Key") == key:
+            return tag.get("Value")
     return None
 
 
+class FleetCache:
+    """
+    Snapshot of the instances (not terminated) and the account's AMIs that have a
+    Model tag. It is fetched with paginated describe calls and reused for
+    FLEET_CACHE_TTL_SECONDS, so polling endpoints do not call the EC2 API per
+    request. Endpoints that change instances invalidate it.
+    """
+
+    def __init__(self):
+        self.instances: Dict[str, Dict] = {}
+        self.images: Dict[str, Dict] = {}
+        self.updated = 0.0
+
+    def get(self, max_age: Optional[float] = None) -> "FleetCache":
+        if max_age is None:
+            max_age = FLEET_CACHE_TTL_SECONDS
+        if time.time() - self.updated > max_age:
+            self.refresh()
+        return self
+
+    def refresh(self) -> "FleetCache":
+        ec2 = get_ec2_client()
+        instances = {}
+        pages = ec2.get_paginator("describe_instances").paginate(
+            Filters=[
+                {
+                    "Name": "instance-state-name",
+                    "Values": ["pending", "running", "stopping", "stopped"],
+                },
+                {"Name": "tag-key", "Values": ["Model"]},
+            ]
+        )
+        for page in pages:
+            for reservation in page.get("Reservations", []):
+                for instance in reservation.get("Instances", []):
+                    instances[instance["InstanceId"]] = instance
+        images = {}
+        pages = ec2.get_paginator("describe_images").paginate(
+            Owners=["self"], Filters=[{"Name": "tag-key", "Values": ["Model"]}]
+        )
+        for page in pages:
+            for image in page.get("Images", []):
+                images[image["ImageId"]] = image
+        self.instances, self.images = instances, images
+        self.updated = time.time()
+        return self
+
+    def invalidate(self):
+        self.updated = 0.0
+
+    def by_model(self) -> Dict[str, List[Dict]]:
+        """The instances grouped by their Model tag."""
+        fleet = {}
+        for instance in self.instances.values():
+            fleet.setdefault(get_tag(instance, "Model"), []).append(instance)
+        return fleet
+
+    def latest_images(self) -> Dict[str, str]:
+        """The newest AMI ID of every model, by the AMIs' Model tag."""
+        images = sorted(self.images.values(), key=lambda i: i.get("CreationDate"))
+        return {get_tag(image, "Model"): image["ImageId"] for image in images}
+
+
+fleet_cache = FleetCache()
+
+
+def get_model_tag_value(ami_id: str) -> Optional[str]:
+    # A single lookup, a stale fleet cache is not worth refreshing for it
+    response = get_ec2_client().describe_images(ImageIds=[ami_id])
+    images = response.get("Images", [])
+    return get_tag(images[0], "Model") if images else None
+
+
 # Define the FastAPI app
 app = FastAPI()
 
@@ -57,18 +164,27 @@ class CreateInstanceRequest(BaseModel):
     ami_id: str
 
 
-@app.post("/create/{ami_id}")
-def create_instance(ami_id: str):
-    print_timestamp("Starting instance launch process...")
+# Launch configuration, overridable for other accounts or a local AWS stand-in
+INSTANCE_TYPE = os.getenv("EC2_INSTANCE_TYPE", "g5.xlarge")
+# List of subnets across the availability zones
+AVAILABLE_SUBNETS = os.getenv(
+    "EC2_SUBNETS",
+    "subnet-0782b2c51913f5597,"  # eu-central-1a
+    "subnet-0563d0db138045902",  # eu-central-1b
+).split(",")
+SECURITY_GROUP_ID = os.getenv("EC2_SECURITY_GROUP_ID", "sg-035e9d14ca33b05dd")
+IAM_INSTANCE_PROFILE_NAME = os.getenv("EC2_INSTANCE_PROFILE", "ec2-instance-profile")
 
-    instance_type = "g5.xlarge"
-    # List of subnets across the three availability zones
-    available_subnets = [
-        "subnet-0782b2c51913f5597",  # eu-central-1a
-        "subnet-0563d0db138045902",  # eu-central-1b
-    ]
-    security_group_id = "sg-035e9d14ca33b05dd"
-    iam_instance_profile_name = "ec2-instance-profile"
+
+def launch_instance(ami_id: str, tags: List[Dict]):
+    """
+    Launches one instance from the AMI in the first subnet with capacity and
+    returns the boto3 Instance without waiting for it to run.
+    """
+    instance_type = INSTANCE_TYPE
+    available_subnets = AVAILABLE_SUBNETS
+    security_group_id = SECURITY_GROUP_ID
+    iam_instance_profile_name = IAM_INSTANCE_PROFILE_NAME
     tag_name = "boto3-g5-whisper-diarization"
     volume_size = 200  # in GB
     volume_type = "gp3"
@@ -113,7 +229,7 @@ def create_instance(ami_id: str):
                 TagSpecifications=[
                     {
                         "ResourceType": "instance",
-                        "Tags": [{"Key": "Name", "Value": tag_name}],
+                        "Tags": [{"Key": "Name", "Value": tag_name}] + tags,
                     }
                 ],
                 BlockDeviceMappings=[
@@ -146,6 +262,16 @@ def create_instance(ami_id: str):
             status_code=500,
             detail=f"Error launching instance in all subnets. Last error: {last_error}",
         )
+    return instance
+
+
+@app.post("/create/{ami_id}")
+def create_instance(ami_id: str):
+    print_timestamp("Starting instance launch process...")
+    model = get_model_tag_value(ami_id)
+    model_tags = [{"Key": "Model", "Value": model}] if model else []
+    instance = launch_instance(ami_id, model_tags + launch_tags("cold"))
+    fleet_cache.invalidate()
 
     # Wait until the instance is in the "running" state
     try:
@@ -160,26 +286,12 @@ def create_instance(ami_id: str):
             status_code=500, detail=f"Error waiting for instance to run: {e}"
         )
 
-    # Add a Model tag to the running instance using the value from the AMI
-    additional_tag_key = "Model"
-    additional_tag_value = get_model_tag_value(ami_id)
-    try:
-        instance.create_tags(
-            Tags=[{"Key": additional_tag_key, "Value": additional_tag_value}]
-        )
-        print_timestamp(
-            f"Added tag {additional_tag_key}:{additional_tag_value} to instance {instance.id}"
-        )
-    except Exception as e:
-        print_timestamp(f"Error adding additional tag: {e}")
-        print_timestamp(traceback.format_exc())
-        raise HTTPException(status_code=500, detail=f"Error adding additional tag: {e}")
-
     print_timestamp(f"Public IP available: {instance.public_ip_address}")
 
-    # Construct the health check URL using the public IP
-    health_url = f"http://{instance.public_ip_address}:8000/health"
-    print_timestamp(f"Starting health checks at {health_url} every 1 second...")
+    # The API binds its port right away and loads the models in the background;
+    # /ready answers 200 once they are loaded
+    ready_url = f"http://{instance.public_ip_address}:8000/ready"
+    print_timestamp(f"Poll /status/{instance.id} until {ready_url} answers 200")
 
     return {
         "instance_id": instance.id,
@@ -187,89 +299,126 @@ def create_instance(ami_id: str):
     }
 
 
-@app.get("/status/{instance_id}")
-async def get_instance_status(instance_id: str):
-    """
-    Checks the status of an EC2 instance by its instance ID.
+READY_TIMEOUT_SECONDS = 5.0
 
-    It retrieves the instance's public IP using boto3, then calls http://<public_ip>:8000/health.
-    If the health endpoint returns 200 OK, the instance is considered "ready".
-    Otherwise, the endpoint returns a "not ready" status along with details.
+
+def describe_instance(instance_id: str) -> Dict:
+    """
+    Describes the instance directly: the fleet snapshot can lag a start or stop,
+    also one made by another orchestrator process or the console.
     """
-    # Create an EC2 client (make sure your Lambda's IAM role has ec2:DescribeInstances permission)
-    ec2 = boto3.client("ec2")
     try:
-        response = ec2.describe_instances(InstanceIds=[instance_id])
-        reservations = response.get("Reservations", [])
-        if not reservations:
-            raise HTTPException(status_code=404, detail="Instance not found")
-        # Assuming we use the first instance from the first reservation
-        instance = reservations[0]["Instances"][0]
-        public_ip = instance.get("PublicIpAddress")
-        if not public_ip:
-            raise HTTPException(
-                status_code=400, detail="Instance does not have a public IP"
-            )
+        response = get_ec2_client().describe_instances(InstanceIds=[instance_id])
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving instance: {e}")
+    reservations = response.get("Reservations", [])
+    if not reservations:
+        raise HTTPException(status_code=404, detail="Instance not found")
+    return reservations[0]["Instances"][0]
 
-    # Construct the health check URL using the public IP on port 8000
-    health_url = f"http://{public_ip}:8000/health"
+
+async def check_ready(public_ip: str) -> Dict:
+    """Calls the API's /ready endpoint on the instance."""
+    ready_url = f"http://{public_ip}:8000/ready"
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(health_url, timeout=5.0)
+        response = await get_http_client().get(ready_url, timeout=READY_TIMEOUT_SECONDS)
+        try:
+            timings = response.json().get("timings")
+        except ValueError:
+            timings = None
         if response.status_code == 200:
-            return {"status": "ready"}
+            return {"status": "ready", "timings": timings}
         else:
             return {
                 "status": "not ready",
-                "detail": f"Health check returned status code {response.status_code}",
+                "detail": f"Ready check returned status code {response.status_code}",
+                "timings": timings,
             }
     except httpx.RequestError as exc:
         # If the connection fails, we assume the service is not ready
         return {
             "status": "not ready",
-            "detail": f"Error connecting to {health_url}: {exc}",
+            "detail": f"Error connecting to {ready_url}: {exc}",
         }
 
 
-@app.get("/list")
-def list_running_ec2_instances() -> Dict[str, List[Dict]]:
+@app.get("/status/{instance_id}")
+async def get_instance_status(instance_id: str):
     """
-    Lists all running EC2 instances that have the 'Model' tag, along with their tags and predict endpoint.
+    Checks the status of an EC2 instance by its instance ID.
+
+    It looks up the instance's public IP, then calls http://<public_ip>:8000/ready.
+    If the ready endpoint returns 200 OK, the models are loaded and the instance is
+    considered "ready". Otherwise, the endpoint returns a "not ready" status along
+    with details. The API's startup timings are passed on when it reports them.
     """
-    ec2 = boto3.client("ec2")
-    response = ec2.describe_instances(
-        Filters=[
-            {
-                "Name": "instance-state-name",
-                "Values": ["initializing", "running", "stopping", "stopped"],
-            },
+    instance = await asyncio.to_thread(describe_instance, instance_id)
+    public_ip = instance.get("PublicIpAddress")
+    if not public_ip:
+        raise HTTPException(
+            status_code=400, detail="Instance does not have a public IP"
+        )
+    return await check_ready(public_ip)
+
+
+@app.get("/status")
+async def get_fleet_status(model: Optional[str] = None):
+    """
+    Checks the status of every instance with a Model tag, or of one model's
+    instances, calling the running instances' /ready endpoints concurrently.
+    Instances that are not running report their EC2 state as status.
+    """
+    snapshot = await asyncio.to_thread(fleet_cache.get)
+    instances = [
+        i
+        for i in snapshot.instances.values()
+        if model is None or get_tag(i, "Model") == model
+    ]
+
+    async def status(instance):
+        public_ip = instance.get("PublicIpAddress")
+        if instance["State"]["Name"] != "running" or not public_ip:
+            return {"status": instance["State"]["Name"]}
+        return await check_ready(public_ip)
+
+    results = await asyncio.gather(*(status(i) for i in instances))
+    return {
+        "instances": [
             {
-                "Name": "tag-key",
-                "Values": ["Model"],
-            },
+                "instance_id": instance["InstanceId"],
+                "model": get_tag(instance, "Model"),
+                "public_ip": instance.get("PublicIpAddress"),
+                **result,
+            }
+            for instance, result in zip(instances, results)
         ]
-    )
+    }
+
 
+@app.get("/list")
+def list_running_ec2_instances() -> Dict[str, List[Dict]]:
+    """
+    Lists all running EC2 instances that have the 'Model' tag, along with their tags and predict endpoint.
+    """
     instances = []
-    for reservation in response.get("Reservations", []):
-        for instance in reservation.get("Instances", []):
-            public_ip = instance.get("PublicIpAddress")
-            health_endpoint = f"http://{public_ip}:8000/health" if public_ip else None
-            predict_endpoint = f"http://{public_ip}:8000/predict" if public_ip else None
+    for instance in fleet_cache.get().instances.values():
+        public_ip = instance.get("PublicIpAddress")
+        health_endpoint = f"http://{public_ip}:8000/health" if public_ip else None
+        ready_endpoint = f"http://{public_ip}:8000/ready" if public_ip else None
+        predict_endpoint = f"http://{public_ip}:8000/predict" if public_ip else None
 
-            instances.append(
-                {
-                    "InstanceId": instance.get("InstanceId"),
-                    "InstanceType": instance.get("InstanceType"),
-                    "State": instance.get("State", {}).get("Name"),
-                    "PublicIpAddress": public_ip,
-                    "Tags": instance.get("Tags", []),
-                    "HealthEndpoint": health_endpoint,
-                    "PredictEndpoint": predict_endpoint,
-                }
-            )
+        instances.append(
+            {
+                "InstanceId": instance.get("InstanceId"),
+                "InstanceType": instance.get("InstanceType"),
+                "State": instance.get("State", {}).get("Name"),
+                "PublicIpAddress": public_ip,
+                "Tags": instance.get("Tags", []),
+                "HealthEndpoint": health_endpoint,
+                "ReadyEndpoint": ready_endpoint,
+                "PredictEndpoint": predict_endpoint,
+            }
+        )
 
     return {"running_instances": instances}
 
@@ -279,27 +428,19 @@ def list_images():
     """
     Lists all AMIs owned by the account that have the 'Model' tag.
     """
-    ec2 = boto3.client("ec2")
     try:
-        response = ec2.describe_images(
-            Owners=["self"], Filters=[{"Name": "tag-key", "Values": ["Model"]}]
-        )
+        snapshot = fleet_cache.get()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error listing images: {e}")
 
     images = []
-    for image in response.get("Images", []):
-        model_value = None
-        for tag in image.get("Tags", []):
-            if tag.get("Key") == "Model":
-                model_value = tag.get("Value")
-                break
+    for image in snapshot.images.values():
         images.append(
             {
                 "ImageId": image.get("ImageId"),
                 "Name": image.get("Name"),
                 "CreationDate": image.get("CreationDate"),
-                "Model": model_value,
+                "Model": get_tag(image, "Model"),
                 "Tags": image.get("Tags", []),
             }
         )
@@ -312,10 +453,12 @@ def start_instance(instance_id: str):
     """
     Starts the specified EC2 instance.
     """
-    ec2 = boto3.client("ec2")
+    ec2 = get_ec2_client()
 
     try:
         response = ec2.start_instances(InstanceIds=[instance_id])
+        ec2.create_tags(Resources=[instance_id], Tags=launch_tags("warm"))
+        fleet_cache.invalidate()
         return {
             "message": f"Start initiated for instance {instance_id}",
             "response": response,
@@ -331,10 +474,11 @@ def stop_instance(instance_id: str):
     """
     Stops the specified EC2 instance.
     """
-    ec2 = boto3.client("ec2")
+    ec2 = get_ec2_client()
 
     try:
         response = ec2.stop_instances(InstanceIds=[instance_id])
+        fleet_cache.invalidate()
         return {
             "message": f"Stop initiated for instance {instance_id}",
             "response": response,
@@ -350,9 +494,10 @@ def terminate_instance(instance_id: str):
     """
     Terminates a single EC2 instance given its instance ID.
     """
-    ec2 = boto3.client("ec2")
+    ec2 = get_ec2_client()
     try:
         response = ec2.terminate_instances(InstanceIds=[instance_id])
+        fleet_cache.invalidate()
     except Exception as e:
         # Raise an HTTP exception with a 400 status if termination fails.
         raise HTTPException(status_code=400, detail=str(e))
@@ -363,5 +508,675 @@ def terminate_instance(instance_id: str):
     }
 
 
+# Autoscaling
+#
+# autoscale() sizes the fleet of every model so that its backlog (the audio
+# seconds pending on its instances, as reported by their /stats endpoint) can be
+# processed within AUTOSCALE_TARGET_LATENCY_SECONDS. It runs on a schedule through
+# autoscale_handler and can be triggered with POST /autoscale. Capacity is added
+# by starting stopped instances of the model first, then by launching instances
+# from the model's newest AMI; idle instances are stopped, down to
+# AUTOSCALE_MIN_INSTANCES, which may be 0. The time of the last scaling action is
+# kept in the LastScaledAt tag of the instances, so the Lambda stays stateless.
+#
+# Each pass also keeps a warm pool of WARM_POOL_SIZE stopped instances per model
+# whose volumes already hold the model's weights, so scaling out only waits for
+# the instance to boot and load them from disk. The PoolState tag is "hydrating"
+# for instances launched to join the pool, which are stopped once their models
+# are loaded, "warm" for stopped pool instances and "active" for serving ones.
+# LaunchPath ("warm", "cold" or "pool") and LaunchedAt are set whenever an
+# instance is launched or started, and the time it took to become ready is logged
+# as a CloudWatch metric per model and launch path.
+LAST_SCALED_TAG = "LastScaledAt"
+POOL_STATE_TAG = "PoolState"
+LAUNCH_PATH_TAG = "LaunchPath"
+LAUNCHED_AT_TAG = "LaunchedAt"
+READY_AT_TAG = "ReadyAt"
+METRICS_NAMESPACE = "WhisperOrchestrator"
+STATS_TIMEOUT_SECONDS = 3.0
+
+
+def autoscale_config() -> Dict:
+    return {
+        "models": [
+            model for model in os.getenv("AUTOSCALE_MODELS", "").split(",") if model
+        ],
+        "target_latency": float(os.getenv("AUTOSCALE_TARGET_LATENCY_SECONDS", "300")),
+        "min_instances": int(os.getenv("AUTOSCALE_MIN_INSTANCES", "0")),
+        "max_instances": int(os.getenv("AUTOSCALE_MAX_INSTANCES", "4")),
+        # Audio seconds per second an instance is assumed to process until one
+        # has reported its measured capacity
+        "default_capacity": float(os.getenv("AUTOSCALE_DEFAULT_CAPACITY", "20")),
+        "scale_up_cooldown": float(os.getenv("AUTOSCALE_SCALE_UP_COOLDOWN", "120")),
+        "scale_down_cooldown": float(os.getenv("AUTOSCALE_SCALE_DOWN_COOLDOWN", "600")),
+        "idle_seconds": float(os.getenv("AUTOSCALE_IDLE_SECONDS", "600")),
+        "warm_pool_size": int(os.getenv("WARM_POOL_SIZE", "0")),
+        # Per-model overrides: "openai/whisper-large-v3=2,NbAiLab/nb-whisper-large=1"
+        "warm_pool_sizes": {
+            model: int(size)
+            for model, size in (
+                item.rsplit("=", 1)
+                for item in os.getenv("WARM_POOL_SIZES", "").split(",")
+                if item
+            )
+        },
+    }
+
+
+def pool_state(instance: Dict) -> str:
+    return get_tag(instance, POOL_STATE_TAG) or "active"
+
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def launch_tags(path: str, state: str = "active") -> List[Dict]:
+    """Tags of an instance that is being launched or started through `path`."""
+    return [
+        {"Key": POOL_STATE_TAG, "Value": state},
+        {"Key": LAUNCH_PATH_TAG, "Value": path},
+        {"Key": LAUNCHED_AT_TAG, "Value": now_iso()},
+    ]
+
+
+def serving(instances: List[Dict]) -> List[Dict]:
+    """The pending and running instances, without those hydrating the pool."""
+    return [
+        i
+        for i in instances
+        if i["State"]["Name"] in ("pending", "running") and pool_state(i) != "hydrating"
+    ]
+
+
+async def fetch_stats(instances: List[Dict]) -> Dict[str, Optional[Dict]]:
+    """The /stats of every instance, None for instances that do not answer yet."""
+
+    async def fetch(client, instance):
+        public_ip = instance.get("PublicIpAddress")
+        if not public_ip:
+            return None
+        try:
+            response = await client.get(
+                f"http://{public_ip}:8000/stats", timeout=STATS_TIMEOUT_SECONDS
+            )
+        except httpx.RequestError:
+            return None
+        return response.json() if response.status_code == 200 else None
+
+    client = get_http_client()
+    results = await asyncio.gather(*(fetch(client, i) for i in instances))
+    return {i["InstanceId"]: stats for i, stats in zip(instances, results)}
+
+
+def last_scaled_at(instances: List[Dict]) -> float:
+    """Timestamp of the last scaling action on the model's instances, 0 if none."""
+    times = [0.0]
+    for instance in instances:
+        value = get_tag(instance, LAST_SCALED_TAG)
+        if value:
+            times.append(datetime.fromisoformat(value).timestamp())
+    return max(times)
+
+
+def plan_scaling(active: int, stats: List[Dict], config: Dict) -> Dict:
+    """
+    Returns the desired number of instances for a model from the /stats of its
+    running instances. `active` counts the pending and running instances,
+    including those that are still loading their models and do not report yet.
+    """
+    ready = [s for s in stats if s and s.get("ready")]
+    backlog = sum(s.get("backlog_audio_seconds", 0) for s in ready)
+    capacities = [s["capacity"] for s in ready if s.get("capacity")]
+    capacity = (
+        sum(capacities) / len(capacities) if capacities else config["default_capacity"]
+    )
+    needed = math.ceil(backlog / (capacity * config["target_latency"]))
+    # Never plan below the instances that are still working.
+    busy = sum(1 for s in ready if s.get("idle_seconds", 0) < config["idle_seconds"])
+    booting = active - len(ready)
+    desired = max(needed, busy + booting, config["min_instances"])
+    return {
+        "active": active,
+        "desired": min(desired, config["max_instances"]),
+        "backlog_audio_seconds": backlog,
+        "capacity_per_instance": capacity,
+    }
+
+
+def start_capacity(ec2, model: str, instances: List[Dict], count: int, images):
+    """
+    Adds `count` instances to the model, the fastest first: instances hydrating
+    the warm pool are kept running, stopped instances are started (warm pool
+    instances first) and new instances are launched from the model's newest AMI.
+    """
+    hydrating = [
+        i["InstanceId"]
+        for i in instances
+        if i["State"]["Name"] in ("pending", "running") and pool_state(i) == "hydrating"
+    ][:count]
+    stopped = sorted(
+        (i for i in instances if i["State"]["Name"] == "stopped"),
+        key=lambda i: pool_state(i) != "warm",
+    )
+    to_start = [i["InstanceId"] for i in stopped[: count - len(hydrating)]]
+    scaled_tag = {"Key": LAST_SCALED_TAG, "Value": now_iso()}
+    if hydrating:
+        ec2.create_tags(
+            Resources=hydrating,
+            Tags=[{"Key": POOL_STATE_TAG, "Value": "active"}, scaled_tag],
+        )
+    if to_start:
+        ec2.start_instances(InstanceIds=to_start)
+        ec2.create_tags(Resources=to_start, Tags=launch_tags("warm") + [scaled_tag])
+    launched = []
+    remaining = count - len(hydrating) - len(to_start)
+    if remaining > 0:
+        if model not in images:
+            raise HTTPException(status_code=404, detail=f"No AMI for model {model}")
+        for _ in range(remaining):
+            instance = launch_instance(
+                images[model],
+                [{"Key": "Model", "Value": model}, scaled_tag] + launch_tags("cold"),
+            )
+            launched.append(instance.id)
+    fleet_cache.invalidate()
+    return {"promoted": hydrating, "started": to_start, "launched": launched}
+
+
+def stop_idle(ec2, instances: List[Dict], stats: Dict, count: int, config: Dict):
+    """Stops up to `count` running instances idle for AUTOSCALE_IDLE_SECONDS."""
+    idle = [
+        (stats[i["InstanceId"]]["idle_seconds"], i["InstanceId"])
+        for i in instances
+        if i["State"]["Name"] == "running"
+        and stats.get(i["InstanceId"])
+        and stats[i["InstanceId"]].get("idle_seconds", 0) >= config["idle_seconds"]
+    ]
+    # The longest idle instances go first.
+    to_stop = [instance_id for _, instance_id in sorted(idle, reverse=True)[:count]]
+    if to_stop:
+        ec2.stop_instances(InstanceIds=to_stop)
+        # Their volumes hold the weights, so they join the warm pool.
+        ec2.create_tags(
+            Resources=to_stop,
+            Tags=[
+                {"Key": LAST_SCALED_TAG, "Value": now_iso()},
+                {"Key": POOL_STATE_TAG, "Value": "warm"},
+            ],
+        )
+        fleet_cache.invalidate()
+    return {"stopped": to_stop}
+
+
+def maintain_pool(
+    ec2, model: str, instances: List[Dict], stats: Dict, images, size: int, dry_run
+):
+    """
+    Keeps `size` warm instances of the model. Hydrating instances are stopped
+    into the pool once their models are loaded, which has staged the weights onto
+    their volume, and new ones are launched for the instances that are missing.
+    """
+    hydrating = [
+        i
+        for i in instances
+        if i["State"]["Name"] in ("pending", "running") and pool_state(i) == "hydrating"
+    ]
+    hydrated = [
+        i["InstanceId"]
+        for i in hydrating
+        if (stats.get(i["InstanceId"]) or {}).get("ready")
+    ]
+    warm = [
+        i
+        for i in instances
+        if i["State"]["Name"] in ("stopping", "stopped") and pool_state(i) == "warm"
+    ]
+    missing = max(size - len(warm) - len(hydrating), 0)
+    result = {
+        "size": size,
+        "warm": len(warm) + len(hydrated),
+        "hydrating": len(hydrating) - len(hydrated) + missing,
+    }
+    if dry_run or not (hydrated or missing):
+        return result
+
+    if hydrated:
+        ec2.stop_instances(InstanceIds=hydrated)
+        ec2.create_tags(
+            Resources=hydrated, Tags=[{"Key": POOL_STATE_TAG, "Value": "warm"}]
+        )
+        result["hydrated"] = hydrated
+    if missing:
+        if model not in images:
+            raise HTTPException(status_code=404, detail=f"No AMI for model {model}")
+        result["launched"] = [
+            launch_instance(
+                images[model],
+                [{"Key": "Model", "Value": model}] + launch_tags("pool", "hydrating"),
+            ).id
+            for _ in range(missing)
+        ]
+    fleet_cache.invalidate()
+    return result
+
+
+def record_time_to_ready(ec2, model: str, instances: List[Dict], stats: Dict):
+    """
+    Logs the seconds from launching or starting each instance to its models being
+    loaded, once per launch, as a CloudWatch metric (embedded metric format) with
+    the model and the launch path as dimensions. Returns the recorded times.
+    """
+    recorded = []
+    for instance in instances:
+        ready_at = (stats.get(instance["InstanceId"]) or {}).get("ready_at")
+        launched_at = get_tag(instance, LAUNCHED_AT_TAG)
+        if not ready_at or not launched_at:
+            continue
+        launched_at = datetime.fromisoformat(launched_at).timestamp()
+        previous = get_tag(instance, READY_AT_TAG)
+        if previous and datetime.fromisoformat(previous).timestamp() >= launched_at:
+            continue
+        seconds = ready_at - launched_at
+        if seconds < 0:
+            # Reported by the service before this start; it is still booting.
+            continue
+        path = get_tag(instance, LAUNCH_PATH_TAG) or "cold"
+        print(
+            json.dumps(
+                {
+                    "_aws": {
+                        "Timestamp": int(time.time() * 1000),
+                        "CloudWatchMetrics": [
+                            {
+                                "Namespace": METRICS_NAMESPACE,
+                                "Dimensions": [["Model", "LaunchPath"]],
+                                "Metrics": [
+                                    {"Name": "TimeToReadySeconds", "Unit": "Seconds"}
+                                ],
+                            }
+                        ],
+                    },
+                    "Model": model,
+                    "LaunchPath": path,
+                    "InstanceId": instance["InstanceId"],
+                    "TimeToReadySeconds": round(seconds, 1),
+                }
+            )
+        )
+        ec2.create_tags(
+            Resources=[instance["InstanceId"]],
+            Tags=[
+                {
+                    "Key": READY_AT_TAG,
+                    "Value": datetime.fromtimestamp(ready_at, timezone.utc).isoformat(),
+                }
+            ],
+        )
+        recorded.append(
+            {
+                "instance_id": instance["InstanceId"],
+                "launch_path": path,
+                "seconds": round(seconds, 1),
+            }
+        )
+    if recorded:
+        fleet_cache.invalidate()
+    return recorded
+
+
+async def autoscale(dry_run: bool = False) -> List[Dict]:
+    """Runs one autoscaling pass over all models and returns its decisions."""
+    config = autoscale_config()
+    ec2 = get_ec2_client()
+    snapshot = fleet_cache.refresh()
+    fleet = snapshot.by_model()
+    images = snapshot.latest_images()
+    models = config["models"] or sorted(set(fleet) | set(images))
+
+    decisions = []
+    now = datetime.now(timezone.utc).timestamp()
+    for model in models:
+        instances = fleet.get(model, [])
+        active = serving(instances)
+        hydrating = [
+            i
+            for i in instances
+            if i["State"]["Name"] in ("pending", "running")
+            and pool_state(i) == "hydrating"
+        ]
+        stats = await fetch_stats(active + hydrating)
+        active_stats = [stats[i["InstanceId"]] for i in active]
+        decision = {"model": model, **plan_scaling(len(active), active_stats, config)}
+        ready_times = record_time_to_ready(ec2, model, active + hydrating, stats)
+        if ready_times:
+            decision["time_to_ready"] = ready_times
+        since_scaled = now - last_scaled_at(instances)
+        delta = decision["desired"] - decision["active"]
+        if delta > 0 and since_scaled < config["scale_up_cooldown"]:
+            decision["action"] = "cooldown"
+        elif delta < 0 and since_scaled < config["scale_down_cooldown"]:
+            decision["action"] = "cooldown"
+        elif delta == 0 or dry_run:
+            decision["action"] = "none" if delta == 0 else "dry_run"
+        else:
+            decision["action"] = "scale_up" if delta > 0 else "scale_down"
+            # A failing model must not keep the others from being scaled.
+            try:
+                if delta > 0:
+                    result = start_capacity(ec2, model, instances, delta, images)
+                else:
+                    result = stop_idle(ec2, active, stats, -delta, config)
+                decision.update(result)
+            except Exception as e:
+                print_timestamp(traceback.format_exc())
+                decision["error"] = getattr(e, "detail", str(e))
+            # The scaling changed the instances' states and pool tags.
+            instances = fleet_cache.refresh().by_model().get(model, [])
+
+        pool_size = config["warm_pool_sizes"].get(model, config["warm_pool_size"])
+        if pool_size:
+            try:
+                decision["pool"] = maintain_pool(
+                    ec2, model, instances, stats, images, pool_size, dry_run
+                )
+            except Exception as e:
+                print_timestamp(traceback.format_exc())
+                decision["pool"] = {"error": getattr(e, "detail", str(e))}
+        print_timestamp(f"Autoscaling decision: {decision}")
+        decisions.append(decision)
+    return decisions
+
+
+@app.post("/autoscale")
+async def autoscale_now(dry_run: bool = False):
+    """
+    Runs one autoscaling pass, as the scheduled Lambda does. With dry_run=true the
+    decisions are returned without starting or stopping anything.
+    """
+    return {"decisions": await autoscale(dry_run)}
+
+
+@app.post("/autoscale/wake/{model:path}")
+def wake_model(model: str):
+    """
+    Makes sure at least one instance of the model is pending or running, skipping
+    the cooldowns. A model scaled to zero has no instance to report a backlog, so
+    clients call this before sending work to it.
+    """
+    snapshot = fleet_cache.refresh()
+    instances = snapshot.by_model().get(model, [])
+    active = serving(instances)
+    if active:
+        return {"model": model, "instances": [i["InstanceId"] for i in active]}
+    result = start_capacity(
+        get_ec2_client(), model, instances, 1, snapshot.latest_images()
+    )
+    return {"model": model, **result}
+
+
+@app.post("/pool/{model:path}/start")
+def start_from_pool(model: str):
+    """
+    Adds one instance to the model, from its warm pool when it has a warm
+    instance, skipping the cooldowns. Unlike /create, it does not wait for the
+    instance to run; poll /status/{instance_id}.
+    """
+    snapshot = fleet_cache.refresh()
+    instances = snapshot.by_model().get(model, [])
+    result = start_capacity(
+        get_ec2_client(), model, instances, 1, snapshot.latest_images()
+    )
+    return {"model": model, **result}
+
+
+@app.get("/pool")
+def get_pool():
+    """
+    The warm pool of every model and the time-to-ready of its instances' last
+    launch, by launch path, from the instances' tags.
+    """
+    config = autoscale_config()
+    fleet = fleet_cache.get().by_model()
+    pools = []
+    for model, instances in sorted(fleet.items()):
+        times = {}
+        for instance in instances:
+            launched_at = get_tag(instance, LAUNCHED_AT_TAG)
+            ready_at = get_tag(instance, READY_AT_TAG)
+            if not launched_at or not ready_at:
+                continue
+            seconds = (
+                datetime.fromisoformat(ready_at) - datetime.fromisoformat(launched_at)
+            ).total_seconds()
+            if seconds >= 0:
+                path = get_tag(instance, LAUNCH_PATH_TAG) or "cold"
+                times.setdefault(path, []).append(seconds)
+        states = [pool_state(i) for i in instances]
+        pools.append(
+            {
+                "model": model,
+                "size": config["warm_pool_sizes"].get(model, config["warm_pool_size"]),
+                "warm": sum(
+                    1
+                    for i, state in zip(instances, states)
+                    if state == "warm" and i["State"]["Name"] == "stopped"
+                ),
+                "hydrating": states.count("hydrating"),
+                "serving": len(serving(instances)),
+                "time_to_ready_seconds": {
+                    path: {
+                        "count": len(values),
+                        "mean": round(sum(values) / len(values), 1),
+                        "max": round(max(values), 1),
+                    }
+                    for path, values in times.items()
+                },
+            }
+        )
+    return {"pools": pools}
+
+
+async def run_autoscale(dry_run: bool) -> List[Dict]:
+    try:
+        return await autoscale(dry_run)
+    finally:
+        # The loop of asyncio.run ends with this invocation
+        await close_http_client()
+
+
+def autoscale_handler(event, context):
+    """Entry point of the scheduled autoscaling Lambda (EventBridge)."""
+    return {"decisions": asyncio.run(run_autoscale(bool(event.get("dry_run"))))}
+
+
+# Routing
+#
+# POST /route/{model}/predict and POST /route/{model}/jobs forward a request to
+# the ready instance of the model with the shortest estimated wait, its backlog
+# divided by its capacity. The fleet and the instances' /stats are cached in
+# fleet_cache for up to ROUTE_FLEET_TTL_SECONDS and in routing_table for
+# ROUTE_STATS_TTL_SECONDS, so
+# routing does not call describe_instances per request; the cache lives as long
+# as the Lambda container. Requests that cannot reach an instance, or that it
+# rejects as overloaded or not ready, are retried on the next instance.
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+
+def route_config() -> Dict:
+    return {
+        "fleet_ttl": float(os.getenv("ROUTE_FLEET_TTL_SECONDS", "60")),
+        "stats_ttl": float(os.getenv("ROUTE_STATS_TTL_SECONDS", "5")),
+        "max_attempts": int(os.getenv("ROUTE_MAX_ATTEMPTS", "3")),
+        # Instances that failed to answer are skipped for this long
+        "failure_backoff": float(os.getenv("ROUTE_FAILURE_BACKOFF_SECONDS", "30")),
+        # Audio seconds assumed for each request routed since the last /stats
+        "default_audio_seconds": float(os.getenv("ROUTE_DEFAULT_AUDIO_SECONDS", "600")),
+        # Below the Lambda timeout, so a slow instance is reported as such
+        "read_timeout": float(os.getenv("ROUTE_READ_TIMEOUT_SECONDS", "100")),
+    }
+
+
+class RoutingTable:
+    """
+    Cached /stats of the instances, and the requests routed to each instance
+    since its /stats were fetched.
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self.stats_updated = {}
+        self.routed = {}
+        self.failed_until = {}
+
+    async def instances(self, model: str, config: Dict) -> List[Dict]:
+        """The pending and running instances of the model."""
+        snapshot = await asyncio.to_thread(fleet_cache.get, config["fleet_ttl"])
+        return serving(snapshot.by_model().get(model, []))
+
+    async def rank(self, model: str, config: Dict):
+        """
+        Returns the model's active instances and its ready instances, the
+        least loaded first.
+        """
+        active = await self.instances(model, config)
+        now = time.time()
+        if now - self.stats_updated.get(model, 0.0) > config["stats_ttl"]:
+            self.stats.update(await fetch_stats(active))
+            for instance in active:
+                self.routed.pop(instance["InstanceId"], None)
+            self.stats_updated[model] = now
+
+        ranked = []
+        for instance in active:
+            instance_id = instance["InstanceId"]
+            stats = self.stats.get(instance_id)
+            if not stats or not stats.get("ready"):
+                continue
+            if self.failed_until.get(instance_id, 0.0) > now:
+                continue
+            backlog = (
+                stats.get("backlog_audio_seconds", 0)
+                + self.routed.get(instance_id, 0) * config["default_audio_seconds"]
+            )
+            capacity = stats.get("capacity") or autoscale_config()["default_capacity"]
+            ranked.append((backlog / capacity, stats.get("in_flight", 0), instance))
+        ranked.sort(key=lambda item: item[:2])
+        return active, [instance for _, _, instance in ranked]
+
+    def record_routed(self, instance_id: str):
+        self.routed[instance_id] = self.routed.get(instance_id, 0) + 1
+
+    def record_failure(self, instance_id: str, config: Dict):
+        self.failed_until[instance_id] = time.time() + config["failure_backoff"]
+        self.stats.pop(instance_id, None)
+
+    def invalidate(self):
+        fleet_cache.invalidate()
+        self.stats_updated.clear()
+
+
+routing_table = RoutingTable()
+
+
+async def route_request(model: str, path: str, request: Request) -> Response:
+    config = route_config()
+    active, ranked = await routing_table.rank(model, config)
+    if not active:
+        # The model is scaled to zero; wake it and let the client retry.
+        result = await asyncio.to_thread(wake_model, model)
+        routing_table.invalidate()
+        print_timestamp(f"Woke {model} to route a request: {result}")
+        raise HTTPException(
+            status_code=503,
+            detail=f"No instance of {model} is running, starting one",
+            headers={"Retry-After": "120"},
+        )
+    if not ranked:
+        raise HTTPException(
+            status_code=503,
+            detail=f"No instance of {model} is ready",
+            headers={"Retry-After": "30"},
+        )
+
+    body = await request.body()
+    headers = {"Content-Type": request.headers.get("content-type", "application/json")}
+    timeout = httpx.Timeout(config["read_timeout"], connect=5.0)
+    last_response = None
+    client = get_http_client()
+    for instance in ranked[: config["max_attempts"]]:
+        instance_id = instance["InstanceId"]
+        url = f"http://{instance['PublicIpAddress']}:8000{path}"
+        try:
+            response = await client.post(
+                url, content=body, headers=headers, timeout=timeout
+            )
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            # The request never reached the instance, so it is safe to retry.
+            print_timestamp(f"Routing to {instance_id} failed: {e}")
+            routing_table.record_failure(instance_id, config)
+            continue
+        except httpx.TimeoutException:
+            # The instance may still be working on it; do not run it twice.
+            raise HTTPException(
+                status_code=504,
+                detail=f"Instance {instance_id} did not answer in time",
+                headers={"X-Instance-Id": instance_id},
+            )
+        if response.status_code in RETRY_STATUS_CODES:
+            print_timestamp(
+                f"Instance {instance_id} answered {response.status_code}, "
+                "trying the next instance"
+            )
+            routing_table.stats.pop(instance_id, None)
+            last_response = response
+            continue
+
+        routing_table.record_routed(instance_id)
+        response_headers = {"X-Instance-Id": instance_id}
+        if path == "/jobs" and response.status_code == 202:
+            job_id = response.json()["job_id"]
+            response_headers["Location"] = (
+                f"http://{instance['PublicIpAddress']}:8000/jobs/{job_id}"
+            )
+        return Response(
+            content=response.content,
+            status_code=response.status_code,
+            headers=response_headers,
+            media_type=response.headers.get("content-type"),
+        )
+
+    if last_response is not None:
+        retry_after = last_response.headers.get("retry-after")
+        return Response(
+            content=last_response.content,
+            status_code=last_response.status_code,
+            headers={"Retry-After": retry_after} if retry_after else None,
+            media_type=last_response.headers.get("content-type"),
+        )
+    raise HTTPException(
+        status_code=502, detail=f"No instance of {model} could be reached"
+    )
+
+
+@app.post("/route/{model:path}/predict")
+async def route_predict(model: str, request: Request):
+    """
+    Forwards a /predict request to the least loaded ready instance of the model
+    (its Model tag) and returns the instance's response. The instance is named in
+    the X-Instance-Id header.
+    """
+    return await route_request(model, "/predict", request)
+
+
+@app.post("/route/{model:path}/jobs")
+async def route_job(model: str, request: Request):
+    """
+    Submits a job to the least loaded ready instance of the model. The job is
+    polled on that instance, at the URL in the Location header.
+    """
+    return await route_request(model, "/jobs", request)
+
+
 # Attach the FastAPI app to Mangum, so it can be used as a Lambda function
 lambda_handler = Mangum(app)
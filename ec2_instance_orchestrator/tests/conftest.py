@@ -0,0 +1,80 @@
+import os
+import sys
+import types
+
+import pytest
+
+# The orchestrator is a single module; import it from its directory.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ec2_orchestrator  # noqa: E402
+
+
+@pytest.fixture
+def orchestrator(monkeypatch):
+    """The orchestrator module with empty caches."""
+    monkeypatch.setattr(ec2_orchestrator, "ec2_client", None)
+    monkeypatch.setattr(ec2_orchestrator, "fleet_cache", ec2_orchestrator.FleetCache())
+    monkeypatch.setattr(
+        ec2_orchestrator, "routing_table", ec2_orchestrator.RoutingTable()
+    )
+    return ec2_orchestrator
+
+
+@pytest.fixture
+def aws(orchestrator, monkeypatch):
+    """
+    A moto EC2 with a subnet, security group and instance profile to launch
+    into, and an AMI of the `whisper` model. `aws.run` adds instances.
+    """
+    moto = pytest.importorskip("moto")
+    import boto3
+
+    for name, value in [
+        ("AWS_ACCESS_KEY_ID", "testing"),
+        ("AWS_SECRET_ACCESS_KEY", "testing"),
+        ("AWS_DEFAULT_REGION", "eu-central-1"),
+    ]:
+        monkeypatch.setenv(name, value)
+    with moto.mock_aws():
+        ec2 = boto3.client("ec2")
+        vpc = ec2.create_vpc(CidrBlock="10.0.0.0/16")["Vpc"]["VpcId"]
+        subnet = ec2.create_subnet(VpcId=vpc, CidrBlock="10.0.0.0/24")
+        group = ec2.create_security_group(
+            GroupName="whisper", Description="whisper", VpcId=vpc
+        )
+        boto3.client("iam").create_instance_profile(
+            InstanceProfileName=orchestrator.IAM_INSTANCE_PROFILE_NAME
+        )
+        monkeypatch.setattr(
+            orchestrator, "AVAILABLE_SUBNETS", [subnet["Subnet"]["SubnetId"]]
+        )
+        monkeypatch.setattr(orchestrator, "SECURITY_GROUP_ID", group["GroupId"])
+
+        base_image = ec2.describe_images(Owners=["amazon"])["Images"][0]["ImageId"]
+        builder = ec2.run_instances(ImageId=base_image, MinCount=1, MaxCount=1)
+        image = ec2.create_image(
+            InstanceId=builder["Instances"][0]["InstanceId"], Name="whisper"
+        )["ImageId"]
+        ec2.create_tags(Resources=[image], Tags=[{"Key": "Model", "Value": "whisper"}])
+        ec2.terminate_instances(InstanceIds=[builder["Instances"][0]["InstanceId"]])
+
+        def run(model="whisper", stopped=False, **tags):
+            tags = [{"Key": "Model", "Value": model}] + [
+                {"Key": key, "Value": value} for key, value in tags.items()
+            ]
+            instance = ec2.run_instances(
+                ImageId=image,
+                MinCount=1,
+                MaxCount=1,
+                TagSpecifications=[{"ResourceType": "instance", "Tags": tags}],
+            )["Instances"][0]["InstanceId"]
+            if stopped:
+                ec2.stop_instances(InstanceIds=[instance])
+            return instance
+
+        def instance(instance_id):
+            reservations = ec2.describe_instances(InstanceIds=[instance_id])
+            return reservations["Reservations"][0]["Instances"][0]
+
+        yield types.SimpleNamespace(ec2=ec2, image=image, run=run, instance=instance)
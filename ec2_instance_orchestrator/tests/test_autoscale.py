@@ -0,0 +1,155 @@
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def config(orchestrator):
+    config = orchestrator.autoscale_config()
+    config.update(
+        target_latency=300.0,
+        min_instances=0,
+        max_instances=4,
+        default_capacity=20.0,
+        idle_seconds=600.0,
+    )
+    return config
+
+
+def ready(backlog=0.0, capacity=None, idle=0.0):
+    return {
+        "ready": True,
+        "backlog_audio_seconds": backlog,
+        "capacity": capacity,
+        "idle_seconds": idle,
+    }
+
+
+@pytest.mark.parametrize(
+    "active, stats, desired",
+    [
+        # Nothing running and nothing to do.
+        (0, [], 0),
+        # 2 x 20 s/s x 300 s of audio fits in the target latency of two instances.
+        (1, [ready(backlog=12000)], 2),
+        (1, [ready(backlog=12001)], 3),
+        # Measured capacities replace the default.
+        (1, [ready(backlog=12000, capacity=40)], 1),
+        # Capped at max_instances.
+        (1, [ready(backlog=10**6)], 4),
+        # Idle instances can go, busy ones and those still booting stay.
+        (2, [ready(idle=900), ready(idle=900)], 0),
+        (2, [ready(idle=900), ready(idle=10)], 1),
+        (3, [ready(idle=10), None, {"ready": False}], 3),
+    ],
+)
+def test_plan_scaling(orchestrator, config, active, stats, desired):
+    assert orchestrator.plan_scaling(active, stats, config)["desired"] == desired
+
+
+def test_plan_scaling_keeps_min_instances(orchestrator, config):
+    config["min_instances"] = 1
+    assert orchestrator.plan_scaling(0, [], config)["desired"] == 1
+
+
+@pytest.fixture
+def stats(orchestrator, monkeypatch):
+    """The /stats the instances report, by instance ID."""
+    reported = {}
+
+    async def fetch_stats(instances):
+        return {i["InstanceId"]: reported.get(i["InstanceId"]) for i in instances}
+
+    monkeypatch.setattr(orchestrator, "fetch_stats", fetch_stats)
+    return reported
+
+
+def autoscale(orchestrator, dry_run=False):
+    (decision,) = asyncio.run(orchestrator.autoscale(dry_run))
+    return decision
+
+
+def tag(instance, key):
+    return {t["Key"]: t["Value"] for t in instance.get("Tags", [])}.get(key)
+
+
+def test_scale_up_starts_warm_instances_before_launching(aws, orchestrator, stats):
+    running = aws.run()
+    warm = aws.run(stopped=True, PoolState="warm")
+    stats[running] = ready(backlog=15000)
+
+    decision = autoscale(orchestrator)
+
+    assert (decision["action"], decision["active"], decision["desired"]) == (
+        "scale_up",
+        1,
+        3,
+    )
+    assert decision["started"] == [warm]
+    assert len(decision["launched"]) == 1
+    assert aws.instance(warm)["State"]["Name"] in ("pending", "running")
+    assert tag(aws.instance(warm), "PoolState") == "active"
+    launched = aws.instance(decision["launched"][0])
+    assert tag(launched, "Model") == "whisper"
+    assert tag(launched, "LaunchPath") == "cold"
+    assert tag(launched, orchestrator.LAST_SCALED_TAG)
+
+
+def test_scale_down_stops_idle_instances_into_the_pool(aws, orchestrator, stats):
+    busy, idle = aws.run(), aws.run()
+    stats[busy] = ready(idle=10)
+    stats[idle] = ready(idle=900)
+
+    decision = autoscale(orchestrator)
+
+    assert (decision["action"], decision["desired"]) == ("scale_down", 1)
+    assert decision["stopped"] == [idle]
+    assert aws.instance(idle)["State"]["Name"] in ("stopping", "stopped")
+    assert tag(aws.instance(idle), "PoolState") == "warm"
+    assert aws.instance(busy)["State"]["Name"] == "running"
+
+
+def test_cooldown_after_scaling(aws, orchestrator, stats):
+    running = aws.run(**{orchestrator.LAST_SCALED_TAG: orchestrator.now_iso()})
+    stats[running] = ready(backlog=15000)
+
+    decision = autoscale(orchestrator)
+
+    assert decision["action"] == "cooldown"
+    assert "launched" not in decision
+
+
+def test_dry_run_changes_nothing(aws, orchestrator, stats):
+    running = aws.run()
+    warm = aws.run(stopped=True, PoolState="warm")
+    stats[running] = ready(backlog=15000)
+
+    decision = autoscale(orchestrator, dry_run=True)
+
+    assert (decision["action"], decision["desired"]) == ("dry_run", 3)
+    assert aws.instance(warm)["State"]["Name"] == "stopped"
+    assert len(orchestrator.fleet_cache.refresh().instances) == 2
+
+
+def test_failing_model_does_not_stop_the_others(aws, orchestrator, stats, monkeypatch):
+    # No AMI to launch the other model from.
+    other = aws.run(model="other")
+    running = aws.run()
+    stats[other] = ready(backlog=15000)
+    stats[running] = ready(backlog=15000)
+    monkeypatch.setenv("AUTOSCALE_MODELS", "other,whisper")
+
+    failed, scaled = asyncio.run(orchestrator.autoscale())
+
+    assert failed["action"] == "scale_up"
+    assert failed["error"] == "No AMI for model other"
+    assert scaled["action"] == "scale_up"
+    assert len(scaled["launched"]) == 2
+
+
+def test_autoscale_handler_closes_its_http_client(aws, orchestrator):
+    # The model only has an AMI, so no instance is asked for its /stats.
+    result = orchestrator.autoscale_handler({"dry_run": True}, None)
+
+    assert [d["action"] for d in result["decisions"]] == ["none"]
+    assert orchestrator.http_client is None
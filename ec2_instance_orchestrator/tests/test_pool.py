@@ -0,0 +1,117 @@
+from fastapi.testclient import TestClient
+
+
+def tag(instance, key):
+    return {t["Key"]: t["Value"] for t in instance.get("Tags", [])}.get(key)
+
+
+def fleet(orchestrator, model="whisper"):
+    snapshot = orchestrator.fleet_cache.refresh()
+    return snapshot.by_model().get(model, []), snapshot.latest_images()
+
+
+def test_capacity_comes_from_the_pool_before_launching(aws, orchestrator):
+    hydrating = aws.run(PoolState="hydrating")
+    stopped = aws.run(stopped=True)
+    warm = aws.run(stopped=True, PoolState="warm")
+    instances, images = fleet(orchestrator)
+
+    result = orchestrator.start_capacity(aws.ec2, "whisper", instances, 4, images)
+
+    # Hydrating instances are already running, warm ones have the weights on disk.
+    assert result["promoted"] == [hydrating]
+    assert result["started"] == [warm, stopped]
+    assert len(result["launched"]) == 1
+    for instance_id in [hydrating, warm, stopped, *result["launched"]]:
+        assert tag(aws.instance(instance_id), "PoolState") == "active"
+    assert tag(aws.instance(warm), "LaunchPath") == "warm"
+    assert tag(aws.instance(result["launched"][0]), "LaunchPath") == "cold"
+    # Promoted instances keep the launch they were hydrated with.
+    assert tag(aws.instance(hydrating), "LaunchPath") is None
+
+
+def test_warm_instances_are_started_first(aws, orchestrator):
+    aws.run(stopped=True)
+    warm = aws.run(stopped=True, PoolState="warm")
+    instances, images = fleet(orchestrator)
+
+    result = orchestrator.start_capacity(aws.ec2, "whisper", instances, 1, images)
+
+    assert result == {"promoted": [], "started": [warm], "launched": []}
+
+
+def test_pool_is_filled_with_hydrating_instances(aws, orchestrator):
+    warm = aws.run(stopped=True, PoolState="warm")
+    instances, images = fleet(orchestrator)
+
+    result = orchestrator.maintain_pool(
+        aws.ec2, "whisper", instances, {}, images, 3, dry_run=False
+    )
+
+    assert (result["size"], result["warm"], result["hydrating"]) == (3, 1, 2)
+    assert len(result["launched"]) == 2
+    for instance_id in result["launched"]:
+        instance = aws.instance(instance_id)
+        assert (tag(instance, "PoolState"), tag(instance, "LaunchPath")) == (
+            "hydrating",
+            "pool",
+        )
+    assert aws.instance(warm)["State"]["Name"] == "stopped"
+
+
+def test_hydrated_instances_are_stopped_into_the_pool(aws, orchestrator):
+    loading = aws.run(PoolState="hydrating")
+    hydrated = aws.run(PoolState="hydrating")
+    instances, images = fleet(orchestrator)
+    stats = {hydrated: {"ready": True}, loading: {"ready": False}}
+
+    result = orchestrator.maintain_pool(
+        aws.ec2, "whisper", instances, stats, images, 2, dry_run=False
+    )
+
+    assert (result["warm"], result["hydrating"]) == (1, 1)
+    assert result["hydrated"] == [hydrated]
+    assert "launched" not in result
+    assert aws.instance(hydrated)["State"]["Name"] in ("stopping", "stopped")
+    assert tag(aws.instance(hydrated), "PoolState") == "warm"
+    assert aws.instance(loading)["State"]["Name"] == "running"
+
+
+def test_dry_run_leaves_the_pool_alone(aws, orchestrator):
+    hydrated = aws.run(PoolState="hydrating")
+    instances, images = fleet(orchestrator)
+
+    result = orchestrator.maintain_pool(
+        aws.ec2, "whisper", instances, {hydrated: {"ready": True}}, images, 2, True
+    )
+
+    assert result == {"size": 2, "warm": 1, "hydrating": 1}
+    assert aws.instance(hydrated)["State"]["Name"] == "running"
+    assert len(fleet(orchestrator)[0]) == 1
+
+
+def test_pool_endpoints(aws, orchestrator, monkeypatch):
+    monkeypatch.setenv("WARM_POOL_SIZES", "whisper=2")
+    aws.run(stopped=True, PoolState="warm")
+    hydrating = aws.run(PoolState="hydrating")
+    client = TestClient(orchestrator.app)
+
+    (pool,) = client.get("/pool").json()["pools"]
+    assert (pool["model"], pool["size"], pool["warm"], pool["hydrating"]) == (
+        "whisper",
+        2,
+        1,
+        1,
+    )
+    assert pool["serving"] == 0
+
+    # The hydrating instance is promoted before the warm one is started.
+    response = client.post("/pool/whisper/start").json()
+    assert response == {
+        "model": "whisper",
+        "promoted": [hydrating],
+        "started": [],
+        "launched": [],
+    }
+    (pool,) = client.get("/pool").json()["pools"]
+    assert (pool["warm"], pool["hydrating"], pool["serving"]) == (1, 0, 1)
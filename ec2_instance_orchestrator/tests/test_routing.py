@@ -0,0 +1,137 @@
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+
+class Instances:
+    """
+    Stand-ins for the model's instances. `stats` and `answers` are keyed by IP;
+    an answer is a status code or an httpx exception to raise.
+    """
+
+    def __init__(self):
+        self.stats = {}
+        self.answers = {}
+        self.calls = []
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        ip, path = request.url.host, request.url.path
+        if path == "/stats":
+            return httpx.Response(200, json=self.stats[ip])
+        self.calls.append((ip, path))
+        answer = self.answers.get(ip, 200)
+        if isinstance(answer, type) and issubclass(answer, Exception):
+            raise answer("unreachable", request=request)
+        if answer == 202:
+            return httpx.Response(202, json={"job_id": "job-1"})
+        headers = {"Retry-After": "7"} if answer != 200 else {}
+        return httpx.Response(answer, content=request.content, headers=headers)
+
+
+@pytest.fixture
+def instances(orchestrator, monkeypatch):
+    instances = Instances()
+    fleet = {}
+    for instance_id, ip in [("i-a", "10.0.0.1"), ("i-b", "10.0.0.2")]:
+        fleet[instance_id] = {
+            "InstanceId": instance_id,
+            "State": {"Name": "running"},
+            "PublicIpAddress": ip,
+            "Tags": [{"Key": "Model", "Value": "whisper"}],
+        }
+        instances.stats[ip] = {"ready": True, "backlog_audio_seconds": 0.0}
+    # i-b has the shorter backlog and is tried first.
+    instances.stats["10.0.0.1"]["backlog_audio_seconds"] = 600.0
+    orchestrator.fleet_cache.instances = fleet
+    orchestrator.fleet_cache.updated = time.time()
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(instances.handler))
+    monkeypatch.setattr(orchestrator, "get_http_client", lambda: client)
+    return instances
+
+
+@pytest.fixture
+def client(orchestrator):
+    return TestClient(orchestrator.app)
+
+
+def predict(client):
+    return client.post("/route/whisper/predict", json={"file_url": "s3://b/k"})
+
+
+def test_routes_to_the_least_loaded_instance(client, instances):
+    response = predict(client)
+
+    assert response.status_code == 200
+    assert response.headers["X-Instance-Id"] == "i-b"
+    assert response.json() == {"file_url": "s3://b/k"}
+    assert instances.calls == [("10.0.0.2", "/predict")]
+
+
+@pytest.mark.parametrize("error", [httpx.ConnectError, httpx.ConnectTimeout])
+def test_unreachable_instances_are_skipped(client, instances, error):
+    instances.answers["10.0.0.2"] = error
+
+    response = predict(client)
+
+    assert response.status_code == 200
+    assert response.headers["X-Instance-Id"] == "i-a"
+    assert instances.calls == [("10.0.0.2", "/predict"), ("10.0.0.1", "/predict")]
+
+    # The unreachable instance is left alone for ROUTE_FAILURE_BACKOFF_SECONDS.
+    instances.calls.clear()
+    assert predict(client).headers["X-Instance-Id"] == "i-a"
+    assert instances.calls == [("10.0.0.1", "/predict")]
+
+
+def test_no_reachable_instance(client, instances):
+    instances.answers["10.0.0.1"] = httpx.ConnectError
+    instances.answers["10.0.0.2"] = httpx.ConnectError
+
+    response = predict(client)
+
+    assert response.status_code == 502
+    assert len(instances.calls) == 2
+
+
+def test_overloaded_instances_answer_with_the_last_rejection(client, instances):
+    instances.answers["10.0.0.1"] = 429
+    instances.answers["10.0.0.2"] = 503
+
+    response = predict(client)
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "7"
+    assert len(instances.calls) == 2
+
+
+def test_timeouts_are_not_retried(client, instances):
+    instances.answers["10.0.0.2"] = httpx.ReadTimeout
+
+    response = predict(client)
+
+    assert response.status_code == 504
+    assert response.headers["X-Instance-Id"] == "i-b"
+    assert instances.calls == [("10.0.0.2", "/predict")]
+
+
+def test_jobs_are_polled_on_their_instance(client, instances):
+    instances.answers["10.0.0.2"] = 202
+
+    response = client.post("/route/whisper/jobs", json={"file_url": "s3://b/k"})
+
+    assert response.status_code == 202
+    assert response.headers["Location"] == "http://10.0.0.2:8000/jobs/job-1"
+
+
+def test_no_ready_instance(client, instances):
+    for stats in instances.stats.values():
+        stats["ready"] = False
+
+    response = predict(client)
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "30"
+    assert instances.calls == []
@@ -0,0 +1,36 @@
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client(orchestrator, monkeypatch):
+    # Every instance reports ready.
+    http = httpx.AsyncClient(
+        transport=httpx.MockTransport(lambda request: httpx.Response(200, json={}))
+    )
+    monkeypatch.setattr(orchestrator, "get_http_client", lambda: http)
+    return TestClient(orchestrator.app)
+
+
+def test_instance_status_is_not_read_from_the_fleet_snapshot(orchestrator, aws, client):
+    instance_id = aws.run()
+    assert client.get(f"/status/{instance_id}").json()["status"] == "ready"
+    assert orchestrator.fleet_cache.get().instances[instance_id]
+
+    # Stopped behind the orchestrator's back, e.g. from the console.
+    aws.ec2.stop_instances(InstanceIds=[instance_id])
+    response = client.get(f"/status/{instance_id}")
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Instance does not have a public IP"
+
+
+def test_fleet_status_reports_instances_that_are_not_running(aws, client):
+    running, stopped = aws.run(), aws.run(stopped=True)
+
+    statuses = {
+        instance["instance_id"]: instance["status"]
+        for instance in client.get("/status").json()["instances"]
+    }
+    assert statuses == {running: "ready", stopped: "stopped"}
@@ -0,0 +1,50 @@
+# Scheduled autoscaling of the model instances. The function shares the
+# orchestrator's package and role; its entry point is autoscale_handler.
+resource "aws_lambda_function" "ec2_instance_autoscaler" {
+  function_name = "ec2_instance_autoscaler"
+  description   = "Lambda function to start/stop EC2 model instances based on their backlog"
+
+  s3_bucket = module.models_bucket.bucket_id
+  s3_key    = aws_s3_object.ec2_instance_orchestrator_lambda.key
+
+  runtime = "python3.12"
+  handler = "ec2_orchestrator.autoscale_handler"
+
+  role = aws_iam_role.ec2_instance_orchestrator_lambda_role.arn
+
+  source_code_hash = data.archive_file.ec2_instance_orchestrator_lambda_zip.output_base64sha256
+
+  # Launching instances does not wait for them to run
+  timeout = 60
+
+  environment {
+    variables = {
+      AUTOSCALE_MODELS                 = var.autoscale_models
+      AUTOSCALE_TARGET_LATENCY_SECONDS = var.autoscale_target_latency_seconds
+      AUTOSCALE_MIN_INSTANCES          = var.autoscale_min_instances
+      AUTOSCALE_MAX_INSTANCES          = var.autoscale_max_instances
+      WARM_POOL_SIZE                   = var.warm_pool_size
+    }
+  }
+
+  depends_on = [aws_s3_object.ec2_instance_orchestrator_lambda]
+}
+
+resource "aws_cloudwatch_event_rule" "ec2_instance_autoscaler_schedule" {
+  name                = "ec2-instance-autoscaler-schedule"
+  description         = "Runs the EC2 instance autoscaler"
+  schedule_expression = var.autoscale_schedule
+}
+
+resource "aws_cloudwatch_event_target" "ec2_instance_autoscaler" {
+  rule = aws_cloudwatch_event_rule.ec2_instance_autoscaler_schedule.name
+  arn  = aws_lambda_function.ec2_instance_autoscaler.arn
+}
+
+resource "aws_lambda_permission" "ec2_instance_autoscaler_eventbridge" {
+  statement_id  = "AllowExecutionFromEventBridge"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.ec2_instance_autoscaler.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.ec2_instance_autoscaler_schedule.arn
+}
@@ -27,7 +27,8 @@ resource "aws_instance" "whisper-diarization" {
   }
 
   user_data = templatefile("${path.module}/user-data-template.sh", {
-    MODEL_PACKAGE_S3_URI = "s3://models-bucket-just-stag/whisper-diarization.tar.gz"
+    MODEL_PACKAGE_S3_URI   = "s3://models-bucket-just-stag/whisper-diarization.tar.gz"
+    MODEL_ARTIFACTS_S3_URI = "s3://models-bucket-just-stag/model-cache"
   })
 
   user_data_replace_on_change = true
@@ -54,7 +55,8 @@ resource "aws_instance" "whisper-diarization-no" {
   }
 
   user_data = templatefile("${path.module}/user-data-template.sh", {
-    MODEL_PACKAGE_S3_URI = "s3://models-bucket-just-stag/whisper-diarization-no.tar.gz"
+    MODEL_PACKAGE_S3_URI   = "s3://models-bucket-just-stag/whisper-diarization-no.tar.gz"
+    MODEL_ARTIFACTS_S3_URI = "s3://models-bucket-just-stag/model-cache"
   })
 
   user_data_replace_on_change = true
@@ -132,6 +134,14 @@ resource "aws_iam_policy" "s3_model_access_policy" {
           "s3:GetObject"
         ]
         Resource = "${module.models_bucket.bucket_arn}/*"
+      },
+      {
+        # Listing the model-cache prefix when staging model artifacts
+        Effect = "Allow"
+        Action = [
+          "s3:ListBucket"
+        ]
+        Resource = module.models_bucket.bucket_arn
       }
     ]
   })
@@ -3,6 +3,7 @@ set -euxo pipefail
 
 # Variables
 MODEL_PACKAGE_S3_URI=${MODEL_PACKAGE_S3_URI}
+MODEL_ARTIFACTS_S3_URI=${MODEL_ARTIFACTS_S3_URI}
 
 # Install virtualenv if not already installed
 pip3 install --upgrade pip
@@ -47,6 +48,11 @@ pip install -r /opt/model/requirements.txt
 chown -R ec2-user:ec2-user /opt/model
 chmod -R 755 /opt/model
 
+# Pre-converted model artifacts are staged here by the service from
+# MODEL_ARTIFACTS_S3_URI; AMIs created from this instance keep them.
+mkdir -p /opt/model-cache
+chown -R ec2-user:ec2-user /opt/model-cache
+
 # Run the unpacked file as a service
 cat <<EOF > /etc/systemd/system/model.service
 [Unit]
@@ -58,6 +64,8 @@ Wants=network-online.target
 ExecStart=/opt/venvs/model/bin/python3 -m uvicorn main:app --host 0.0.0.0 --port 8000
 WorkingDirectory=/opt/model
 Environment="PATH=/opt/venvs/model/bin:$PATH"
+Environment="MODEL_CACHE_DIR=/opt/model-cache"
+Environment="MODEL_ARTIFACTS_S3_URI=${MODEL_ARTIFACTS_S3_URI}"
 Environment="LD_LIBRARY_PATH=/usr/local/cuda-12.5/lib:/opt/amazon/efa/lib64:/opt/amazon/openmpi/lib64:/opt/aws-ofi-nccl/lib:/usr/local/cuda-12.4/lib:/usr/local/cuda-12.4/lib64:/usr/local/cuda-12.4:/usr/local/cuda-12.4/targets/x86_64-linux/lib/:/usr/local/lib:/usr/lib:/lib"
 Restart=always
 User=ec2-user
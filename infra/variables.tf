@@ -3,4 +3,40 @@ variable "aws_region" {
   description = "AWS region for all resources."
   type        = string
   default     = "eu-central-1"
-}
\ No newline at end of file
+}
+
+variable "autoscale_models" {
+  description = "Comma-separated Model tags the autoscaler manages; empty for all models with an AMI or instance."
+  type        = string
+  default     = ""
+}
+
+variable "autoscale_target_latency_seconds" {
+  description = "Time within which the autoscaler sizes each model's fleet to process its backlog."
+  type        = number
+  default     = 300
+}
+
+variable "autoscale_min_instances" {
+  description = "Minimum number of running instances per model; 0 allows scaling to zero."
+  type        = number
+  default     = 0
+}
+
+variable "autoscale_max_instances" {
+  description = "Maximum number of running instances per model."
+  type        = number
+  default     = 4
+}
+
+variable "autoscale_schedule" {
+  description = "EventBridge schedule expression of the autoscaler."
+  type        = string
+  default     = "rate(1 minute)"
+}
+
+variable "warm_pool_size" {
+  description = "Stopped instances per model whose volumes hold the model's weights, started first when scaling out."
+  type        = number
+  default     = 1
+}
@@ -0,0 +1,717 @@
+"""
+Benchmarks for the whisper-diarization service.
+
+precision
+    Transcribes a reference clip set once per device/compute type setting and
+    reports the real-time factor of each setting together with its word error
+    rate (WER). If a clip has a reference transcript next to it (`<clip>.txt`),
+    WER is computed against it; the WER delta is always reported relative to the
+    first setting, so list the most accurate setting first.
+
+    python benchmark.py precision --clips clips/ --model large-v3 \\
+        --settings cuda:float32 cuda:float16 cuda:int8_float16 cpu:int8
+
+alignment
+    Times the word-to-speaker alignment on a synthetic transcript against the
+    previous single-pointer merge loop. No models are needed.
+
+    python benchmark.py alignment --hours 1 2 4 8
+
+e2e
+    Replays a corpus of audio files against the whole prediction pipeline at one
+    or more concurrency levels and reports latency percentiles, real-time factor,
+    throughput and, per stage (download, decode, transcribe, diarize, merge,
+    group), the duration and peak memory. The target is this service started
+    in-process (`local`), the RunPod handler called in-process (`runpod`) or the
+    /predict endpoint of a running instance (a base URL). In-process targets can
+    run on CPU with a tiny Whisper model and a stubbed diarizer:
+
+    python benchmark.py e2e --corpus clips/ --target local --model tiny \\
+        --stub-diarizer --concurrency 1 4 --requests 16 --output e2e.json
+"""
+
+import argparse
+import functools
+import http.server
+import importlib.util
+import inspect
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+
+from alignment import assign_speakers
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".m4a", ".mp4", ".ogg", ".flac", ".webm")
+
+
+def normalize_text(text: str) -> list:
+    return re.sub(r"[^\w\s']", " ", text.lower()).split()
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    """Word-level Levenshtein distance divided by the reference length."""
+    ref, hyp = normalize_text(reference), normalize_text(hypothesis)
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, start=1):
+        current = [i] + [0] * len(hyp)
+        for j, hyp_word in enumerate(hyp, start=1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_word != hyp_word),
+            )
+        previous = current
+    return previous[-1] / len(ref)
+
+
+def load_clips(clips_dir: str) -> list:
+    from faster_whisper import decode_audio
+
+    clips = []
+    for name in sorted(os.listdir(clips_dir)):
+        if not name.lower().endswith(AUDIO_EXTENSIONS):
+            continue
+        path = os.path.join(clips_dir, name)
+        reference_path = os.path.splitext(path)[0] + ".txt"
+        reference = None
+        if os.path.exists(reference_path):
+            with open(reference_path) as f:
+                reference = f.read()
+        clips.append(
+            {
+                "name": name,
+                "audio": decode_audio(path, sampling_rate=SAMPLE_RATE),
+                "reference": reference,
+            }
+        )
+    if not clips:
+        raise ValueError(f"No audio clips found in {clips_dir}")
+    return clips
+
+
+def run_precision_setting(model_name, device, compute_type, clips, args) -> dict:
+    from faster_whisper import WhisperModel
+
+    time_load_start = time.time()
+    model = WhisperModel(
+        model_name,
+        device=device,
+        compute_type=compute_type,
+        cpu_threads=args.cpu_threads,
+        num_workers=args.num_workers,
+    )
+    load_seconds = time.time() - time_load_start
+
+    transcripts = {}
+    audio_seconds = 0.0
+    processing_seconds = 0.0
+    for clip in clips:
+        time_start = time.time()
+        segments, _ = model.transcribe(
+            clip["audio"],
+            vad_filter=True,
+            vad_parameters=dict(min_silence_duration_ms=1000),
+            word_timestamps=True,
+            language=args.language,
+        )
+        transcripts[clip["name"]] = "".join(segment.text for segment in segments)
+        processing_seconds += time.time() - time_start
+        audio_seconds += len(clip["audio"]) / SAMPLE_RATE
+    del model
+
+    return {
+        "setting": f"{device}:{compute_type}",
+        "load_seconds": load_seconds,
+        "audio_seconds": audio_seconds,
+        "processing_seconds": processing_seconds,
+        "real_time_factor": processing_seconds / audio_seconds,
+        "transcripts": transcripts,
+    }
+
+
+def mean_wer(references: dict, transcripts: dict):
+    rates = [
+        word_error_rate(references[name], transcripts[name])
+        for name in transcripts
+        if references.get(name) is not None
+    ]
+    return sum(rates) / len(rates) if rates else None
+
+
+def precision_benchmark(args) -> list:
+    clips = load_clips(args.clips)
+    references = {clip["name"]: clip["reference"] for clip in clips}
+
+    results = []
+    for setting in args.settings:
+        device, compute_type = setting.split(":", 1)
+        logger.info("Benchmarking %s on %s", args.model, setting)
+        results.append(
+            run_precision_setting(args.model, device, compute_type, clips, args)
+        )
+
+    # Without reference transcripts, the baseline's output serves as reference.
+    baseline = results[0]["transcripts"]
+    baseline_wer = mean_wer(references, baseline)
+    for result in results:
+        result["wer"] = mean_wer(references, result["transcripts"])
+        if baseline_wer is not None:
+            result["wer_delta"] = result["wer"] - baseline_wer
+        else:
+            result["wer_delta"] = mean_wer(baseline, result["transcripts"])
+    if not args.keep_transcripts:
+        for result in results:
+            del result["transcripts"]
+
+    print(f"{'setting':<24}{'load s':>10}{'RTF':>10}{'WER':>10}{'WER delta':>12}")
+    for result in results:
+        wer = "-" if result["wer"] is None else f"{result['wer']:.4f}"
+        print(
+            f"{result['setting']:<24}{result['load_seconds']:>10.1f}"
+            f"{result['real_time_factor']:>10.4f}{wer:>10}{result['wer_delta']:>12.4f}"
+        )
+    return results
+
+
+def synthetic_transcript(duration: float, num_speakers: int, seed: int = 0):
+    """
+    Builds Whisper-like segments (about 2.5 words per second) and diarization turns
+    of 2-20 seconds with short gaps and occasional overlaps.
+    """
+    rng = random.Random(seed)
+    turns = []
+    t = 0.0
+    while t < duration:
+        length = rng.uniform(2, 20)
+        speaker = f"SPEAKER_{rng.randrange(num_speakers):02d}"
+        turns.append((t, min(t + length, duration), speaker))
+        t += length + rng.uniform(-0.5, 1.5)
+
+    segments = []
+    t = 0.0
+    while t < duration:
+        words = []
+        for _ in range(rng.randint(5, 30)):
+            length = rng.uniform(0.15, 0.6)
+            words.append(
+                {"start": t, "end": t + length, "word": " word", "probability": 0.9}
+            )
+            t += length + rng.uniform(0, 0.2)
+        segments.append(
+            {
+                "avg_logprob": -0.2,
+                "start": words[0]["start"],
+                "end": words[-1]["end"],
+                "text": "".join(w["word"] for w in words),
+                "words": words,
+            }
+        )
+        t += rng.uniform(0, 2)
+    return segments, turns
+
+
+def legacy_assign_speakers(segments, turns, offset_seconds=0, margin=0.1):
+    """The merge loop speech_to_text used before the interval-based alignment."""
+    final_segments = []
+    speaker_idx = 0
+    n_speakers = len(turns)
+    for segment in segments:
+        segment_text = []
+        segment_words = []
+        for word in segment["words"]:
+            word_start = word["start"] + offset_seconds - margin
+            word_end = word["end"] + offset_seconds + margin
+            while speaker_idx < n_speakers:
+                turn_start, turn_end, speaker = turns[speaker_idx]
+                if turn_start <= word_end and turn_end >= word_start:
+                    segment_text.append(word["word"])
+                    word["word"] = word["word"].strip()
+                    segment_words.append(word)
+                    if turn_end <= word_end:
+                        speaker_idx += 1
+                    break
+                elif turn_end < word_start:
+                    speaker_idx += 1
+                else:
+                    break
+        if segment_text:
+            final_segments.append(
+                {
+                    "avg_logprob": segment["avg_logprob"],
+                    "start": segment["start"],
+                    "end": segment["end"],
+                    "speaker": speaker,
+                    "text": re.sub("  ", " ", "".join(segment_text)).strip(),
+                    "words": segment_words,
+                }
+            )
+    return final_segments
+
+
+def alignment_benchmark(args) -> list:
+    results = []
+    print(
+        f"{'hours':>6}{'words':>10}{'turns':>8}{'legacy s':>10}{'new s':>10}"
+        f"{'legacy words':>14}{'new words':>11}"
+    )
+    for hours in args.hours:
+        segments, turns = synthetic_transcript(hours * 3600, args.speakers)
+        num_words = sum(len(segment["words"]) for segment in segments)
+
+        legacy_input = json.loads(json.dumps(segments))
+        time_start = time.perf_counter()
+        legacy_output = legacy_assign_speakers(legacy_input, turns)
+        legacy_seconds = time.perf_counter() - time_start
+
+        time_start = time.perf_counter()
+        output, _ = assign_speakers(segments, turns)
+        seconds = time.perf_counter() - time_start
+
+        result = {
+            "hours": hours,
+            "words": num_words,
+            "turns": len(turns),
+            "legacy_seconds": legacy_seconds,
+            "seconds": seconds,
+            "legacy_words_kept": sum(len(s["words"]) for s in legacy_output),
+            "words_kept": sum(len(s["words"]) for s in output),
+        }
+        results.append(result)
+        print(
+            f"{hours:>6g}{num_words:>10}{result['turns']:>8}{legacy_seconds:>10.3f}"
+            f"{seconds:>10.3f}{result['legacy_words_kept']:>14}{result['words_kept']:>11}"
+        )
+    return results
+
+
+E2E_STAGES = ("download", "decode", "vad", "transcribe", "diarize", "merge", "group")
+# Service functions wrapped to measure the peak memory of each stage in-process.
+STAGE_FUNCTIONS = {
+    "download": "download_input",
+    "decode": "decode_audio",
+    "vad": "detect_speech",
+    "transcribe": "transcribe",
+    "diarize": "diarize",
+    "merge": "assign_speakers",
+    "group": "group_by_speaker",
+}
+
+
+class StubDiarization:
+    """
+    Stands in for the pyannote pipeline, so the service runs on CPU without
+    downloading it. Speakers take turns of `turn_seconds`, every speaker has a
+    fixed embedding, and each call sleeps `rtf` seconds per second of audio to
+    model the cost of the real pipeline.
+    """
+
+    def __init__(self, speakers=2, turn_seconds=10.0, rtf=0.0):
+        self.speakers = speakers
+        self.turn_seconds = turn_seconds
+        self.rtf = rtf
+        self.clustering = SimpleNamespace(threshold=0.7, method="centroid")
+
+    def to(self, device):
+        return self
+
+    @staticmethod
+    def _speaker_embedding(label: str) -> np.ndarray:
+        return np.random.default_rng(int(label[-2:])).standard_normal(256)
+
+    def __call__(
+        self, file, num_speakers=None, max_speakers=None, return_embeddings=False
+    ):
+        from pyannote.core import Annotation, Segment
+
+        duration = file["waveform"].shape[-1] / file["sample_rate"]
+        time.sleep(duration * self.rtf)
+        speakers = num_speakers or min(self.speakers, max_speakers or self.speakers)
+        annotation = Annotation()
+        start, turn = 0.0, 0
+        while start < duration:
+            end = min(start + self.turn_seconds, duration)
+            annotation[Segment(start, end)] = f"SPEAKER_{turn % speakers:02d}"
+            start, turn = end, turn + 1
+        if not return_embeddings:
+            return annotation
+        labels = annotation.labels()
+        embeddings = [self._speaker_embedding(label) for label in labels]
+        return annotation, np.array(embeddings)
+
+    def _embedding(self, waveform):
+        return np.random.default_rng(0).standard_normal((1, 256))
+
+
+def load_service(path: str, args):
+    """
+    Imports a service's main.py with the benchmark settings: the Whisper model,
+    no result cache (repeated files would be served from it) and optionally the
+    stub diarizer in place of pyannote.
+    """
+    os.environ["WHISPER_MODEL"] = args.model
+    os.environ["CACHE_MAX_MB"] = "0"
+    os.environ.pop("CACHE_S3_BUCKET", None)
+    if args.device:
+        os.environ["WHISPER_DEVICE"] = args.device
+    if args.stub_diarizer:
+        from pyannote.audio import Pipeline
+
+        diarizer = StubDiarization(rtf=args.stub_diarizer_rtf)
+        Pipeline.from_pretrained = staticmethod(lambda *_, **__: diarizer)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(path)))
+    spec = importlib.util.spec_from_file_location("benchmarked_service", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class StageMemory:
+    """
+    Wraps the stage functions of an in-process service with its own PeakMemory
+    and keeps the highest peak seen per stage. Peaks are process-wide, so with
+    concurrent requests a stage's peak includes whatever else runs meanwhile;
+    benchmark at concurrency 1 for a clean attribution.
+    """
+
+    def __init__(self, module):
+        self.peaks = {}
+        self._lock = threading.Lock()
+        for stage, name in STAGE_FUNCTIONS.items():
+            if hasattr(module, name):
+                wrapped = self._wrap(module, stage, getattr(module, name))
+                setattr(module, name, wrapped)
+
+    def _record(self, stage: str, report: dict):
+        with self._lock:
+            peaks = self.peaks.setdefault(stage, {})
+            for key, value in report.items():
+                peaks[key] = max(peaks.get(key, 0.0), value)
+
+    def _wrap(self, module, stage: str, function):
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with module.PeakMemory() as memory:
+                    result = await function(*args, **kwargs)
+                self._record(stage, memory.report())
+                return result
+
+        else:
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with module.PeakMemory() as memory:
+                    result = function(*args, **kwargs)
+                self._record(stage, memory.report())
+                return result
+
+        return wrapper
+
+
+class QuietFileHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_corpus(corpus: str) -> str:
+    """Serves the corpus directory over HTTP on localhost and returns its URL."""
+    handler = functools.partial(QuietFileHandler, directory=corpus)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def start_local_service(module) -> str:
+    """Runs the service's app with uvicorn on a background thread until /ready."""
+    import uvicorn
+
+    config = uvicorn.Config(module.app, host="127.0.0.1", port=0, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.1)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    url = f"http://127.0.0.1:{port}"
+    while True:
+        try:
+            with urllib.request.urlopen(f"{url}/ready") as response:
+                if response.status == 200:
+                    return url
+        except OSError:
+            pass
+        time.sleep(0.5)
+
+
+def post_predict(url: str, input_data: dict, timeout: float) -> dict:
+    request = urllib.request.Request(
+        f"{url}/predict",
+        data=json.dumps({"input": input_data}).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.load(response)
+
+
+def percentiles(values) -> dict:
+    if not values:
+        return {}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": p50, "p95": p95, "p99": p99, "mean": float(np.mean(values))}
+
+
+def run_e2e_level(predict, files: list, concurrency: int, num_requests: int) -> dict:
+    """Sends `num_requests` requests over `files`, `concurrency` at a time."""
+
+    def run_request(i):
+        name, duration = files[i % len(files)]
+        time_start = time.perf_counter()
+        try:
+            output = predict(name)
+            error = None
+        except Exception as e:
+            output, error = {}, str(e)
+        latency = time.perf_counter() - time_start
+        return {
+            "file": name,
+            "audio_seconds": duration,
+            "latency": latency,
+            "output": output,
+            "error": error,
+        }
+
+    time_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(run_request, range(num_requests)))
+    wall_seconds = time.perf_counter() - time_start
+
+    ok = [r for r in results if r["error"] is None]
+    for result in results:
+        if result["error"]:
+            logger.warning("%s failed: %s", result["file"], result["error"])
+    audio_seconds = sum(r["audio_seconds"] for r in ok)
+    stages = {}
+    for stage in E2E_STAGES:
+        seconds = [
+            r["output"]["timings"][stage]
+            for r in ok
+            if stage in (r["output"].get("timings") or {})
+        ]
+        stages[stage] = {"seconds": percentiles(seconds)}
+    peak_memory = {}
+    for r in ok:
+        for key, value in (r["output"].get("memory") or {}).items():
+            peak_memory[key] = max(peak_memory.get(key, 0.0), value)
+
+    return {
+        "concurrency": concurrency,
+        "requests": num_requests,
+        "errors": len(results) - len(ok),
+        "wall_seconds": wall_seconds,
+        "throughput_rps": len(ok) / wall_seconds,
+        "audio_seconds_per_second": audio_seconds / wall_seconds,
+        "latency_seconds": percentiles([r["latency"] for r in ok]),
+        "real_time_factor": percentiles(
+            [r["latency"] / r["audio_seconds"] for r in ok if r["audio_seconds"]]
+        ),
+        "stages": stages,
+        "peak_memory": peak_memory,
+    }
+
+
+def e2e_benchmark(args) -> dict:
+    from faster_whisper import decode_audio
+
+    names = sorted(
+        name
+        for name in os.listdir(args.corpus)
+        if name.lower().endswith(AUDIO_EXTENSIONS)
+    )
+    if not names:
+        raise ValueError(f"No audio files found in {args.corpus}")
+    files = [
+        (name, len(decode_audio(os.path.join(args.corpus, name))) / SAMPLE_RATE)
+        for name in names
+    ]
+    corpus_url = args.corpus_url or serve_corpus(args.corpus)
+
+    def input_for(name):
+        input_data = {"file_url": f"{corpus_url.rstrip('/')}/{name}"}
+        if args.language:
+            input_data["language"] = args.language
+        if args.num_speakers:
+            input_data["num_speakers"] = args.num_speakers
+        return input_data
+
+    stage_memory = None
+    if args.target == "runpod":
+        module = load_service(args.runpod_main, args)
+        stage_memory = StageMemory(module)
+
+        def predict(name):
+            return module.handler({"input": input_for(name)})
+
+    else:
+        url = args.target
+        if args.target == "local":
+            module = load_service(args.service_main, args)
+            stage_memory = StageMemory(module)
+            url = start_local_service(module)
+
+        def predict(name):
+            return post_predict(url, input_for(name), args.timeout)
+
+    # Warm up the models and code paths outside the measurements.
+    for _ in range(args.warmup):
+        predict(files[0][0])
+    if stage_memory is not None:
+        stage_memory.peaks.clear()
+
+    levels = []
+    for concurrency in args.concurrency:
+        logger.info("Benchmarking %s at concurrency %d", args.target, concurrency)
+        level = run_e2e_level(
+            predict, files, concurrency, args.requests or len(files)
+        )
+        if stage_memory is not None:
+            for stage, peaks in stage_memory.peaks.items():
+                level["stages"][stage]["peak_memory"] = peaks
+            stage_memory.peaks.clear()
+        levels.append(level)
+
+    print(
+        f"{'conc':>5}{'req/s':>8}{'audio x':>9}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}"
+        f"{'RTF p50':>9}{'errors':>8}"
+    )
+    for level in levels:
+        latency, rtf = level["latency_seconds"], level["real_time_factor"]
+        print(
+            f"{level['concurrency']:>5}{level['throughput_rps']:>8.2f}"
+            f"{level['audio_seconds_per_second']:>9.1f}{latency.get('p50', 0):>9.2f}"
+            f"{latency.get('p95', 0):>9.2f}{latency.get('p99', 0):>9.2f}"
+            f"{rtf.get('p50', 0):>9.3f}{level['errors']:>8}"
+        )
+        for stage, result in level["stages"].items():
+            seconds = result["seconds"]
+            memory = result.get("peak_memory", {})
+            print(
+                f"      {stage:<12}p50 {seconds.get('p50', 0):>8.3f}s"
+                f"  p95 {seconds.get('p95', 0):>8.3f}s"
+                f"  peak RSS {memory.get('peak_rss_mb', '-'):>8} MiB"
+            )
+
+    return {
+        "target": args.target,
+        "model": args.model,
+        "stub_diarizer": args.stub_diarizer,
+        "files": [{"name": name, "audio_seconds": d} for name, d in files],
+        "levels": levels,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    precision = subparsers.add_parser(
+        "precision", help="Compare device/compute type settings on a clip set"
+    )
+    precision.add_argument("--clips", required=True, help="Directory of audio clips")
+    precision.add_argument("--model", default="large-v3")
+    precision.add_argument(
+        "--settings",
+        nargs="+",
+        default=["cuda:float32", "cuda:float16", "cuda:int8_float16"],
+        help="device:compute_type pairs, the first one is the WER baseline",
+    )
+    precision.add_argument("--language", default=None)
+    precision.add_argument("--cpu-threads", type=int, default=0)
+    precision.add_argument("--num-workers", type=int, default=1)
+    precision.add_argument("--keep-transcripts", action="store_true")
+    precision.add_argument("--output", help="Write the results as JSON to this file")
+
+    alignment = subparsers.add_parser(
+        "alignment", help="Time word-to-speaker alignment on synthetic transcripts"
+    )
+    alignment.add_argument(
+        "--hours", type=float, nargs="+", default=[0.5, 1, 2, 4, 8]
+    )
+    alignment.add_argument("--speakers", type=int, default=4)
+    alignment.add_argument("--output", help="Write the results as JSON to this file")
+
+    e2e = subparsers.add_parser(
+        "e2e", help="Replay an audio corpus against the whole prediction pipeline"
+    )
+    e2e.add_argument("--corpus", required=True, help="Directory of audio files")
+    e2e.add_argument(
+        "--corpus-url",
+        help="Base URL (or s3:// prefix) the target downloads the corpus from; "
+        "by default the corpus is served from this machine",
+    )
+    e2e.add_argument(
+        "--target",
+        default="local",
+        help="`local`, `runpod` or the base URL of a running instance",
+    )
+    e2e.add_argument("--model", default="tiny", help="Whisper model (in-process)")
+    e2e.add_argument("--device", help="Whisper device (in-process)")
+    e2e.add_argument("--stub-diarizer", action="store_true")
+    e2e.add_argument(
+        "--stub-diarizer-rtf",
+        type=float,
+        default=0.0,
+        help="Seconds the stub diarizer sleeps per second of audio",
+    )
+    e2e.add_argument("--concurrency", type=int, nargs="+", default=[1])
+    e2e.add_argument(
+        "--requests",
+        type=int,
+        help="Requests per concurrency level, by default one per file",
+    )
+    e2e.add_argument("--warmup", type=int, default=1)
+    e2e.add_argument("--language", default=None)
+    e2e.add_argument("--num-speakers", type=int, default=None)
+    e2e.add_argument("--timeout", type=float, default=3600)
+    e2e.add_argument(
+        "--service-main", default=os.path.join(os.path.dirname(__file__), "main.py")
+    )
+    e2e.add_argument(
+        "--runpod-main",
+        default=os.path.join(
+            os.path.dirname(__file__), "..", "whisper-runpod", "main.py"
+        ),
+    )
+    e2e.add_argument("--output", help="Write the results as JSON to this file")
+
+    args = parser.parse_args()
+    if args.command == "precision":
+        results = precision_benchmark(args)
+    elif args.command == "alignment":
+        results = alignment_benchmark(args)
+    elif args.command == "e2e":
+        results = e2e_benchmark(args)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,67 @@
+import gc
 import logging
-from fastapi import FastAPI, UploadFile, File, HTTPException, Request
-from pydantic import BaseModel
-from typing import Optional
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import Dict, List, Optional
+import aiohttp
+import asyncio
+import contextvars
+import fcntl
+import functools
+import hashlib
+import json
+import math
+import multiprocessing
+import signal
 import subprocess
 import os
-import requests
+import re
+import resource
+import shutil
+import tempfile
+import threading
 import time
+import uuid
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import replace
+from contextlib import asynccontextmanager, contextmanager
+import numpy as np
+import prometheus_client as prometheus
 import torch
-import re
-from faster_whisper import WhisperModel
+import yaml
+from faster_whisper import BatchedInferencePipeline, WhisperModel
+from faster_whisper.vad import SpeechTimestampsMap, VadOptions, get_speech_timestamps
 from pyannote.audio import Pipeline
-import torchaudio
+
+from alignment import (
+    OnlineSpeakers,
+    assign_speakers,
+    diarization_windows,
+    restore_turns,
+    stitch_windows,
+)
 
 # Configure logging
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
-
 
 class Output(BaseModel):
     segments: list
     language: Optional[str] = None
     num_speakers: Optional[int] = None
+    model: Optional[str] = None
+    timings: Optional[dict] = None
+    memory: Optional[dict] = None
 
 
 class PredictRequest(BaseModel):
     file_string: Optional[str] = None
     file_url: Optional[str] = None
-    file: Optional[UploadFile] = None
+    # URLs only; handled like file_url.
+    file: Optional[str] = None
     group_segments: bool = True
     transcript_output_format: str = "both"
     num_speakers: Optional[int] = None
@@ -36,262 +69,3012 @@ class PredictRequest(BaseModel):
     language: Optional[str] = None
     prompt: Optional[str] = None
     offset_seconds: int = 0
+    model: Optional[str] = None
+    # Silero VAD options, see vad_parameters.
+    vad_filter: bool = True
+    vad_threshold: float = 0.5
+    vad_min_silence_ms: int = 1000
+    vad_speech_pad_ms: int = 400
+
+
+class BatchItem(BaseModel):
+    index: int
+    file_url: str
+    status: str  # completed or failed
+    status_code: int = 200
+    error: Optional[str] = None
+    result: Optional[Output] = None
+
+
+class BatchOutput(BaseModel):
+    results: List[BatchItem]
+    completed: int
+    failed: int
+
+
+class Job(BaseModel):
+    job_id: str
+    status: str  # queued, running, completed or failed
+    stage: Optional[str] = None
+    progress: float = 0.0  # percent of the audio transcribed
+    created_at: float
+    updated_at: float
+    error: Optional[str] = None
+    result: Optional[Output] = None
+
+
+SAMPLE_RATE = 16000
+
+# SERVING_PROFILE=cpu serves from CPU-only instances: a small Whisper model with int8
+# weights and pyannote on CPU, one stage after the other, with every worker process
+# pinned to its own share of the cores (see claim_cpu_slot).
+serving_profile = os.getenv("SERVING_PROFILE", "gpu")
+if serving_profile not in ("gpu", "cpu"):
+    raise ValueError(f"Unknown SERVING_PROFILE {serving_profile!r}")
+cpu_profile = serving_profile == "cpu"
+
+# Run transcription (CTranslate2) and diarization (PyTorch) side by side instead of
+# one after the other. Set CONCURRENT_STAGES=0 to fall back to sequential execution.
+# On CPU both stages would compete for the same cores, so the CPU profile runs them
+# sequentially, each with all of the process's threads.
+concurrent_stages = (
+    os.getenv("CONCURRENT_STAGES", "0" if cpu_profile else "1") != "0"
+)
+
+# Cross-request micro-batching of Whisper chunks; 0 disables it. Batching only pays
+# off when several requests are in flight, so the number of concurrently executed
+# jobs defaults to the batch size.
+whisper_batch_size = int(os.getenv("WHISPER_BATCH_SIZE", "0"))
+whisper_batch_window_ms = int(os.getenv("WHISPER_BATCH_WINDOW_MS", "20"))
+gpu_workers = int(os.getenv("GPU_WORKERS", str(max(1, whisper_batch_size))))
+
+stage_executor = ThreadPoolExecutor(
+    max_workers=2 * gpu_workers, thread_name_prefix="stage"
+)
+
+# Model precision and placement are configurable at startup. On GPU-less boxes and
+# in the CPU profile the defaults switch to CPU with int8 quantization.
+default_models = {"gpu": "large-v3", "cpu": "small"}
+model_name = os.getenv("WHISPER_MODEL", default_models[serving_profile])
+use_cuda = torch.cuda.is_available() and not cpu_profile
+whisper_device = os.getenv("WHISPER_DEVICE", "cuda" if use_cuda else "cpu")
+whisper_device_index = int(os.getenv("WHISPER_DEVICE_INDEX", "0"))
+whisper_compute_type = os.getenv(
+    "WHISPER_COMPUTE_TYPE", "float32" if whisper_device == "cuda" else "int8"
+)
+diarization_device = os.getenv(
+    "DIARIZATION_DEVICE",
+    f"cuda:{whisper_device_index}" if whisper_device == "cuda" else "cpu",
+)
+
+
+# Slot lock files stay open for the life of the process; closing one releases it.
+cpu_slot_files = []
+
+
+def claim_cpu_slot(workers: int) -> Optional[int]:
+    """
+    Claims one of `workers` slots with an exclusive lock on a slot file, so that
+    every worker process started by `uvicorn --workers` gets its own slot. A
+    restarted worker takes over the slot its predecessor released.
+    """
+    slot_dir = os.getenv(
+        "CPU_SLOT_DIR", os.path.join(tempfile.gettempdir(), "whisper-cpu-slots")
+    )
+    os.makedirs(slot_dir, exist_ok=True)
+    for slot in range(workers):
+        f = open(os.path.join(slot_dir, f"slot-{slot}.lock"), "w")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            continue
+        cpu_slot_files.append(f)
+        return slot
+    return None
+
+
+def pin_cpu_threads() -> int:
+    """
+    Pins the process to its share of the available cores and returns the number
+    of threads Whisper and PyTorch should use. The cores are split into contiguous
+    blocks, one per worker process (CPU_WORKERS, by default uvicorn's
+    WEB_CONCURRENCY), so processes do not oversubscribe each other's cores.
+    """
+    cores = sorted(os.sched_getaffinity(0))
+    workers = int(os.getenv("CPU_WORKERS", os.getenv("WEB_CONCURRENCY", "1")))
+    workers = max(1, min(workers, len(cores)))
+    slot = claim_cpu_slot(workers) if workers > 1 else 0
+    if slot is None:
+        logger.warning("No free CPU slot among %d, using all cores", workers)
+        return len(cores)
+    cores = cores[slot * len(cores) // workers : (slot + 1) * len(cores) // workers]
+    os.sched_setaffinity(0, cores)
+    logger.info("CPU slot %d/%d pinned to cores %s", slot, workers, cores)
+    return len(cores)
+
+
+# Thread counts of CTranslate2 (intra-op) and PyTorch (intra- and inter-op). The
+# CPU profile sizes them to the process's cores; otherwise the libraries' defaults
+# apply unless set.
+cpu_threads = pin_cpu_threads() if cpu_profile else 0
+whisper_cpu_threads = int(os.getenv("WHISPER_CPU_THREADS", str(cpu_threads)))
+torch_threads = int(os.getenv("TORCH_THREADS", str(cpu_threads)))
+if torch_threads > 0:
+    torch.set_num_threads(torch_threads)
+torch_interop_threads = int(
+    os.getenv("TORCH_INTEROP_THREADS", "1" if cpu_profile else "0")
+)
+if torch_interop_threads > 0:
+    torch.set_num_interop_threads(torch_interop_threads)
+
+
+def parse_worker_devices(value: str) -> List[int]:
+    if value.strip() == "all":
+        return list(range(torch.cuda.device_count()))
+    return [int(device) for device in value.split(",") if device.strip()]
+
+
+# Worker-pool mode: with MODEL_WORKER_DEVICES, e.g. "0,1,2,3" or "all", the API
+# process loads no models and spawns one model worker process per listed GPU (list
+# a GPU twice to run two workers on it), see ModelWorkerPool. The workers
+# themselves run with MODEL_WORKER_DEVICE set.
+model_worker_device = os.getenv("MODEL_WORKER_DEVICE")
+worker_devices = (
+    parse_worker_devices(os.getenv("MODEL_WORKER_DEVICES", ""))
+    if model_worker_device is None
+    else []
+)
+
+DIARIZATION_PIPELINE = "pyannote/speaker-diarization-3.1"
+# Loaded in the background after the server starts, see Startup.
+diarization_model: Optional[Pipeline] = None
+# pyannote pipelines are not guaranteed to be thread-safe.
+diarization_lock = threading.Lock()
+
+# Recordings longer than LONG_FORM_DIARIZATION_SECONDS are diarized in overlapping
+# windows, so the memory used by pyannote depends on the window length instead of
+# the recording length; 0 disables the long-form mode. Speakers are matched across
+# windows by clustering their embeddings, by default with the pipeline's own
+# clustering threshold (set once the pipeline is loaded). Cache keys use the
+# configured value, which the API process knows without loading the pipeline.
+long_form_diarization_seconds = float(
+    os.getenv("LONG_FORM_DIARIZATION_SECONDS", "1800")
+)
+diarization_window_seconds = float(os.getenv("DIARIZATION_WINDOW_SECONDS", "600"))
+diarization_window_overlap_seconds = float(
+    os.getenv("DIARIZATION_WINDOW_OVERLAP_SECONDS", "30")
+)
+cluster_threshold_setting: Optional[float] = (
+    float(os.environ["DIARIZATION_CLUSTER_THRESHOLD"])
+    if os.getenv("DIARIZATION_CLUSTER_THRESHOLD")
+    else None
+)
+diarization_cluster_threshold = cluster_threshold_setting
+
+# Model artifacts are looked up in MODEL_CACHE_DIR first: pre-converted CTranslate2
+# Whisper models in whisper/<model>/ and an offline copy of the pyannote pipeline in
+# pyannote/, as written by prepare_models.py. Missing artifacts are copied from
+# MODEL_ARTIFACTS_S3_URI, which has the same layout, and are otherwise downloaded
+# from the Hugging Face Hub.
+model_cache_dir = os.getenv("MODEL_CACHE_DIR", "/opt/model-cache")
+model_artifacts_s3_uri = os.getenv("MODEL_ARTIFACTS_S3_URI", "").rstrip("/")
+
+
+def cuda_devices() -> set:
+    """
+    The CUDA devices the models run on. None in the API process of pool mode,
+    which leaves the GPUs to its model workers; they measure their own memory.
+    """
+    if worker_devices:
+        return set()
+    devices = (f"{whisper_device}:{whisper_device_index}", diarization_device)
+    return {torch.device(device) for device in devices if device.startswith("cuda")}
+
+
+def gpu_memory_used(device) -> int:
+    free, total = torch.cuda.mem_get_info(device)
+    return total - free
+
+
+class PeakMemory:
+    """
+    Samples the resident set size of the process and the memory in use on the CUDA
+    devices of the models while the block runs, and keeps the peaks. Both are
+    process (or device) wide: with several GPU workers they include concurrent
+    requests, and the VRAM figure includes the loaded models.
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_vram = 0
+        self._devices = cuda_devices()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _rss(self) -> int:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError:
+            # Lifetime peak of the process (in KiB on Linux) where /proc is missing.
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _vram(self) -> int:
+        return sum(gpu_memory_used(device) for device in self._devices)
+
+    def _sample(self):
+        self.peak_rss = max(self.peak_rss, self._rss())
+        self.peak_vram = max(self.peak_vram, self._vram())
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+        self._sample()
+
+    def report(self) -> dict:
+        report = {"peak_rss_mb": round(self.peak_rss / 2**20, 1)}
+        if self._devices:
+            report["peak_vram_mb"] = round(self.peak_vram / 2**20, 1)
+        return report
+
+
+class _BatchItem:
+    def __init__(self, features, tokenizer, chunks_metadata, options):
+        self.features = features
+        self.tokenizer = tokenizer
+        self.chunks_metadata = chunks_metadata
+        self.options = options
+        # clip_timestamps differ per request but are not used when decoding a batch.
+        self.key = (
+            tokenizer.language_code,
+            tokenizer.task,
+            replace(options, clip_timestamps=None),
+        )
+        self.enqueued_at = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _RoutedBatchedPipeline(BatchedInferencePipeline):
+    """
+    Per-request BatchedInferencePipeline that does VAD, feature extraction and
+    language detection itself but hands the decoding of its chunks to the shared
+    WhisperBatcher.
+    """
+
+    def __init__(self, batcher):
+        super().__init__(batcher.model)
+        self.batcher = batcher
+
+    def forward(self, features, tokenizer, chunks_metadata, options):
+        return self.batcher.forward(features, tokenizer, chunks_metadata, options)
+
+
+class WhisperBatcher:
+    """
+    Micro-batching engine in front of WhisperModel.
+
+    Every in-flight request splits its audio into VAD chunks as usual. Chunks are
+    collected for up to `window_ms` and chunks of requests with compatible decoding
+    options (language, task, prompt, ...) are decoded together in a single batch of
+    up to `batch_size` chunks. The segments are then routed back to the requests
+    that own them.
+    """
+
+    def __init__(self, model, batch_size: int, window_ms: int):
+        self.model = model
+        self.batch_size = batch_size
+        self.window = window_ms / 1000
+        self.pipeline = BatchedInferencePipeline(model)
+        self._pending = []
+        self._stopped = False
+        self._condition = threading.Condition()
+        threading.Thread(target=self._run, name="whisper-batcher", daemon=True).start()
+
+    def transcribe(self, audio, **options):
+        pipeline = _RoutedBatchedPipeline(self)
+        return pipeline.transcribe(audio, batch_size=self.batch_size, **options)
+
+    def forward(self, features, tokenizer, chunks_metadata, options):
+        item = _BatchItem(features, tokenizer, chunks_metadata, options)
+        with self._condition:
+            self._pending.append(item)
+            self._condition.notify()
+        item.done.wait()
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def stop(self):
+        """Stops the batching thread once the pending chunks are decoded."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def _next_batch(self):
+        with self._condition:
+            while not self._pending:
+                if self._stopped:
+                    return None
+                self._condition.wait()
+            first = self._pending[0]
+            deadline = first.enqueued_at + self.window
+            while True:
+                compatible = [item for item in self._pending if item.key == first.key]
+                rows = sum(len(item.features) for item in compatible)
+                remaining = deadline - time.monotonic()
+                if rows >= self.batch_size or remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            batch, rows = [], 0
+            for item in compatible:
+                if batch and rows + len(item.features) > self.batch_size:
+                    break
+                batch.append(item)
+                rows += len(item.features)
+            for item in batch:
+                self._pending.remove(item)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            logger.debug(
+                "Decoding batch of %d chunks from %d requests",
+                sum(len(item.features) for item in batch),
+                len(batch),
+            )
+            try:
+                features = np.concatenate([item.features for item in batch])
+                chunks_metadata = [
+                    metadata for item in batch for metadata in item.chunks_metadata
+                ]
+                # Word timestamp heuristics carry state between consecutive chunks of
+                # the same audio; chunks of a mixed batch are independent.
+                self.pipeline.last_speech_timestamp = 0.0
+                outputs = self.pipeline.forward(
+                    features, batch[0].tokenizer, chunks_metadata, batch[0].options
+                )
+                start = 0
+                for item in batch:
+                    item.result = outputs[start : start + len(item.features)]
+                    start += len(item.features)
+            except Exception as e:
+                for item in batch:
+                    item.error = e
+            for item in batch:
+                item.done.set()
+
+
+class WhisperModels:
+    """
+    The Whisper models hosted by the service, loaded on first use.
+
+    Loaded models are kept in least recently used order. Before another model is
+    loaded, idle models are evicted until fewer than WHISPER_MAX_LOADED_MODELS are
+    loaded and, on GPU, at least WHISPER_MIN_FREE_VRAM_MB are free. Models in use
+    are never evicted; if none is idle, loading waits for one to be released.
+    """
+
+    def __init__(self, models: dict, default: str, max_loaded: int, min_free_vram_mb):
+        self.models = models  # name -> model size, Hugging Face ID or path
+        self.default = default
+        self.max_loaded = max(1, max_loaded)
+        self.min_free_vram = min_free_vram_mb * 2**20
+        self._loaded = OrderedDict()  # name -> (WhisperModel, WhisperBatcher)
+        self._loading = set()
+        self._in_use = Counter()
+        self._condition = threading.Condition()
+
+    def resolve(self, name: Optional[str] = None) -> str:
+        name = name or self.default
+        if name not in self.models:
+            raise ValueError(
+                f"Unknown model {name!r}, available: {', '.join(self.models)}"
+            )
+        return name
+
+    @contextmanager
+    def use(self, name: Optional[str] = None):
+        """Yields the (model, batcher) pair of a model, loading it if needed."""
+        name = self.resolve(name)
+        entry = self._acquire(name)
+        try:
+            yield entry
+        finally:
+            with self._condition:
+                self._in_use[name] -= 1
+                self._condition.notify_all()
+
+    def _acquire(self, name: str):
+        with self._condition:
+            while True:
+                if name in self._loaded:
+                    self._loaded.move_to_end(name)
+                    self._in_use[name] += 1
+                    return self._loaded[name]
+                if name not in self._loading:
+                    self._make_room()
+                    if len(self._loaded) + len(self._loading) < self.max_loaded:
+                        self._loading.add(name)
+                        break
+                self._condition.wait()
+
+        try:
+            entry = self._load(name)
+        finally:
+            with self._condition:
+                self._loading.discard(name)
+                self._condition.notify_all()
+        with self._condition:
+            self._loaded[name] = entry
+            self._in_use[name] += 1
+        return entry
+
+    def _needs_room(self) -> bool:
+        if len(self._loaded) + len(self._loading) >= self.max_loaded:
+            return True
+        if self.min_free_vram and whisper_device == "cuda":
+            free, _ = torch.cuda.mem_get_info(whisper_device_index)
+            return free < self.min_free_vram
+        return False
+
+    def _make_room(self):
+        for name in list(self._loaded):
+            if not self._needs_room():
+                return
+            if self._in_use[name]:
+                continue
+            model, batcher = self._loaded.pop(name)
+            if batcher is not None:
+                batcher.stop()
+            del model, batcher
+            gc.collect()
+            logger.info("Evicted %s", name)
+
+    def _load(self, name: str):
+        model = WhisperModel(
+            whisper_model_path(self.models[name]),
+            device=whisper_device,
+            device_index=whisper_device_index,
+            compute_type=whisper_compute_type,
+            cpu_threads=whisper_cpu_threads,
+            num_workers=int(os.getenv("WHISPER_NUM_WORKERS", "1")),
+        )
+        logger.info(
+            "Loaded %s on %s:%d with compute type %s",
+            self.models[name],
+            whisper_device,
+            whisper_device_index,
+            whisper_compute_type,
+        )
+        batcher = None
+        if whisper_batch_size > 0:
+            batcher = WhisperBatcher(
+                model, whisper_batch_size, whisper_batch_window_ms
+            )
+        return model, batcher
+
+
+def parse_models(value: str) -> dict:
+    """Parses WHISPER_MODELS, a comma-separated list of `model` or `name=model`."""
+    models = {}
+    for entry in value.split(","):
+        name, _, model = entry.strip().rpartition("=")
+        if model:
+            models[name or model] = model
+    return models
+
+
+whisper_models = WhisperModels(
+    {model_name: model_name, **parse_models(os.getenv("WHISPER_MODELS", ""))},
+    default=model_name,
+    max_loaded=int(os.getenv("WHISPER_MAX_LOADED_MODELS", "2")),
+    min_free_vram_mb=float(os.getenv("WHISPER_MIN_FREE_VRAM_MB", "0")),
+)
+
+
+def artifact_dir_name(model: str) -> str:
+    """The directory of a model in MODEL_CACHE_DIR, e.g. NbAiLab--nb-whisper-large."""
+    return re.sub(r"[^\w.-]+", "--", model)
+
+
+def stage_artifacts(name: str, marker: str) -> Optional[str]:
+    """
+    Returns the local directory of the artifacts `name` in MODEL_CACHE_DIR, copying
+    them from MODEL_ARTIFACTS_S3_URI first if they are not there yet, or None if
+    neither has them. `marker` is a file every complete copy contains.
+    """
+    path = os.path.join(model_cache_dir, name)
+    if os.path.exists(os.path.join(path, marker)):
+        return path
+    if not model_artifacts_s3_uri.startswith("s3://"):
+        return None
+
+    from boto3.s3.transfer import TransferConfig
+
+    bucket, _, prefix = model_artifacts_s3_uri[len("s3://") :].partition("/")
+    prefix = f"{prefix}/{name}/".lstrip("/")
+    client = get_s3_client()
+    keys = [
+        item["Key"]
+        for page in client.get_paginator("list_objects_v2").paginate(
+            Bucket=bucket, Prefix=prefix
+        )
+        for item in page.get("Contents", [])
+        if not item["Key"].endswith("/")
+    ]
+    if prefix + marker not in keys:
+        return None
+
+    # Files are downloaded next to the final directory and moved into place at the
+    # end, so an interrupted copy is never mistaken for a complete one.
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    staging = tempfile.mkdtemp(dir=os.path.dirname(path), prefix=".staging-")
+    config = TransferConfig(
+        multipart_threshold=download_part_bytes,
+        multipart_chunksize=download_part_bytes,
+        max_concurrency=download_concurrency,
+    )
+    try:
+        for key in keys:
+            target = os.path.join(staging, key[len(prefix) :])
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            client.download_file(bucket, key, target, Config=config)
+        os.rename(staging, path)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    logger.info("Staged %s from s3://%s/%s", name, bucket, prefix)
+    return path
+
+
+def whisper_model_path(model: str) -> str:
+    """The local CTranslate2 directory of a Whisper model, if one is available."""
+    if os.path.isdir(model):
+        return model
+    return stage_artifacts(f"whisper/{artifact_dir_name(model)}", "model.bin") or model
+
+
+def diarization_pipeline_path() -> str:
+    """
+    The config.yaml of a local copy of the diarization pipeline, if one is
+    available. Its checkpoints are stored next to it; pyannote resolves checkpoint
+    paths against the working directory, so they are made absolute in a copy of the
+    config.
+    """
+    path = stage_artifacts("pyannote", "config.yaml")
+    if path is None:
+        return DIARIZATION_PIPELINE
+    with open(os.path.join(path, "config.yaml")) as f:
+        config = yaml.safe_load(f)
+    params = config["pipeline"]["params"]
+    for name in ("segmentation", "embedding"):
+        checkpoint = os.path.join(path, params[name])
+        if os.path.isfile(checkpoint):
+            params[name] = checkpoint
+    resolved = os.path.join(path, "config.local.yaml")
+    with open(resolved, "w") as f:
+        yaml.safe_dump(config, f)
+    return resolved
+
+
+def process_seconds() -> Optional[float]:
+    """Seconds since the process started, including interpreter and import time."""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return None
+    return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+
+
+class Startup:
+    """
+    Loads the default Whisper model and the diarization pipeline in the background
+    once the server is up, so the port is bound and /health answers right away.
+    Both are staged and loaded on their own thread; CTranslate2 and PyTorch release
+    the GIL while reading and copying weights, so the loads overlap. /ready reports
+    the outcome and how long each phase took.
+    """
+
+    def __init__(self):
+        self.ready = threading.Event()
+        self.error: Optional[str] = None
+        self.timings = {}
+        self.ready_at: Optional[float] = None
+        self._started = None
+
+    def start(self):
+        boot_seconds = process_seconds()
+        if boot_seconds is not None:
+            # Interpreter start, imports and module setup, before the port is bound.
+            self.timings["boot_seconds"] = round(boot_seconds, 3)
+        self._started = time.time()
+        threading.Thread(target=self._run, name="startup", daemon=True).start()
+
+    @contextmanager
+    def _phase(self, name: str):
+        time_start = time.time()
+        yield
+        seconds = time.time() - time_start
+        self.timings[f"{name}_seconds"] = round(seconds, 3)
+        logger.info("Startup phase %s took %.1fs", name, seconds)
+
+    def _load_whisper(self):
+        with self._phase("stage_whisper"):
+            whisper_model_path(whisper_models.models[whisper_models.default])
+        with self._phase("load_whisper"):
+            with whisper_models.use():
+                pass
+
+    def _load_diarization(self):
+        global diarization_model, diarization_cluster_threshold
+        with self._phase("stage_diarization"):
+            path = diarization_pipeline_path()
+        with self._phase("load_diarization"):
+            pipeline = Pipeline.from_pretrained(path, use_auth_token="")
+            pipeline.to(torch.device(diarization_device))
+        if diarization_cluster_threshold is None:
+            diarization_cluster_threshold = pipeline.clustering.threshold
+        diarization_model = pipeline
+
+    def _start_workers(self):
+        with self._phase("start_workers"):
+            worker_pool.start()
+
+    def _run(self):
+        if worker_pool is not None:
+            loaders = [self._start_workers]
+        else:
+            loaders = [self._load_whisper, self._load_diarization]
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="startup") as pool:
+            futures = [pool.submit(loader) for loader in loaders]
+            try:
+                for future in futures:
+                    future.result()
+            except Exception as e:
+                logger.exception("Failed to load the models")
+                self.error = str(e)
+                return
+        self.timings["models_seconds"] = round(time.time() - self._started, 3)
+        if "boot_seconds" in self.timings:
+            self.timings["total_seconds"] = round(
+                self.timings["boot_seconds"] + self.timings["models_seconds"], 3
+            )
+        self.ready_at = time.time()
+        self.ready.set()
+        logger.info("Ready after %s", self.timings)
+
+    def check(self):
+        """Raises 503 until the models are loaded."""
+        if self.ready.is_set():
+            return
+        detail = "Models are still loading"
+        if self.error:
+            detail = f"Failed to load the models: {self.error}"
+        raise HTTPException(
+            status_code=503, detail=detail, headers={"Retry-After": "10"}
+        )
+
+
+startup = Startup()
+
+
+# Live transcription (/live). Live decoding runs on its own threads instead of the
+# GPU queue, so captions do not wait behind batch jobs; LIVE_MAX_SESSIONS bounds
+# how many streams share the GPU with them.
+live_max_sessions = int(os.getenv("LIVE_MAX_SESSIONS", "4"))
+live_step_ms = int(os.getenv("LIVE_STEP_MS", "1000"))
+live_min_silence_ms = int(os.getenv("LIVE_MIN_SILENCE_MS", "500"))
+live_max_utterance_seconds = float(os.getenv("LIVE_MAX_UTTERANCE_SECONDS", "15"))
+live_executor = ThreadPoolExecutor(
+    max_workers=live_max_sessions, thread_name_prefix="live"
+)
+live_sessions = 0
+
+
+class LiveTranscriber:
+    """
+    Incremental transcription of a live audio stream.
+
+    Audio is kept from the start of the current utterance. Until Silero VAD sees
+    the utterance end, it is re-decoded on every step, and the words that two
+    consecutive hypotheses agree on form the stable prefix of the partial
+    transcript. An utterance becomes final after LIVE_MIN_SILENCE_MS of silence.
+    To bound latency, an utterance longer than LIVE_MAX_UTTERANCE_SECONDS commits
+    its stable prefix early. Final utterances are labelled with a speaker by
+    matching their pyannote embedding against the speakers seen so far.
+    """
+
+    def __init__(self, language=None, prompt=None, num_speakers=None, model=None):
+        self.model = whisper_models.resolve(model)
+        self.language = language
+        self.context = prompt or ""
+        self.audio = np.zeros(0, dtype=np.float32)
+        self.offset = 0  # samples dropped from the start of the stream
+        self.hypothesis = []
+        self.speakers = OnlineSpeakers(diarization_cluster_threshold, num_speakers)
+        self.speaker = None
+        self.vad_options = VadOptions(
+            min_silence_duration_ms=live_min_silence_ms, speech_pad_ms=100
+        )
+
+    def append(self, samples: np.ndarray):
+        self.audio = np.concatenate([self.audio, samples])
+
+    def _drop(self, samples: int):
+        self.audio = self.audio[samples:]
+        self.offset += samples
+
+    def _time(self, seconds: float) -> float:
+        return round(self.offset / SAMPLE_RATE + seconds, 3)
+
+    @staticmethod
+    def _text(words) -> str:
+        return "".join(word.word for word in words).strip()
+
+    @staticmethod
+    def _normalize(word: str) -> str:
+        return re.sub(r"[^\w']", "", word.lower())
+
+    def _decode(self, audio: np.ndarray):
+        time_start = time.time()
+        with whisper_models.use(self.model) as (model, _):
+            segments, info = model.transcribe(
+                audio,
+                language=self.language,
+                initial_prompt=self.context[-200:] or None,
+                word_timestamps=True,
+                condition_on_previous_text=False,
+            )
+            words = [word for segment in segments for word in segment.words]
+        stage_seconds.labels("live_decode").observe(time.time() - time_start)
+        return words, info.language
+
+    def _speaker(self, audio: np.ndarray) -> Optional[str]:
+        # Utterances under a second give unreliable embeddings; they keep the
+        # previous speaker.
+        if len(audio) >= SAMPLE_RATE:
+            waveform = torch.from_numpy(np.ascontiguousarray(audio))[None, None]
+            with diarization_lock:
+                embedding = diarization_model._embedding(waveform)[0]
+            speaker = self.speakers.assign(embedding)
+            if speaker is not None:
+                self.speaker = speaker
+        return self.speaker
+
+    def _final(self, words, language: str, end: int) -> list:
+        """Commits `words` and drops the first `end` samples of the buffer."""
+        events = []
+        if words:
+            # The language detected on the first utterance is kept for the session.
+            self.language = self.language or language
+            text = self._text(words)
+            self.context = f"{self.context} {text}"[-1000:]
+            events.append(
+                {
+                    "type": "final",
+                    "start": self._time(words[0].start),
+                    "end": self._time(words[-1].end),
+                    "speaker": self._speaker(self.audio[:end]),
+                    "text": text,
+                    "words": [
+                        {
+                            "start": self._time(word.start),
+                            "end": self._time(word.end),
+                            "word": word.word.strip(),
+                            "probability": word.probability,
+                        }
+                        for word in words
+                    ],
+                }
+            )
+        self._drop(max(1, end))
+        self.hypothesis = []
+        return events
+
+    def process(self, final: bool = False) -> list:
+        """
+        Decodes the buffered audio and returns the resulting events. With `final`,
+        everything left in the buffer is committed.
+        """
+        events = []
+        while True:
+            speech = get_speech_timestamps(self.audio, self.vad_options)
+            if not speech:
+                # Keep half a second so the onset of the next word is not lost.
+                keep = 0 if final else SAMPLE_RATE // 2
+                self._drop(max(0, len(self.audio) - keep))
+                return events
+
+            self._drop(speech[0]["start"])
+            end = speech[0]["end"] - speech[0]["start"]
+            if final or len(speech) > 1 or end < len(self.audio):
+                # The VAD closed the first speech region: the speaker paused.
+                words, language = self._decode(self.audio[:end])
+                events += self._final(words, language, end)
+                continue
+
+            words, language = self._decode(self.audio)
+            agreed = 0
+            for previous, current in zip(self.hypothesis, words):
+                if self._normalize(previous.word) != self._normalize(current.word):
+                    break
+                agreed += 1
+            self.hypothesis = words
+
+            max_samples = live_max_utterance_seconds * SAMPLE_RATE
+            if len(self.audio) > max_samples and agreed:
+                committed = words[:agreed]
+                end = int(committed[-1].end * SAMPLE_RATE)
+                return events + self._final(committed, language, end)
+            if len(self.audio) > 2 * max_samples:
+                # No agreement for too long; commit the latest hypothesis.
+                return events + self._final(words, language, len(self.audio))
+
+            if words:
+                events.append(
+                    {
+                        "type": "partial",
+                        "start": self._time(words[0].start),
+                        "end": self._time(words[-1].end),
+                        "stable": self._text(words[:agreed]),
+                        "unstable": self._text(words[agreed:]),
+                    }
+                )
+            return events
+
+
+class GPUWorkQueue:
+    """
+    Bounded FIFO in front of the models.
+
+    Jobs are executed on `workers` dedicated threads (one unless micro-batching is
+    enabled), so the event loop stays free for downloads, decoding and /health
+    while the GPU is busy. When the queue is full, submissions are rejected with
+    429 and a Retry-After estimate based on the recent average job duration.
+    """
+
+    def __init__(self, maxsize: int, workers: int = 1):
+        self.maxsize = maxsize
+        self.workers = workers
+        self.avg_job_seconds = 30.0
+        self._queue = None
+        self._worker_tasks = []
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="gpu"
+        )
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def full(self) -> bool:
+        return self._queue is not None and self._queue.full()
+
+    def retry_after(self) -> int:
+        return max(
+            1, math.ceil((self.depth + 1) * self.avg_job_seconds / self.workers)
+        )
+
+    def rejected(self) -> HTTPException:
+        return HTTPException(
+            status_code=429,
+            detail="Server is busy, GPU work queue is full",
+            headers={"Retry-After": str(self.retry_after())},
+        )
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._worker_tasks = [
+            asyncio.create_task(self._run()) for _ in range(self.workers)
+        ]
+
+    async def stop(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+
+    async def submit(self, fn, *args, wait: bool = False, **kwargs):
+        """
+        Runs `fn(*args, **kwargs)` on the GPU thread and returns its result. If the
+        queue is full, waits for room when `wait` is set and raises 429 otherwise.
+        """
+        future = asyncio.get_running_loop().create_future()
+        # Run in the caller's context, so tracing spans nest under its request.
+        job = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+        item = (job, future)
+        if wait:
+            await self._queue.put(item)
+        else:
+            try:
+                self._queue.put_nowait(item)
+            except asyncio.QueueFull:
+                raise self.rejected()
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job, future = await self._queue.get()
+            try:
+                if future.cancelled():
+                    # The client went away while the job was waiting.
+                    continue
+                time_start = time.time()
+                try:
+                    result = await loop.run_in_executor(self._executor, job)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+                elapsed = time.time() - time_start
+                self.avg_job_seconds = 0.8 * self.avg_job_seconds + 0.2 * elapsed
+            finally:
+                self._queue.task_done()
+
+
+def is_out_of_memory(error: Exception) -> bool:
+    """CUDA out-of-memory errors of PyTorch and CTranslate2."""
+    if isinstance(error, torch.cuda.OutOfMemoryError):
+        return True
+    return isinstance(error, RuntimeError) and "out of memory" in str(error).lower()
+
+
+@contextmanager
+def environment(**values):
+    """Temporarily sets environment variables, e.g. for a child process to inherit."""
+    previous = {name: os.environ.get(name) for name in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def run_model_worker(connection):
+    """
+    Entry point of a model worker process. Loads the models, then runs the
+    speech_to_text calls the API process sends over `connection` on GPU_WORKERS
+    threads, streaming progress and segments back. After a CUDA out-of-memory
+    error the API process stops sending work and asks the worker to drain: the
+    calls it already accepted finish, then the process exits and is replaced.
+    """
+    # Ctrl+C reaches the whole process group; the API process stops the workers.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    send_lock = threading.Lock()
+
+    def send(*message):
+        with send_lock:
+            connection.send(message)
+
+    startup.start()
+    while not startup.ready.wait(1):
+        if startup.error:
+            send("failed", startup.error)
+            return
+    send("ready", startup.timings)
+
+    def run(call_id, audio, kwargs, report_progress, stream):
+        timings = {}
+        progress = functools.partial(send, "progress", call_id)
+        on_segment = functools.partial(send, "segment", call_id)
+        try:
+            with PeakMemory() as memory:
+                result = speech_to_text(
+                    audio,
+                    timings=timings,
+                    progress=progress if report_progress else None,
+                    on_segment=on_segment if stream else None,
+                    **kwargs,
+                )
+        except Exception as e:
+            logger.exception("Model worker call failed")
+            send("error", call_id, f"{type(e).__name__}: {e}", is_out_of_memory(e))
+        else:
+            send("result", call_id, result, timings, memory.report())
+
+    with ThreadPoolExecutor(max_workers=gpu_workers, thread_name_prefix="gpu") as pool:
+        while True:
+            try:
+                message = connection.recv()
+            except EOFError:
+                break
+            if message is None:
+                break
+            pool.submit(run, *message)
+    logger.info("Model worker on cuda:%s stopped", model_worker_device)
+
+
+def worker_unavailable(detail: str = "No model worker is available") -> HTTPException:
+    return HTTPException(
+        status_code=503, detail=detail, headers={"Retry-After": "30"}
+    )
+
+
+# Consecutive exits after which a model worker is given up on. Restarts back off
+# exponentially, up to a minute apart; a completed call resets the count.
+model_worker_max_restarts = int(os.getenv("MODEL_WORKER_MAX_RESTARTS", "5"))
+
+
+class ModelWorker:
+    """
+    A model worker process on one GPU and the calls it is running. A reader thread
+    completes the calls from the worker's messages. A worker that exits after an
+    out-of-memory error or a crash fails its unfinished calls with 503 and is
+    started again, with backoff; one that fails to load its models, or keeps
+    exiting, stays down.
+    """
+
+    # Workers read their device from the environment they inherit.
+    _start_lock = threading.Lock()
+
+    def __init__(self, device: int):
+        self.device = device
+        self.accepting = False
+        self.restarts = 0
+        self.timings = {}
+        self.error: Optional[str] = None
+        self.loaded = threading.Event()
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._connection = None
+        self._process = None
+        self._draining = False
+        self._failures = 0
+        self._restarting = False
+        self._stopping = threading.Event()
+
+    @property
+    def load(self) -> int:
+        return len(self._calls)
+
+    def start(self):
+        self.loaded.clear()
+        self.error = None
+        self._draining = False
+        context = multiprocessing.get_context("spawn")
+        connection, child_connection = context.Pipe()
+        device = str(self.device)
+        with self._start_lock, environment(
+            MODEL_WORKER_DEVICE=device, WHISPER_DEVICE_INDEX=device
+        ):
+            self._process = context.Process(
+                target=run_model_worker,
+                args=(child_connection,),
+                name=f"model-worker-{device}",
+                daemon=True,
+            )
+            self._process.start()
+        child_connection.close()
+        self._connection = connection
+        threading.Thread(
+            target=self._read,
+            args=(self._process, connection),
+            name=f"model-worker-{device}",
+            daemon=True,
+        ).start()
+        logger.info("Started model worker %d on cuda:%s", self._process.pid, device)
+
+    def stop(self, timeout: float = 30):
+        self._stopping.set()
+        self.drain()
+        if self._process is not None:
+            self._process.join(timeout)
+            if self._process.is_alive():
+                self._process.kill()
+
+    def drain(self):
+        """Stops sending calls to the worker and lets it exit once they finish."""
+        with self._lock:
+            self.accepting = False
+            if self._draining:
+                return
+            self._draining = True
+            try:
+                self._connection.send(None)
+            except OSError:
+                pass
+
+    def submit(
+        self, audio, kwargs: dict, timings: dict, memory: dict, progress, on_segment
+    ):
+        """
+        Sends a speech_to_text call and returns a Future of its result. The
+        worker's timings and peak memory during the call are added to `timings`
+        and `memory`.
+        """
+        call_id = uuid.uuid4().hex
+        # The callbacks are keyed by the kind of message they receive.
+        call = dict(
+            future=Future(),
+            timings=timings,
+            memory=memory,
+            progress=progress,
+            segment=on_segment,
+        )
+        with self._lock:
+            if not self.accepting:
+                raise worker_unavailable()
+            self._calls[call_id] = call
+            try:
+                self._connection.send(
+                    (call_id, audio, kwargs, bool(progress), bool(on_segment))
+                )
+            except OSError:
+                self._calls.pop(call_id)
+                raise worker_unavailable()
+        return call["future"]
+
+    def _read(self, process, connection):
+        while True:
+            try:
+                message = connection.recv()
+            except (EOFError, OSError):
+                break
+            self._handle(*message)
+        process.join()
+        connection.close()
+        self._exited(process.exitcode)
+
+    def _handle(self, kind, *args):
+        if kind == "ready":
+            self.timings = args[0]
+            with self._lock:
+                self.accepting = True
+            self.loaded.set()
+            logger.info("Model worker on cuda:%d is ready", self.device)
+        elif kind == "failed":
+            self.error = args[0]
+            self.loaded.set()
+        elif kind in ("progress", "segment"):
+            callback = self._calls.get(args[0], {}).get(kind)
+            if callback:
+                callback(*args[1:])
+        elif kind == "result":
+            call_id, result, timings, memory = args
+            self._failures = 0
+            call = self._pop_call(call_id)
+            if call is None:
+                return
+            call["timings"].update(timings)
+            call["memory"].update(memory)
+            call["future"].set_result(result)
+        elif kind == "error":
+            call_id, error, out_of_memory = args
+            call = self._pop_call(call_id)
+            if call is None:
+                return
+            if out_of_memory:
+                logger.warning("Model worker on cuda:%d ran out of memory", self.device)
+                self.drain()
+                call["future"].set_exception(
+                    worker_unavailable(f"GPU out of memory: {error}")
+                )
+            else:
+                call["future"].set_exception(RuntimeError(error))
+
+    def _pop_call(self, call_id: str) -> Optional[dict]:
+        # None for calls that _exited has already failed.
+        with self._lock:
+            return self._calls.pop(call_id, None)
+
+    def _exited(self, exitcode):
+        with self._lock:
+            self.accepting = False
+            calls, self._calls = self._calls, {}
+        for call in calls.values():
+            call["future"].set_exception(worker_unavailable("The model worker exited"))
+        self.loaded.set()
+        if self._stopping.is_set():
+            return
+        self._failures += 1
+        if not self.error and self._failures > model_worker_max_restarts:
+            self.error = f"Exited {self._failures} times in a row, last code {exitcode}"
+        if self.error:
+            logger.error("Model worker on cuda:%d failed: %s", self.device, self.error)
+            return
+        delay = min(60, 2 ** (self._failures - 1))
+        logger.warning(
+            "Model worker on cuda:%d exited with code %s, restarting in %ds",
+            self.device,
+            exitcode,
+            delay,
+        )
+        self._restarting = True
+        if self._stopping.wait(delay):
+            return
+        self._restarting = False
+        self.restarts += 1
+        self.start()
+
+    def report(self) -> dict:
+        if self.accepting:
+            state = "ready"
+        elif self.error:
+            state = "failed"
+        elif self._stopping.is_set():
+            state = "stopped"
+        elif self._restarting:
+            state = "restarting"
+        else:
+            state = "starting" if not self.loaded.is_set() else "draining"
+        return {
+            "device": self.device,
+            "pid": self._process and self._process.pid,
+            "state": state,
+            "calls": self.load,
+            "restarts": self.restarts,
+            "error": self.error,
+            "timings": self.timings,
+        }
+
+
+class ModelWorkerPool:
+    """
+    The model workers of the API process in pool mode. The GPU queue still admits
+    and orders the requests; its threads hand every call to the worker with the
+    fewest calls in flight and wait for the result.
+    """
+
+    def __init__(self, devices: List[int]):
+        self.workers = [ModelWorker(device) for device in devices]
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Starts the workers and waits until they have loaded their models."""
+        for worker in self.workers:
+            worker.start()
+        for worker in self.workers:
+            worker.loaded.wait()
+        errors = [f"cuda:{w.device}: {w.error}" for w in self.workers if w.error]
+        if errors:
+            raise RuntimeError("; ".join(errors))
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+
+    def speech_to_text(
+        self,
+        audio,
+        timings=None,
+        progress=None,
+        on_segment=None,
+        memory=None,
+        **kwargs,
+    ):
+        """
+        Runs speech_to_text on the least busy worker, see speech_to_text. The
+        worker's PeakMemory report for the call is added to `memory`.
+        """
+        if timings is None:
+            timings = {}
+        if memory is None:
+            memory = {}
+        with self._lock:
+            available = [worker for worker in self.workers if worker.accepting]
+            if not available:
+                raise worker_unavailable()
+            worker = min(available, key=lambda worker: worker.load)
+            future = worker.submit(
+                audio, kwargs, timings, memory, progress, on_segment
+            )
+        return future.result()
+
+    def report(self) -> list:
+        return [worker.report() for worker in self.workers]
+
+
+class LoadStats:
+    """
+    The backlog and speed of this instance, reported on /stats for the
+    orchestrator's autoscaler. The backlog is the audio of every unfinished
+    prediction: its decoded duration once known, the recent average duration of a
+    request before that. The speed is the recent average of audio seconds
+    processed per second of speech_to_text on one GPU worker.
+    """
+
+    def __init__(self):
+        self.avg_audio_seconds = float(os.getenv("STATS_DEFAULT_AUDIO_SECONDS", "600"))
+        self.speed: Optional[float] = None
+        self.last_active = time.time()
+        self._requests = []
+
+    @contextmanager
+    def track(self):
+        """Counts a prediction as in flight; yields a dict to record its duration."""
+        request = {"audio_seconds": None}
+        self._requests.append(request)
+        try:
+            yield request
+        finally:
+            self._requests.remove(request)
+            self.last_active = time.time()
+
+    def record(self, audio_seconds: float, processing_seconds: Optional[float]):
+        self.avg_audio_seconds = 0.8 * self.avg_audio_seconds + 0.2 * audio_seconds
+        if processing_seconds:
+            speed = audio_seconds / processing_seconds
+            self.speed = speed if self.speed is None else 0.8 * self.speed + 0.2 * speed
+
+    def report(self, queued_jobs: int = 0) -> dict:
+        backlog = sum(
+            request["audio_seconds"] or self.avg_audio_seconds
+            for request in self._requests
+        )
+        backlog += queued_jobs * self.avg_audio_seconds
+        busy = self._requests or queued_jobs
+        return {
+            "in_flight": len(self._requests),
+            "queued_jobs": queued_jobs,
+            "backlog_audio_seconds": round(backlog, 1),
+            "speed": self.speed and round(self.speed, 2),
+            "idle_seconds": 0.0 if busy else round(time.time() - self.last_active, 1),
+        }
+
+
+class LocalResultStore:
+    """Stores job records as JSON files in a local directory."""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, job_id: str) -> str:
+        return os.path.join(self.path, f"{job_id}.json")
+
+    def put(self, job_id: str, record: dict):
+        # Write to a temporary file first so readers never see a partial record.
+        temp_file = self._file(job_id) + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(record, f)
+        os.replace(temp_file, self._file(job_id))
+
+    def get(self, job_id: str) -> Optional[dict]:
+        try:
+            with open(self._file(job_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+
+class S3ResultStore:
+    """
+    Stores job records as JSON objects in S3. S3_ENDPOINT_URL can point the client
+    at an S3-compatible stand-in (e.g. moto server or MinIO) for local testing.
+    """
+
+    def __init__(self, bucket: str, prefix: str = ""):
+        import boto3
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=os.getenv("S3_ENDPOINT_URL"))
+
+    def _key(self, job_id: str) -> str:
+        return f"{self.prefix}{job_id}.json"
+
+    def put(self, job_id: str, record: dict):
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self._key(job_id),
+            Body=json.dumps(record).encode(),
+            ContentType="application/json",
+        )
+
+    def get(self, job_id: str) -> Optional[dict]:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(job_id))
+        except self.client.exceptions.NoSuchKey:
+            return None
+        return json.loads(response["Body"].read())
+
+
+def create_result_store():
+    backend = os.getenv("RESULT_STORE", "local")
+    if backend == "local":
+        return LocalResultStore(os.getenv("RESULT_STORE_PATH", "results"))
+    if backend == "s3":
+        return S3ResultStore(
+            os.environ["RESULT_STORE_BUCKET"], os.getenv("RESULT_STORE_PREFIX", "jobs/")
+        )
+    raise ValueError(f"Unknown RESULT_STORE backend: {backend}")
+
+
+class DiskCache:
+    """
+    Size-bounded cache of JSON values in a local directory. File modification times
+    double as access times, so the least recently used entries are evicted first.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._sizes = {
+            entry.name: entry.stat().st_size
+            for entry in os.scandir(path)
+            if entry.name.endswith(".json")
+        }
+        self._total = sum(self._sizes.values())
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.json")
+
+    def has(self, key: str) -> bool:
+        return os.path.exists(self._file(key))
+
+    def get(self, key: str):
+        try:
+            with open(self._file(key)) as f:
+                value = json.load(f)
+            os.utime(self._file(key))
+        except FileNotFoundError:
+            return None
+        return value
+
+    def put(self, key: str, value):
+        data = json.dumps(value).encode()
+        if len(data) > self.max_bytes:
+            return
+        # Write to a temporary file first so readers never see a partial entry.
+        temp_file = f"{self._file(key)}.{uuid.uuid4().hex}.tmp"
+        with open(temp_file, "wb") as f:
+            f.write(data)
+        os.replace(temp_file, self._file(key))
+        with self._lock:
+            name = f"{key}.json"
+            self._total += len(data) - self._sizes.get(name, 0)
+            self._sizes[name] = len(data)
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Evict down to 90% of the limit so that eviction does not run on every put.
+        target = 0.9 * self.max_bytes
+        entries = []
+        for name in self._sizes:
+            try:
+                entries.append((os.path.getmtime(os.path.join(self.path, name)), name))
+            except FileNotFoundError:
+                entries.append((0.0, name))
+        for _, name in sorted(entries):
+            if self._total <= target:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+            self._total -= self._sizes.pop(name)
+
+
+class S3Cache:
+    """Cache of JSON values in S3, shared by all instances of the service."""
+
+    def __init__(self, bucket: str, prefix: str = ""):
+        import boto3
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=os.getenv("S3_ENDPOINT_URL"))
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}{key}.json"
+
+    def get(self, key: str):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(key))
+        except self.client.exceptions.NoSuchKey:
+            return None
+        return json.loads(response["Body"].read())
+
+    def put(self, key: str, value):
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self._key(key),
+            Body=json.dumps(value).encode(),
+            ContentType="application/json",
+        )
+
+
+class CacheMiss(Exception):
+    """A stage was run without audio and its result was no longer cached."""
+
+
+class ResultCache:
+    """
+    Caches intermediate pipeline results on local disk, optionally backed by a
+    shared cache. Shared hits are copied to the local cache. Cache errors are
+    logged and treated as misses: the cache must never fail a request.
+    """
+
+    def __init__(self, local: Optional[DiskCache], shared: Optional[S3Cache] = None):
+        self.local = local
+        self.shared = shared
+
+    def has(self, key: str) -> bool:
+        if self.local is None:
+            return self.get(key) is not None
+        return self.local.has(key) or self.get(key) is not None
+
+    def get(self, key: str):
+        for cache in (self.local, self.shared):
+            if cache is None:
+                continue
+            try:
+                value = cache.get(key)
+            except Exception as e:
+                logger.warning("Cache read of %s failed: %s", key, e)
+                continue
+            if value is not None:
+                if cache is self.shared and self.local is not None:
+                    self.local.put(key, value)
+                return value
+        return None
+
+    def put(self, key: str, value):
+        for cache in (self.local, self.shared):
+            if cache is None:
+                continue
+            try:
+                cache.put(key, value)
+            except Exception as e:
+                logger.warning("Cache write of %s failed: %s", key, e)
+
+
+def create_result_cache() -> Optional[ResultCache]:
+    max_bytes = int(float(os.getenv("CACHE_MAX_MB", "2048")) * 1024 * 1024)
+    local = DiskCache(os.getenv("CACHE_DIR", "cache"), max_bytes) if max_bytes else None
+    shared = None
+    if os.getenv("CACHE_S3_BUCKET"):
+        shared = S3Cache(
+            os.environ["CACHE_S3_BUCKET"], os.getenv("CACHE_S3_PREFIX", "cache/")
+        )
+    if local is None and shared is None:
+        return None
+    return ResultCache(local, shared)
+
+
+def make_cache_key(stage: str, audio_hash: str, **params) -> str:
+    """
+    Builds the cache key of a pipeline stage from the hash of the input audio and
+    every parameter that affects the stage output.
+    """
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+    return f"{audio_hash}-{stage}-{digest[:16]}"
+
+
+def transcription_key(audio_hash: str, predict_request: PredictRequest) -> str:
+    return make_cache_key(
+        "transcription",
+        audio_hash,
+        model=whisper_models.models[predict_request.model],
+        compute_type=whisper_compute_type,
+        batched=whisper_batch_size > 0,
+        prompt=predict_request.prompt,
+        language=predict_request.language,
+        translate=predict_request.translate,
+        word_timestamps=True,
+        vad=vad_parameters(predict_request),
+    )
+
+
+def diarization_key(audio_hash: str, predict_request: PredictRequest) -> str:
+    return make_cache_key(
+        "diarization",
+        audio_hash,
+        pipeline=DIARIZATION_PIPELINE,
+        num_speakers=predict_request.num_speakers,
+        long_form_seconds=long_form_diarization_seconds,
+        window_seconds=diarization_window_seconds,
+        window_overlap_seconds=diarization_window_overlap_seconds,
+        # None stands for the default threshold of DIARIZATION_PIPELINE.
+        cluster_threshold=cluster_threshold_setting,
+        vad=vad_parameters(predict_request),
+    )
+
+
+worker_pool = ModelWorkerPool(worker_devices) if worker_devices else None
+# In pool mode every model worker runs GPU_WORKERS calls at a time.
+gpu_queue = GPUWorkQueue(
+    maxsize=int(os.getenv("GPU_QUEUE_SIZE", str(8 * max(1, len(worker_devices))))),
+    workers=gpu_workers * max(1, len(worker_devices)),
+)
+result_store = create_result_store()
+result_cache = create_result_cache()
+load_stats = LoadStats()
+
+# Jobs that have not finished yet; finished jobs live in the result store.
+jobs: Dict[str, dict] = {}
+job_tasks = set()
+max_pending_jobs = int(os.getenv("MAX_PENDING_JOBS", "100"))
+# Limits how many jobs download and hold decoded audio at the same time.
+job_slots = asyncio.Semaphore(gpu_queue.maxsize)
+
+# Downloads are streamed to temporary files in DOWNLOAD_DIR and capped at
+# MAX_DOWNLOAD_MB. Files larger than one DOWNLOAD_PART_MB part are fetched as ranges,
+# DOWNLOAD_CONCURRENCY at a time, when the origin (or S3) supports it.
+max_download_bytes = int(float(os.getenv("MAX_DOWNLOAD_MB", "4096")) * 2**20)
+download_part_bytes = int(float(os.getenv("DOWNLOAD_PART_MB", "16")) * 2**20)
+download_concurrency = int(os.getenv("DOWNLOAD_CONCURRENCY", "8"))
+download_dir = os.getenv("DOWNLOAD_DIR") or None
+download_read_timeout = float(os.getenv("DOWNLOAD_READ_TIMEOUT", "30"))
+http_session: Optional[aiohttp.ClientSession] = None
+s3_client = None
+
+# Prometheus metrics, exported on /metrics. Stage durations come from the same
+# timings the responses report.
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+stage_seconds = prometheus.Histogram(
+    "whisper_stage_seconds",
+    "Duration of a prediction stage",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+prediction_seconds = prometheus.Histogram(
+    "whisper_prediction_seconds",
+    "Duration of a prediction, including the download",
+    ["model"],
+    buckets=STAGE_BUCKETS,
+)
+predictions_total = prometheus.Counter(
+    "whisper_predictions_total",
+    "Finished predictions by outcome (HTTP status code)",
+    ["model", "status"],
+)
+audio_seconds_total = prometheus.Counter(
+    "whisper_audio_seconds_total",
+    "Seconds of audio decoded and processed",
+    ["model"],
+)
+http_requests_total = prometheus.Counter(
+    "whisper_http_requests_total",
+    "HTTP requests by route and status code",
+    ["method", "route", "status"],
+)
+prometheus.Gauge(
+    "whisper_gpu_queue_depth", "Predictions waiting for the GPU"
+).set_function(lambda: gpu_queue.depth)
+prometheus.Gauge("whisper_pending_jobs", "Jobs not finished yet").set_function(
+    lambda: len(jobs)
+)
+prometheus.Gauge("whisper_live_sessions", "Open /live sessions").set_function(
+    lambda: live_sessions
+)
+prometheus.Gauge(
+    "whisper_loaded_models", "Whisper models currently loaded"
+).set_function(lambda: len(whisper_models._loaded))
+prometheus.Gauge("whisper_ready", "1 once the models are loaded").set_function(
+    lambda: startup.ready.is_set()
+)
+gpu_memory_used_bytes = prometheus.Gauge(
+    "whisper_gpu_memory_used_bytes", "Memory in use on a CUDA device", ["device"]
+)
+for device in cuda_devices():
+    gpu_memory_used_bytes.labels(str(device)).set_function(
+        functools.partial(gpu_memory_used, device)
+    )
+
+
+def create_tracer():
+    """
+    Sets up OpenTelemetry tracing when OTEL_EXPORTER_OTLP_ENDPOINT is set. The SDK
+    and the OTLP exporter are optional dependencies; without them tracing stays off.
+    """
+    if not os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"):
+        return None
+    try:
+        from opentelemetry import trace
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+            OTLPSpanExporter,
+        )
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        logger.warning("Tracing needs opentelemetry-sdk and the OTLP exporter")
+        return None
+    # The service name and exporter settings are read from the OTEL_* variables.
+    provider = TracerProvider()
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    return trace.get_tracer(__name__)
+
+
+tracer = create_tracer()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """An OpenTelemetry span when tracing is enabled, a no-op otherwise."""
+    if tracer is None:
+        yield None
+        return
+    with tracer.start_as_current_span(name, attributes=attributes) as current:
+        yield current
+
+
+def traced(name: str):
+    """Runs the decorated function in a span called `name`."""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
 
+        return wrapper
 
-model_name = "large-v3"
-whisper_model = WhisperModel(
-    model_name,
-    device="cuda" if torch.cuda.is_available() else "cpu",
-    compute_type="float32",
-)
+    return decorator
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global http_session
+    # One pooled session for all downloads, so connections to the same origin are
+    # kept alive across requests. The read timeout applies between chunks, not to
+    # the whole transfer.
+    http_session = aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(sock_connect=10, sock_read=download_read_timeout),
+    )
+    gpu_queue.start()
+    startup.start()
+    yield
+    await gpu_queue.stop()
+    if worker_pool is not None:
+        await asyncio.to_thread(worker_pool.stop)
+    await http_session.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.middleware("http")
+async def count_requests(request: Request, call_next):
+    response = await call_next(request)
+    # The route template rather than the path, so job IDs do not become labels.
+    route = request.scope.get("route")
+    http_requests_total.labels(
+        request.method, route.path if route else "unmatched", response.status_code
+    ).inc()
+    return response
 
-diarization_model = Pipeline.from_pretrained(
-    "pyannote/speaker-diarization-3.1",
-    use_auth_token="",
-).to(torch.device("cuda"))
+
+# /metrics endpoint
+@app.get("/metrics")
+async def metrics():
+    return Response(
+        prometheus.generate_latest(), media_type=prometheus.CONTENT_TYPE_LATEST
+    )
 
 
 # /health endpoint
 @app.get("/health")
 async def health():
+    """Liveness: the server is up, the models may still be loading."""
+    if startup.error:
+        return JSONResponse(
+            status_code=500, content={"status": "failed", "error": startup.error}
+        )
     return {"status": "ok"}
 
 
-# /predict endpoint
-@app.post("/predict", response_model=Output)
-async def predict(request: Request, predict_request: PredictRequest):
-    logger.debug("Received predict request")
-    temp_wav_filename = f"temp-{time.time_ns()}.wav"
-    temp_input_filename = None
+# /ready endpoint
+@app.get("/ready")
+async def ready():
+    """Readiness: 200 once the models are loaded, with the startup timings."""
+    workers = {} if worker_pool is None else {"workers": worker_pool.report()}
+    if startup.ready.is_set():
+        return {"status": "ready", "timings": startup.timings, **workers}
+    return JSONResponse(
+        status_code=503,
+        content={
+            "status": "failed" if startup.error else "loading",
+            "error": startup.error,
+            "timings": startup.timings,
+            **workers,
+        },
+        headers={"Retry-After": "10"},
+    )
+
+
+# /stats endpoint
+@app.get("/stats")
+async def stats():
+    """
+    Load of this instance for the orchestrator's autoscaler. `capacity` is the
+    audio seconds the instance processes per second with all GPU workers busy,
+    null until a prediction has been measured. `ready_at` is the Unix time the
+    models finished loading, which the orchestrator turns into time-to-ready.
+    """
+    queued_jobs = sum(1 for job in jobs.values() if job["status"] == "queued")
+    report = load_stats.report(queued_jobs)
+    if live_sessions:
+        report["idle_seconds"] = 0.0
+    speed = report["speed"]
+    return {
+        "model": whisper_models.default,
+        "ready": startup.ready.is_set(),
+        "ready_at": startup.ready_at,
+        "queue_depth": gpu_queue.depth,
+        "queue_capacity": gpu_queue.maxsize,
+        "gpu_workers": gpu_queue.workers,
+        "capacity": speed and round(speed * gpu_queue.workers, 2),
+        "live_sessions": live_sessions,
+        **report,
+    }
+
+
+def parse_input(body: dict):
+    """
+    Extracts the `input` object of a request body and validates the prediction
+    options it carries.
+    """
+    if "input" not in body:
+        raise HTTPException(
+            status_code=400, detail="Missing 'input' field in request body"
+        )
+    input_data = body["input"]
+    startup.check()
     try:
-        body = await request.json()  # Extract JSON data manually
-        logger.debug("Received request body: %s", body)
+        predict_request = PredictRequest(**input_data)
+        predict_request.model = whisper_models.resolve(predict_request.model)
+    except (ValidationError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return input_data, predict_request
 
-        if "input" not in body:
-            raise HTTPException(
-                status_code=400, detail="Missing 'input' field in request body"
-            )
 
-        input_data = body["input"]
-        file_url = input_data.get("file_url")
-        file_from_json = input_data.get(
-            "file"
-        )  # If 'file' is a URL, handle it like file_url
+def check_download_size(size: Optional[int]):
+    if size is not None and size > max_download_bytes:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File is larger than {max_download_bytes // 2**20} MB",
+        )
 
-        logger.debug("file_url: %s", file_url)
-        logger.debug("file (from JSON): %s", file_from_json)
 
-        temp_input_filename = f"temp-{time.time_ns()}.input"
+async def write_body(response, fd: int, offset: int = 0) -> int:
+    """Streams a response body into `fd` at `offset`; returns the end offset."""
+    async for chunk in response.content.iter_chunked(1 << 20):
+        os.pwrite(fd, chunk, offset)
+        offset += len(chunk)
+        check_download_size(offset)
+    return offset
 
-        if file_url or file_from_json:
-            download_url = file_url if file_url else file_from_json
-            logger.debug("Downloading file from URL: %s", download_url)
 
-            headers = {"User-Agent": "FastAPI-File-Downloader"}
+async def fetch_range(url: str, fd: int, start: int, end: int, semaphore, headers):
+    async with semaphore:
+        async with http_session.get(
+            url, headers={**headers, "Range": f"bytes={start}-{end}"}
+        ) as response:
+            if response.status != 206:
+                raise HTTPException(
+                    status_code=400, detail="Failed to download file from URL"
+                )
+            if await write_body(response, fd, start) != end + 1:
+                raise HTTPException(
+                    status_code=400, detail="Incomplete download from URL"
+                )
 
-            response = requests.get(
-                download_url, headers=headers, timeout=10, allow_redirects=True
-            )
 
-            if response.status_code != 200:
-                logger.error("Failed to download file from URL: %s", download_url)
+def content_range_total(value: Optional[str]) -> Optional[int]:
+    """The length in a Content-Range header, None if missing or unknown (`*`)."""
+    total = (value or "").rsplit("/", 1)[-1].strip()
+    return int(total) if total.isdigit() else None
+
+
+async def download_http(url: str, path: str):
+    """
+    Streams `url` to `path`. The first request only asks for the first part: if
+    the origin answers with a range, the remaining parts are fetched in parallel,
+    otherwise the whole body is streamed from that first response.
+    """
+    headers = {"User-Agent": "FastAPI-File-Downloader"}
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        async with http_session.get(
+            url,
+            headers={**headers, "Range": f"bytes=0-{download_part_bytes - 1}"},
+            allow_redirects=True,
+        ) as response:
+            if response.status == 200:
+                check_download_size(response.content_length)
+                await write_body(response, fd)
+                return
+            if response.status != 206:
+                logger.error("Failed to download file from URL: %s", url)
                 raise HTTPException(
                     status_code=400, detail="Failed to download file from URL"
                 )
+            total = content_range_total(response.headers.get("Content-Range"))
+            if total is not None:
+                check_download_size(total)
+                # Ranged requests go to the final URL of a redirect (e.g. presigned).
+                url = str(response.url)
+                await write_body(response, fd)
 
-            with open(temp_input_filename, "wb") as f:
-                f.write(response.content)
-            logger.debug("File downloaded and saved as %s", temp_input_filename)
-
-            result = subprocess.run(
-                [
-                    "ffmpeg",
-                    "-i",
-                    temp_input_filename,
-                    "-ar",
-                    "16000",
-                    "-ac",
-                    "1",
-                    "-c:a",
-                    "pcm_s16le",
-                    temp_wav_filename,
-                ]
-            )
-            logger.debug("ffmpeg output: %s", result.stdout)
-            logger.debug("ffmpeg error: %s", result.stderr)
-            if result.returncode != 0:
-                raise RuntimeError(
-                    f"ffmpeg failed with return code {result.returncode}"
+        if total is None:
+            # The size is unknown, so download the whole file in a single request.
+            async with http_session.get(
+                url, headers=headers, allow_redirects=True
+            ) as response:
+                if response.status != 200:
+                    raise HTTPException(
+                        status_code=400, detail="Failed to download file from URL"
+                    )
+                await write_body(response, fd)
+            return
+
+        semaphore = asyncio.Semaphore(download_concurrency)
+        await asyncio.gather(
+            *(
+                fetch_range(
+                    url,
+                    fd,
+                    start,
+                    min(start + download_part_bytes, total) - 1,
+                    semaphore,
+                    headers,
                 )
-            if os.path.exists(temp_input_filename):
-                os.remove(temp_input_filename)
-                logger.debug("Temporary audio file removed")
-        else:
-            raise HTTPException(
-                status_code=400,
-                detail="Either 'file', 'file_url', or uploaded file must be provided",
+                for start in range(download_part_bytes, total, download_part_bytes)
             )
+        )
+    finally:
+        os.close(fd)
+
+
+def get_s3_client():
+    global s3_client
+    if s3_client is None:
+        import boto3
+
+        s3_client = boto3.client("s3", endpoint_url=os.getenv("S3_ENDPOINT_URL"))
+    return s3_client
 
-        logger.debug("Starting speech-to-text processing")
-        segments, detected_num_speakers, detected_language = speech_to_text(
-            temp_wav_filename,
-            predict_request.num_speakers,
-            predict_request.prompt,
-            predict_request.offset_seconds,
-            predict_request.group_segments,
-            predict_request.language,
-            word_timestamps=True,
-            transcript_output_format=predict_request.transcript_output_format,
-            translate=predict_request.translate,
+
+def download_s3(url: str, path: str):
+    """Downloads an s3://bucket/key object with parallel ranged GETs."""
+    from boto3.s3.transfer import TransferConfig
+    from botocore.exceptions import ClientError
+
+    bucket, _, key = url[len("s3://") :].partition("/")
+    client = get_s3_client()
+    try:
+        head = client.head_object(Bucket=bucket, Key=key)
+        check_download_size(head["ContentLength"])
+        client.download_file(
+            bucket,
+            key,
+            path,
+            Config=TransferConfig(
+                multipart_threshold=download_part_bytes,
+                multipart_chunksize=download_part_bytes,
+                max_concurrency=download_concurrency,
+            ),
         )
-        logger.debug("Speech-to-text processing completed")
+    except ClientError as e:
+        logger.error("Failed to download %s: %s", url, e)
+        raise HTTPException(status_code=400, detail="Error downloading file: " + str(e))
+
 
-        return Output(
-            segments=segments,
-            language=detected_language,
-            num_speakers=detected_num_speakers,
+async def download_input(input_data: dict, timings: dict) -> str:
+    """
+    Downloads the file referenced by `file_url` (or `file`) to a temporary file
+    and returns its path; the caller removes it. http(s) and s3:// URLs are
+    supported, both capped at MAX_DOWNLOAD_MB.
+    """
+    file_url = input_data.get("file_url")
+    file_from_json = input_data.get(
+        "file"
+    )  # If 'file' is a URL, handle it like file_url
+
+    logger.debug("file_url: %s", file_url)
+    logger.debug("file (from JSON): %s", file_from_json)
+
+    if not (file_url or file_from_json):
+        raise HTTPException(
+            status_code=400,
+            detail="Either 'file', 'file_url', or uploaded file must be provided",
         )
 
-    except requests.exceptions.RequestException as req_err:
+    download_url = file_url if file_url else file_from_json
+    logger.debug("Downloading file from URL: %s", download_url)
+    time_download_start = time.time()
+
+    fd, path = tempfile.mkstemp(dir=download_dir, suffix=".download")
+    os.close(fd)
+    try:
+        if download_url.startswith("s3://"):
+            await asyncio.to_thread(download_s3, download_url, path)
+        else:
+            await download_http(download_url, path)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as req_err:
+        os.remove(path)
         logger.error("Request error while downloading file: %s", req_err)
         raise HTTPException(
             status_code=400, detail="Error downloading file: " + str(req_err)
         )
+    except BaseException:
+        os.remove(path)
+        raise
+    logger.debug("File downloaded (%d bytes)", os.path.getsize(path))
+    timings["download"] = time.time() - time_download_start
+    return path
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(functools.partial(f.read, 1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def run_prediction(
+    input_data: dict,
+    predict_request: PredictRequest,
+    timings: dict,
+    progress=None,
+    wait: bool = False,
+    on_segment=None,
+) -> Output:
+    """
+    Loads the input audio and runs speech_to_text on the GPU worker. With
+    `wait=True` the call waits for room in the GPU queue instead of failing with
+    429, which is what background jobs want.
+
+    Transcription and diarization results are cached by the hash of the downloaded
+    file and the parameters each stage depends on. When both are cached, the
+    output is rebuilt from the cache without decoding the audio or touching the GPU.
+    """
+    time_start = time.time()
+    status = 500
+    try:
+        with span("predict", model=predict_request.model), load_stats.track() as load:
+            output = await download_and_process(
+                input_data, predict_request, timings, progress, wait, on_segment, load
+            )
+        status = 200
+        return output
+    except HTTPException as e:
+        status = e.status_code
+        raise
+    except asyncio.CancelledError:
+        status = "cancelled"
+        raise
+    finally:
+        # Failed predictions still report the stages they completed.
+        for stage, seconds in list(timings.items()):
+            stage_seconds.labels(stage).observe(seconds)
+        prediction_seconds.labels(predict_request.model).observe(
+            time.time() - time_start
+        )
+        predictions_total.labels(predict_request.model, status).inc()
+
+
+async def download_and_process(
+    input_data: dict,
+    predict_request: PredictRequest,
+    timings: dict,
+    progress=None,
+    wait: bool = False,
+    on_segment=None,
+    load=None,
+) -> Output:
+    """Downloads the input and processes it, see run_prediction."""
+    # Reject early instead of downloading a file we have no room to process.
+    if not wait and gpu_queue.full():
+        raise gpu_queue.rejected()
+
+    if progress:
+        progress("downloading", 0.0)
+    with span("download"):
+        path = await download_input(input_data, timings)
+    try:
+        return await process_download(
+            path, predict_request, timings, progress, wait, on_segment, load
+        )
+    finally:
+        os.remove(path)
+
+
+async def process_download(
+    path: str,
+    predict_request: PredictRequest,
+    timings: dict,
+    progress=None,
+    wait: bool = False,
+    on_segment=None,
+    load=None,
+) -> Output:
+    """
+    Runs speech_to_text over a downloaded file, from the cache if possible. The
+    audio duration is recorded in the `load` dict of load_stats.track().
+    """
+    cache_keys = {}
+    if result_cache is not None:
+        audio_hash = await asyncio.to_thread(file_sha256, path)
+        cache_keys = dict(
+            transcription_cache_key=transcription_key(audio_hash, predict_request),
+            diarization_cache_key=diarization_key(audio_hash, predict_request),
+        )
+
+    run_stages = functools.partial(
+        speech_to_text,
+        num_speakers=predict_request.num_speakers,
+        prompt=predict_request.prompt,
+        offset_seconds=predict_request.offset_seconds,
+        group_segments=predict_request.group_segments,
+        language=predict_request.language,
+        word_timestamps=True,
+        transcript_output_format=predict_request.transcript_output_format,
+        translate=predict_request.translate,
+        timings=timings,
+        progress=progress,
+        on_segment=on_segment,
+        model_name=predict_request.model,
+        vad_parameters=vad_parameters(predict_request),
+        **cache_keys,
+    )
+
+    cached = False
+    if cache_keys:
+        lookups = [asyncio.to_thread(result_cache.has, k) for k in cache_keys.values()]
+        cached = all(await asyncio.gather(*lookups))
+
+    # In pool mode the peaks are those of the model worker that ran the request.
+    worker_memory = {}
+    result = None
+    with PeakMemory() as memory:
+        if cached:
+            # Both stages are cached: skip decoding and the GPU queue altogether.
+            logger.debug("Serving speech-to-text from cache")
+            try:
+                result = await asyncio.to_thread(run_stages, None)
+            except CacheMiss as e:
+                # Evicted since the lookup; fall back to running the stages.
+                logger.debug("Cache entry %s was evicted, decoding", e)
+        if result is None:
+            time_decode_start = time.time()
+            audio = await asyncio.to_thread(decode_audio, path)
+            timings["decode"] = time.time() - time_decode_start
+            audio_seconds = len(audio) / SAMPLE_RATE
+            logger.debug("Decoded %.2f seconds of audio", audio_seconds)
+            audio_seconds_total.labels(predict_request.model).inc(audio_seconds)
+            if load is not None:
+                load["audio_seconds"] = audio_seconds
+
+            if progress:
+                progress("queued", 0.0)
+            logger.debug("Queueing speech-to-text (depth %d)", gpu_queue.depth)
+            time_queued = time.time()
+
+            def run_queued(audio):
+                timings["queue"] = time.time() - time_queued
+                if worker_pool is not None:
+                    return worker_pool.speech_to_text(
+                        audio, memory=worker_memory, **run_stages.keywords
+                    )
+                return run_stages(audio)
+
+            result = await gpu_queue.submit(run_queued, audio, wait=wait)
+            load_stats.record(audio_seconds, timings.get("speech_to_text"))
+    segments, detected_num_speakers, detected_language = result
+    logger.debug("Speech-to-text processing completed")
+    peak_memory = worker_memory or memory.report()
+    logger.info("Peak memory: %s", peak_memory)
+
+    return Output(
+        segments=segments,
+        language=detected_language,
+        num_speakers=detected_num_speakers,
+        model=predict_request.model,
+        timings=timings,
+        memory=peak_memory,
+    )
+
+
+# /predict endpoint
+@app.post("/predict", response_model=Output)
+async def predict(request: Request):
+    logger.debug("Received predict request")
+    timings = {}
+    try:
+        body = await request.json()  # Extract JSON data manually
+
+        input_data, predict_request = parse_input(body)
+        return await run_prediction(input_data, predict_request, timings)
+
+    except HTTPException:
+        raise
 
     except Exception as e:
         logger.error("Error processing file: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
+
+def format_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/predict/stream")
+async def predict_stream(request: Request):
+    """
+    Streams a prediction as Server-Sent Events: `segment` events carry the
+    transcription segments as Whisper decodes them, without speakers, and
+    `progress` events report stage changes. A final `result` event carries the
+    same speaker-labelled output as /predict and supersedes the segments streamed
+    before it; failures end the stream with an `error` event instead.
+    """
+    body = await request.json()
+    logger.debug("Received streaming predict request")
+    input_data, predict_request = parse_input(body)
+    if gpu_queue.full():
+        raise gpu_queue.rejected()
+
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    offset_seconds = predict_request.offset_seconds
+    segment_index = 0
+    current_stage = None
+
+    def emit(event: str, data):
+        # Callbacks run on worker threads; serialize right away because the
+        # segment dicts are modified later on by the speaker alignment.
+        loop.call_soon_threadsafe(events.put_nowait, format_event(event, data))
+
+    def progress(stage: str, percent: float):
+        nonlocal current_stage
+        if stage != current_stage:
+            current_stage = stage
+            emit("progress", {"stage": stage})
+
+    def on_segment(segment: dict):
+        nonlocal segment_index
+        emit(
+            "segment",
+            {
+                "index": segment_index,
+                "start": segment["start"] + offset_seconds,
+                "end": segment["end"] + offset_seconds,
+                "avg_logprob": segment["avg_logprob"],
+                "text": segment["text"].strip(),
+                "words": [
+                    dict(
+                        word,
+                        start=word["start"] + offset_seconds,
+                        end=word["end"] + offset_seconds,
+                        word=word["word"].strip(),
+                    )
+                    for word in segment["words"]
+                ],
+            },
+        )
+        segment_index += 1
+
+    async def run():
+        try:
+            output = await run_prediction(
+                input_data,
+                predict_request,
+                {},
+                progress=progress,
+                on_segment=on_segment,
+            )
+            emit("result", output.dict())
+        except HTTPException as e:
+            emit("error", {"status_code": e.status_code, "detail": e.detail})
+        except Exception as e:
+            logger.error("Error processing file: %s", e)
+            emit("error", {"status_code": 500, "detail": str(e)})
+        finally:
+            loop.call_soon_threadsafe(events.put_nowait, None)
+
+    async def stream():
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                yield event
+        finally:
+            # Drop the queued GPU work if the client disconnects early.
+            task.cancel()
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# /predict/batch endpoint. Up to BATCH_CONCURRENCY files of a batch are in flight
+# at once: while the GPU works on one file, the next ones are downloaded, decoded
+# and waiting in the GPU queue, so the GPU runs them back to back.
+batch_max_files = int(os.getenv("BATCH_MAX_FILES", "100"))
+batch_concurrency = int(os.getenv("BATCH_CONCURRENCY", str(gpu_queue.workers + 2)))
+
+
+@app.post("/predict/batch", response_model=BatchOutput)
+async def predict_batch(request: Request, stream: bool = False):
+    """
+    Processes every URL in `file_urls` with the prediction options shared by the
+    batch and returns one item per file, in order. With `stream=true` the items
+    are streamed as NDJSON in the order they complete. A file that fails is
+    reported in its item and does not fail the batch.
+    """
+    body = await request.json()
+    logger.debug("Received batch request")
+    input_data, predict_request = parse_input(body)
+    file_urls = input_data.get("file_urls")
+    if (
+        not isinstance(file_urls, list)
+        or not file_urls
+        or not all(isinstance(url, str) for url in file_urls)
+    ):
+        raise HTTPException(
+            status_code=400, detail="'file_urls' must be a non-empty list of URLs"
+        )
+    if len(file_urls) > batch_max_files:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A batch holds at most {batch_max_files} files",
+        )
+
+    shared_input = {
+        key: value
+        for key, value in input_data.items()
+        if key not in ("file_urls", "file_url", "file", "file_string")
+    }
+    slots = asyncio.Semaphore(batch_concurrency)
+
+    async def run_item(index: int, file_url: str) -> BatchItem:
+        item = BatchItem(index=index, file_url=file_url, status="failed")
+        async with slots:
+            try:
+                item.result = await run_prediction(
+                    {**shared_input, "file_url": file_url},
+                    predict_request,
+                    {},
+                    wait=True,
+                )
+                item.status = "completed"
+            except HTTPException as e:
+                item.status_code, item.error = e.status_code, str(e.detail)
+            except Exception as e:
+                logger.error("Error processing %s: %s", file_url, e)
+                item.status_code, item.error = 500, str(e)
+        return item
+
+    tasks = [
+        asyncio.create_task(run_item(index, file_url))
+        for index, file_url in enumerate(file_urls)
+    ]
+
+    if stream:
+
+        async def stream_items():
+            try:
+                for next_item in asyncio.as_completed(tasks):
+                    item = await next_item
+                    yield json.dumps(item.dict()) + "\n"
+            finally:
+                # Drop the remaining files if the client disconnects early.
+                for task in tasks:
+                    task.cancel()
+
+        return StreamingResponse(
+            stream_items(),
+            media_type="application/x-ndjson",
+            headers={"X-Accel-Buffering": "no"},
+        )
+
+    items = await asyncio.gather(*tasks)
+    completed = sum(1 for item in items if item.status == "completed")
+    return BatchOutput(
+        results=items, completed=completed, failed=len(items) - completed
+    )
+
+
+async def run_job(job_id: str, input_data: dict, predict_request: PredictRequest):
+    job = jobs[job_id]
+
+    def progress(stage: str, percent: float):
+        job["stage"] = stage
+        job["progress"] = round(percent, 1)
+        job["updated_at"] = time.time()
+
+    async with job_slots:
+        job["status"] = "running"
+        timings = {}
+        try:
+            output = await run_prediction(
+                input_data, predict_request, timings, progress=progress, wait=True
+            )
+            job.update(status="completed", stage="completed", progress=100.0)
+            job["result"] = output.dict()
+        except Exception as e:
+            logger.error("Job %s failed: %s", job_id, e)
+            job.update(status="failed", stage="failed")
+            job["error"] = e.detail if isinstance(e, HTTPException) else str(e)
+        job["updated_at"] = time.time()
+
+    try:
+        await asyncio.to_thread(result_store.put, job_id, job)
+    except Exception as e:
+        logger.error("Failed to persist job %s: %s", job_id, e)
+        return
+    # Finished jobs are served from the result store from now on.
+    jobs.pop(job_id, None)
+
+
+# /jobs endpoints
+@app.post("/jobs", response_model=Job, status_code=202)
+async def submit_job(request: Request):
+    body = await request.json()
+    logger.debug("Received job submission")
+    input_data, predict_request = parse_input(body)
+
+    if len(jobs) >= max_pending_jobs:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many pending jobs",
+            headers={"Retry-After": str(gpu_queue.retry_after())},
+        )
+
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    jobs[job_id] = Job(
+        job_id=job_id, status="queued", stage="queued", created_at=now, updated_at=now
+    ).dict()
+    task = asyncio.create_task(run_job(job_id, input_data, predict_request))
+    job_tasks.add(task)
+    task.add_done_callback(job_tasks.discard)
+    return jobs[job_id]
+
+
+@app.get("/jobs/{job_id}", response_model=Job)
+async def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        job = await asyncio.to_thread(result_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+# /live endpoint
+@app.websocket("/live")
+async def live(websocket: WebSocket):
+    """
+    Live transcription. Query parameters: `format` (`pcm_s16le`, the default, or
+    `opus` in an Ogg or WebM container), `sample_rate` of the PCM (default 16000),
+    `language`, `prompt`, `num_speakers` and `model`.
+
+    The client sends audio as binary messages and the text message `stop` when
+    done. The server answers with JSON `partial` events (`stable` and `unstable`
+    text of the current utterance), `final` events (a committed utterance with
+    words and speaker) and a last `done` event after `stop`.
+    """
+    global live_sessions
+    await websocket.accept()
+    if not startup.ready.is_set():
+        await websocket.close(code=1013, reason="Models are still loading")
+        return
+    if worker_pool is not None:
+        # The models live in the model workers, which only run speech_to_text.
+        await websocket.close(code=1003, reason="Not available in worker-pool mode")
+        return
+    if live_sessions >= live_max_sessions:
+        await websocket.close(code=1013, reason="Too many live sessions")
+        return
+
+    # Counted before anything is awaited, so concurrent sessions see each other.
+    live_sessions += 1
+    decoder = None
+    tasks = []
+    try:
+        params = websocket.query_params
+        audio_format = params.get("format", "pcm_s16le")
+        if audio_format not in ("pcm_s16le", "opus"):
+            await websocket.close(
+                code=1003, reason=f"Unsupported format: {audio_format}"
+            )
+            return
+        sample_rate = params.get("sample_rate", str(SAMPLE_RATE))
+        if not sample_rate.isdigit() or int(sample_rate) == 0:
+            await websocket.close(
+                code=1003, reason=f"Invalid sample_rate: {sample_rate}"
+            )
+            return
+        sample_rate = int(sample_rate)
+        num_speakers = params.get("num_speakers")
+        try:
+            transcriber = LiveTranscriber(
+                language=params.get("language"),
+                prompt=params.get("prompt"),
+                num_speakers=int(num_speakers) if num_speakers else None,
+                model=params.get("model"),
+            )
+        except ValueError as e:
+            await websocket.close(code=1003, reason=str(e))
+            return
+        logger.debug("Live session started (%s, %d Hz)", audio_format, sample_rate)
+
+        loop = asyncio.get_running_loop()
+        audio_queue = asyncio.Queue()
+        step_samples = live_step_ms * SAMPLE_RATE // 1000
+
+        async def process_audio():
+            try:
+                await transcribe_stream()
+            except Exception as e:
+                logger.error("Live transcription failed: %s", e)
+                await websocket.send_json({"type": "error", "detail": str(e)})
+                await websocket.close(code=1011)
+
+        async def transcribe_stream():
+            pending = 0
+            while True:
+                chunks = [await audio_queue.get()]
+                # Catch up on everything received while the last step was decoding.
+                while not audio_queue.empty():
+                    chunks.append(audio_queue.get_nowait())
+                final = chunks[-1] is None
+                for samples in chunks:
+                    if samples is not None:
+                        transcriber.append(samples)
+                        pending += len(samples)
+                if final or pending >= step_samples:
+                    pending = 0
+                    events = await loop.run_in_executor(
+                        live_executor, transcriber.process, final
+                    )
+                    for event in events:
+                        await websocket.send_json(event)
+                if final:
+                    return
+
+        # Raw 16 kHz PCM is converted directly, anything else goes through ffmpeg.
+        remainder = b""
+        if audio_format == "opus" or sample_rate != SAMPLE_RATE:
+            input_options = []
+            if audio_format == "pcm_s16le":
+                input_options = ["-f", "s16le", "-ar", str(sample_rate), "-ac", "1"]
+            decoder = await asyncio.create_subprocess_exec(
+                "ffmpeg",
+                "-nostdin",
+                "-loglevel",
+                "error",
+                *input_options,
+                "-i",
+                "pipe:0",
+                "-f",
+                "f32le",
+                "-ac",
+                "1",
+                "-ar",
+                str(SAMPLE_RATE),
+                "pipe:1",
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+            )
+
+        async def read_decoder():
+            buffer = b""
+            while True:
+                data = await decoder.stdout.read(1 << 16)
+                if not data:
+                    audio_queue.put_nowait(None)
+                    return
+                buffer += data
+                usable = len(buffer) - len(buffer) % 4
+                audio_queue.put_nowait(np.frombuffer(buffer[:usable], dtype=np.float32))
+                buffer = buffer[usable:]
+
+        tasks.append(asyncio.create_task(process_audio()))
+        if decoder:
+            tasks.append(asyncio.create_task(read_decoder()))
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("text") is not None:
+                if message["text"].strip() == "stop":
+                    break
+                continue
+            data = message.get("bytes") or b""
+            if decoder:
+                decoder.stdin.write(data)
+                await decoder.stdin.drain()
+            else:
+                data = remainder + data
+                usable = len(data) - len(data) % 2
+                samples = np.frombuffer(data[:usable], dtype="<i2")
+                audio_queue.put_nowait(samples.astype(np.float32) / 32768.0)
+                remainder = data[usable:]
+
+        if decoder:
+            decoder.stdin.close()
+        else:
+            audio_queue.put_nowait(None)
+        await tasks[0]
+        await websocket.send_json({"type": "done"})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
     finally:
-        if temp_input_filename and os.path.exists(temp_input_filename):
-            os.remove(temp_input_filename)
-            logger.debug("Temporary input file removed")
+        live_sessions -= 1
+        for task in tasks:
+            task.cancel()
+        if decoder and decoder.returncode is None:
+            decoder.kill()
+        logger.debug("Live session ended")
 
 
-def speech_to_text(
-    audio_file_wav,
-    num_speakers=None,
+@traced("decode")
+def decode_audio(path: str) -> np.ndarray:
+    """
+    Decodes an audio/video file to 16 kHz mono float32 PCM in memory. The raw
+    samples are read from ffmpeg's stdout; the input is a file rather than a pipe
+    because some containers (e.g. MP4 with the moov atom at the end) need seeking.
+    """
+    command = [
+        "ffmpeg",
+        "-nostdin",
+        "-threads",
+        "0",
+        "-i",
+        path,
+        "-f",
+        "f32le",
+        "-ac",
+        "1",
+        "-ar",
+        str(SAMPLE_RATE),
+        "pipe:1",
+    ]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        logger.debug("ffmpeg error: %s", result.stderr)
+        raise RuntimeError(f"ffmpeg failed with return code {result.returncode}")
+
+    # Copy into a writable buffer; the same array is shared by Whisper and pyannote.
+    return np.frombuffer(result.stdout, dtype=np.float32).copy()
+
+
+# Speech regions are detected once per request with Silero VAD and shared by both
+# stages: Whisper decodes only the speech and pyannote diarizes the concatenated
+# speech, whose turns are mapped back to the original timeline. Regions are capped at
+# Whisper's 30-second window, so the batched pipeline can decode them as clips.
+WHISPER_CHUNK_SECONDS = 30
+DEFAULT_VAD_PARAMETERS = dict(
+    threshold=0.5, min_silence_duration_ms=1000, speech_pad_ms=400
+)
+
+
+def vad_parameters(predict_request: PredictRequest) -> Optional[dict]:
+    """The VAD options of a request, None if it disables the VAD."""
+    if not predict_request.vad_filter:
+        return None
+    return dict(
+        threshold=predict_request.vad_threshold,
+        min_silence_duration_ms=predict_request.vad_min_silence_ms,
+        speech_pad_ms=predict_request.vad_speech_pad_ms,
+    )
+
+
+@traced("vad")
+def detect_speech(audio, vad_parameters: dict) -> List[dict]:
+    """Returns the speech regions of the audio as start and end sample offsets."""
+    options = VadOptions(**vad_parameters, max_speech_duration_s=WHISPER_CHUNK_SECONDS)
+    return get_speech_timestamps(audio, options)
+
+
+def speech_audio(audio, speech: List[dict]) -> np.ndarray:
+    """Concatenates the speech regions of the audio."""
+    if not speech:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate([audio[region["start"] : region["end"]] for region in speech])
+
+
+def speech_clips(audio, speech: Optional[List[dict]]) -> List[dict]:
+    """
+    Groups consecutive speech regions into clips of up to WHISPER_CHUNK_SECONDS for
+    the batched pipeline, as its own VAD would. Without speech regions the whole
+    audio is cut into clips.
+    """
+    max_samples = WHISPER_CHUNK_SECONDS * SAMPLE_RATE
+    if speech is None:
+        return [
+            {"start": start, "end": min(start + max_samples, len(audio))}
+            for start in range(0, len(audio), max_samples)
+        ]
+    clips = []
+    for region in speech:
+        if clips and region["end"] - clips[-1]["start"] <= max_samples:
+            clips[-1]["end"] = region["end"]
+        else:
+            clips.append({"start": region["start"], "end": region["end"]})
+    return clips
+
+
+def restore_segment(segment: dict, timestamps: SpeechTimestampsMap):
+    """
+    Moves the timestamps of a segment decoded from concatenated speech back to the
+    original timeline, in place. Like faster-whisper's own VAD filter, both ends of
+    a word are resolved against the region of its middle.
+    """
+    words = segment["words"]
+    for word in words:
+        region = timestamps.get_chunk_index((word["start"] + word["end"]) / 2)
+        word["start"] = timestamps.get_original_time(word["start"], region)
+        word["end"] = timestamps.get_original_time(word["end"], region)
+    if words:
+        segment["start"], segment["end"] = words[0]["start"], words[-1]["end"]
+    else:
+        segment["start"] = timestamps.get_original_time(segment["start"])
+        segment["end"] = timestamps.get_original_time(segment["end"])
+
+
+@traced("transcribe")
+def transcribe(
+    audio,
     prompt="",
-    offset_seconds=0,
-    group_segments=True,
     language=None,
     word_timestamps=True,
-    transcript_output_format="both",
     translate=False,
+    timings=None,
+    progress=None,
+    cache_key=None,
+    on_segment=None,
+    model_name=None,
+    speech=None,
 ):
+    """
+    Runs Whisper over the audio and returns the segments as plain dicts together
+    with the detected language. The stage duration is recorded in `timings` and
+    `progress("transcribing", percent)` is called as segments are decoded.
+    `on_segment(segment)` receives every segment dict as soon as it is decoded.
+    `model_name` selects one of the hosted models, the default one if not set.
+    `speech` holds the speech regions from detect_speech; only those are decoded,
+    and None decodes the whole audio.
+    Results are read from and written to the result cache under `cache_key`.
+    """
     time_start = time.time()
+    if cache_key and result_cache is not None:
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            if timings is not None:
+                timings["transcribe"] = time.time() - time_start
+            logger.debug("Transcription served from cache (%s)", cache_key)
+            if on_segment:
+                for segment in cached["segments"]:
+                    on_segment(segment)
+            return cached["segments"], cached["language"]
+    if audio is None:
+        raise CacheMiss(cache_key)
     logger.debug("Starting transcription")
 
     options = dict(
-        vad_filter=True,
-        vad_parameters=dict(min_silence_duration_ms=1000),
         initial_prompt=prompt,
         word_timestamps=word_timestamps,
         language=language,
         task="translate" if translate else "transcribe",
         hotwords=prompt,
     )
-    segments, transcript_info = whisper_model.transcribe(audio_file_wav, **options)
-    segments = list(segments)
-    segments = [
-        {
-            "avg_logprob": s.avg_logprob,
-            "start": float(s.start + offset_seconds),
-            "end": float(s.end + offset_seconds),
-            "text": s.text,
-            "words": [
-                {
-                    "start": float(w.start + offset_seconds),
-                    "end": float(w.end + offset_seconds),
-                    "word": w.word,
-                    "probability": w.probability,
-                }
-                for w in s.words
-            ],
-        }
-        for s in segments
-    ]
-
-    time_transcribing_end = time.time()
-    logger.debug(
-        "Transcription completed in %.5f seconds", time_transcribing_end - time_start
-    )
-
-    logger.debug("Starting diarization")
-    waveform, sample_rate = torchaudio.load(audio_file_wav)
-    diarization = diarization_model(
-        {"waveform": waveform, "sample_rate": sample_rate},
-        num_speakers=num_speakers,
-    )
-
-    time_diraization_end = time.time()
-    logger.debug(
-        "Diarization completed in %.5f seconds",
-        time_diraization_end - time_transcribing_end,
-    )
+    timestamps = None
+    decoded_segments = []
+    # The model stays in use, and cannot be evicted, until the segments are decoded.
+    with whisper_models.use(model_name) as (model, batcher):
+        if speech == []:
+            # Nothing to decode; the language cannot be detected either.
+            segments, transcript_info = [], None
+        elif batcher:
+            segments, transcript_info = batcher.transcribe(
+                audio, clip_timestamps=speech_clips(audio, speech), **options
+            )
+        elif speech:
+            timestamps = SpeechTimestampsMap(speech, SAMPLE_RATE)
+            segments, transcript_info = model.transcribe(
+                speech_audio(audio, speech), vad_filter=False, **options
+            )
+        else:
+            segments, transcript_info = model.transcribe(
+                audio, vad_filter=False, **options
+            )
+        if progress:
+            progress("transcribing", 0.0)
+        # Consume the generator segment by segment so that progress and partial
+        # results are reported while Whisper is still decoding.
+        for s in segments:
+            segment = {
+                "avg_logprob": s.avg_logprob,
+                "start": float(s.start),
+                "end": float(s.end),
+                "text": s.text,
+                "words": [
+                    {
+                        "start": float(w.start),
+                        "end": float(w.end),
+                        "word": w.word,
+                        "probability": w.probability,
+                    }
+                    for w in s.words
+                ],
+            }
+            if progress and transcript_info.duration:
+                percent = 100 * s.end / transcript_info.duration
+                progress("transcribing", min(100.0, percent))
+            if timestamps:
+                restore_segment(segment, timestamps)
+            decoded_segments.append(segment)
+            if on_segment:
+                on_segment(segment)
+    segments = decoded_segments
+    detected_language = transcript_info and transcript_info.language
 
-    margin = 0.1
-    final_segments = []
+    if cache_key and result_cache is not None:
+        result_cache.put(
+            cache_key, {"segments": segments, "language": detected_language}
+        )
 
-    diarization_list = list(diarization.itertracks(yield_label=True))
-    unique_speakers = {
-        speaker for _, _, speaker in diarization.itertracks(yield_label=True)
-    }
-    detected_num_speakers = len(unique_speakers)
+    elapsed = time.time() - time_start
+    if timings is not None:
+        timings["transcribe"] = elapsed
+    logger.debug("Transcription completed in %.5f seconds", elapsed)
+    return segments, detected_language
 
-    speaker_idx = 0
-    n_speakers = len(diarization_list)
 
-    for segment in segments:
-        segment_start = segment["start"] + offset_seconds
-        segment_end = segment["end"] + offset_seconds
-        segment_text = []
-        segment_words = []
+@traced("diarize")
+def diarize(audio, num_speakers=None, timings=None, cache_key=None, speech=None):
+    """
+    Runs the pyannote pipeline over the audio and returns the speaker turns as
+    [start, end, speaker] lists. The stage duration is recorded in `timings`.
+    With the `speech` regions from detect_speech, only the concatenated speech is
+    diarized and the turns are mapped back to the original timeline.
+    Results are read from and written to the result cache under `cache_key`.
+    """
+    time_start = time.time()
+    if cache_key and result_cache is not None:
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            if timings is not None:
+                timings["diarize"] = time.time() - time_start
+            logger.debug("Diarization served from cache (%s)", cache_key)
+            return cached["turns"]
+    if audio is None:
+        raise CacheMiss(cache_key)
+    logger.debug("Starting diarization")
 
-        for word in segment["words"]:
-            word_start = word["start"] + offset_seconds - margin
-            word_end = word["end"] + offset_seconds + margin
+    if speech is not None:
+        logger.debug(
+            "Diarizing %.1fs of speech out of %.1fs",
+            sum(region["end"] - region["start"] for region in speech) / SAMPLE_RATE,
+            len(audio) / SAMPLE_RATE,
+        )
+        audio = speech_audio(audio, speech)
+    duration = len(audio) / SAMPLE_RATE
+    if not duration:
+        turns = []
+    elif long_form_diarization_seconds and duration > long_form_diarization_seconds:
+        turns = diarize_long_form(audio, num_speakers)
+    else:
+        waveform = torch.from_numpy(audio).unsqueeze(0)
+        with diarization_lock:
+            diarization = diarization_model(
+                {"waveform": waveform, "sample_rate": SAMPLE_RATE},
+                num_speakers=num_speakers,
+            )
+        turns = [
+            [turn.start, turn.end, speaker]
+            for turn, _, speaker in diarization.itertracks(yield_label=True)
+        ]
+    if speech is not None:
+        regions = [
+            (region["start"] / SAMPLE_RATE, region["end"] / SAMPLE_RATE)
+            for region in speech
+        ]
+        turns = restore_turns(turns, regions)
+    if cache_key and result_cache is not None:
+        result_cache.put(cache_key, {"turns": turns})
 
-            while speaker_idx < n_speakers:
-                turn, _, speaker = diarization_list[speaker_idx]
+    elapsed = time.time() - time_start
+    if timings is not None:
+        timings["diarize"] = elapsed
+    logger.debug("Diarization completed in %.5f seconds", elapsed)
+    return turns
 
-                if turn.start <= word_end and turn.end >= word_start:
-                    segment_text.append(word["word"])
-                    word["word"] = word["word"].strip()
-                    segment_words.append(word)
 
-                    if turn.end <= word_end:
-                        speaker_idx += 1
+def diarize_long_form(audio, num_speakers=None):
+    """
+    Diarizes the audio in overlapping windows, one window at a time, and matches
+    speakers across windows by clustering the speaker embeddings pyannote returns
+    for each window. Returns the turns as [start, end, speaker] lists.
+    """
+    windows = diarization_windows(
+        len(audio) / SAMPLE_RATE,
+        diarization_window_seconds,
+        diarization_window_overlap_seconds,
+    )
+    logger.debug("Diarizing %d windows", len(windows))
+    window_turns = []
+    window_embeddings = []
+    for start, end, _, _ in windows:
+        # A window may not contain every speaker, so num_speakers only caps the
+        # per-window count; the global count is enforced by the clustering.
+        chunk = audio[int(start * SAMPLE_RATE) : int(end * SAMPLE_RATE)]
+        waveform = torch.from_numpy(chunk).unsqueeze(0)
+        with diarization_lock:
+            diarization, embeddings = diarization_model(
+                {"waveform": waveform, "sample_rate": SAMPLE_RATE},
+                max_speakers=num_speakers,
+                return_embeddings=True,
+            )
+        window_turns.append(
+            [
+                [start + turn.start, start + turn.end, speaker]
+                for turn, _, speaker in diarization.itertracks(yield_label=True)
+            ]
+        )
+        if embeddings is None:
+            embeddings = []
+        window_embeddings.append(dict(zip(diarization.labels(), embeddings)))
 
-                    break
-                elif turn.end < word_start:
-                    speaker_idx += 1
-                else:
-                    break
+    return stitch_windows(
+        windows,
+        window_turns,
+        window_embeddings,
+        diarization_cluster_threshold,
+        diarization_model.clustering.method,
+        num_speakers,
+    )
 
-        if segment_text:
-            combined_text = "".join(segment_text)
-            cleaned_text = re.sub("  ", " ", combined_text).strip()
-            new_segment = {
-                "avg_logprob": segment["avg_logprob"],
-                "start": segment_start - offset_seconds,
-                "end": segment_end - offset_seconds,
-                "speaker": speaker,
-                "text": cleaned_text,
-                "words": segment_words,
-            }
-            final_segments.append(new_segment)
 
-    time_merging_end = time.time()
-    logger.debug(
-        "Merging completed in %.5f seconds", time_merging_end - time_diraization_end
-    )
+def shift_segments(segments, offset_seconds):
+    """Moves segment and word timestamps by `offset_seconds`, in place."""
+    if not offset_seconds:
+        return
+    for segment in segments:
+        segment["start"] += offset_seconds
+        segment["end"] += offset_seconds
+        for word in segment["words"]:
+            word["start"] += offset_seconds
+            word["end"] += offset_seconds
 
-    if not final_segments:
-        logger.debug("No final segments found")
-        return [], detected_num_speakers, transcript_info.language
 
-    segments = final_segments
+@traced("group")
+def group_by_speaker(segments, transcript_output_format="both", group_segments=True):
+    """
+    Joins consecutive segments of the same speaker that are at most 2 seconds apart,
+    unless `group_segments` is false, and keeps the text and/or the words of every
+    group depending on `transcript_output_format`.
+    """
     output = []
 
     current_group = {
@@ -333,13 +3116,123 @@ def speech_to_text(
                 current_group["words"] = segments[i]["words"]
 
     output.append(current_group)
+    return output
+
+
+def speech_to_text(
+    audio,
+    num_speakers=None,
+    prompt="",
+    offset_seconds=0,
+    group_segments=True,
+    language=None,
+    word_timestamps=True,
+    transcript_output_format="both",
+    translate=False,
+    timings=None,
+    progress=None,
+    transcription_cache_key=None,
+    diarization_cache_key=None,
+    on_segment=None,
+    model_name=None,
+    vad_parameters=DEFAULT_VAD_PARAMETERS,
+):
+    time_start = time.time()
+    if timings is None:
+        timings = {}
+
+    # Without audio both stages are served from the cache.
+    speech = None
+    if audio is not None and vad_parameters is not None:
+        speech = detect_speech(audio, vad_parameters)
+        timings["vad"] = time.time() - time_start
+        logger.debug("VAD found %d speech regions", len(speech))
+
+    if concurrent_stages:
+        logger.debug("Starting transcription and diarization concurrently")
+        transcription_future = stage_executor.submit(
+            contextvars.copy_context().run,
+            transcribe,
+            audio,
+            prompt,
+            language,
+            word_timestamps,
+            translate,
+            timings,
+            progress,
+            transcription_cache_key,
+            on_segment,
+            model_name,
+            speech,
+        )
+        diarization_future = stage_executor.submit(
+            contextvars.copy_context().run,
+            diarize,
+            audio,
+            num_speakers,
+            timings,
+            diarization_cache_key,
+            speech,
+        )
+        try:
+            segments, detected_language = transcription_future.result()
+        except BaseException:
+            # Do not leave diarization holding the GPU with nobody waiting on it.
+            if not diarization_future.cancel():
+                diarization_future.exception()
+            raise
+        if progress and not diarization_future.done():
+            progress("diarizing", 100.0)
+        turns = diarization_future.result()
+    else:
+        segments, detected_language = transcribe(
+            audio,
+            prompt,
+            language,
+            word_timestamps,
+            translate,
+            timings,
+            progress,
+            transcription_cache_key,
+            on_segment,
+            model_name,
+            speech,
+        )
+        if progress:
+            progress("diarizing", 100.0)
+        turns = diarize(audio, num_speakers, timings, diarization_cache_key, speech)
+
+    if progress:
+        progress("merging", 100.0)
+
+    time_diarization_end = time.time()
+
+    shift_segments(segments, offset_seconds)
+    with span("merge"):
+        final_segments, detected_num_speakers = assign_speakers(
+            segments, turns, offset_seconds
+        )
+
+    time_merging_end = time.time()
+    timings["merge"] = time_merging_end - time_diarization_end
+    logger.debug(
+        "Merging completed in %.5f seconds", time_merging_end - time_diarization_end
+    )
+
+    if not final_segments:
+        logger.debug("No final segments found")
+        return [], detected_num_speakers, detected_language
+
+    output = group_by_speaker(final_segments, transcript_output_format, group_segments)
 
     time_cleaning_end = time.time()
+    timings["group"] = time_cleaning_end - time_merging_end
     logger.debug(
         "Cleaning completed in %.5f seconds", time_cleaning_end - time_merging_end
     )
     time_end = time.time()
     time_diff = time_end - time_start
+    timings["speech_to_text"] = time_diff
     logger.debug("Total processing time: %.5f seconds", time_diff)
 
-    return output, detected_num_speakers, transcript_info.language
+    return output, detected_num_speakers, detected_language
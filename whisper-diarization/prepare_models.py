@@ -0,0 +1,107 @@
+"""
+Prepares the model artifacts main.py loads at startup, so fresh instances neither
+download nor convert models from the Hugging Face Hub.
+
+    python prepare_models.py --output /opt/model-cache \\
+        --whisper-models large-v3 NbAiLab/nb-whisper-large \\
+        --upload s3://models-bucket-just-stag/model-cache
+
+The output directory has the layout main.py expects in MODEL_CACHE_DIR (and, once
+uploaded, in MODEL_ARTIFACTS_S3_URI):
+
+whisper/<model>/
+    A CTranslate2 model. faster-whisper model sizes and repositories that already
+    hold a CTranslate2 model are downloaded as they are; Transformers checkpoints
+    are converted with ctranslate2's TransformersConverter.
+pyannote/
+    The diarization pipeline's config.yaml, rewritten to load the segmentation and
+    embedding checkpoints stored next to it instead of fetching them from the Hub.
+"""
+
+import argparse
+import logging
+import os
+import re
+import shutil
+import subprocess
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DIARIZATION_PIPELINE = "pyannote/speaker-diarization-3.1"
+
+
+def artifact_dir_name(model: str) -> str:
+    # Must match artifact_dir_name in main.py.
+    return re.sub(r"[^\w.-]+", "--", model)
+
+
+def prepare_whisper(model: str, output: str, quantization: str):
+    from faster_whisper import download_model
+
+    path = os.path.join(output, "whisper", artifact_dir_name(model))
+    if os.path.exists(os.path.join(path, "model.bin")):
+        logger.info("%s is already prepared in %s", model, path)
+        return
+    os.makedirs(path, exist_ok=True)
+    download_model(model, output_dir=path)
+    if os.path.exists(os.path.join(path, "model.bin")):
+        logger.info("Downloaded %s to %s", model, path)
+        return
+
+    from ctranslate2.converters import TransformersConverter
+
+    logger.info("Converting %s to CTranslate2 (%s)", model, quantization)
+    shutil.rmtree(path)
+    converter = TransformersConverter(
+        model, copy_files=["tokenizer.json", "preprocessor_config.json"]
+    )
+    converter.convert(path, quantization=quantization)
+
+
+def prepare_pyannote(pipeline: str, output: str, token=None):
+    import yaml
+    from huggingface_hub import hf_hub_download
+
+    path = os.path.join(output, "pyannote")
+    os.makedirs(path, exist_ok=True)
+    with open(hf_hub_download(pipeline, "config.yaml", token=token)) as f:
+        config = yaml.safe_load(f)
+
+    params = config["pipeline"]["params"]
+    for name in ("segmentation", "embedding"):
+        checkpoint = hf_hub_download(params[name], "pytorch_model.bin", token=token)
+        shutil.copyfile(checkpoint, os.path.join(path, f"{name}.bin"))
+        # Relative to the config; main.py makes it absolute when loading.
+        params[name] = f"{name}.bin"
+
+    with open(os.path.join(path, "config.yaml"), "w") as f:
+        yaml.safe_dump(config, f)
+    logger.info("Prepared %s in %s", pipeline, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--output", default="/opt/model-cache")
+    parser.add_argument("--whisper-models", nargs="+", default=["large-v3"])
+    parser.add_argument(
+        "--quantization",
+        default="float16",
+        help="Weight type of converted models; loading converts to the compute type",
+    )
+    parser.add_argument("--pipeline", default=DIARIZATION_PIPELINE)
+    parser.add_argument("--hf-token", default=os.getenv("HF_TOKEN"))
+    parser.add_argument("--upload", help="s3:// URI to upload the artifacts to")
+    args = parser.parse_args()
+
+    for model in args.whisper_models:
+        prepare_whisper(model, args.output, args.quantization)
+    prepare_pyannote(args.pipeline, args.output, args.hf_token)
+
+    if args.upload:
+        command = ["aws", "s3", "sync", args.output, args.upload]
+        subprocess.run(command + ["--exclude", "*.local.yaml"], check=True)
+
+
+if __name__ == "__main__":
+    main()
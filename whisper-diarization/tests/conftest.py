@@ -0,0 +1,51 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The service modules are not a package; import them from the service directory.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# main.py creates its result store and cache directories on import.
+state_dir = tempfile.mkdtemp(prefix="whisper-tests-")
+os.environ.setdefault("RESULT_STORE_PATH", os.path.join(state_dir, "results"))
+os.environ.setdefault("CACHE_DIR", os.path.join(state_dir, "cache"))
+
+
+@pytest.fixture(scope="session")
+def main():
+    """The service module, skipping the test without the model dependencies."""
+    for module in ("torch", "faster_whisper", "pyannote.audio"):
+        pytest.importorskip(module)
+    import main
+
+    return main
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    """A moto S3 with a `test-bucket` bucket."""
+    moto = pytest.importorskip("moto")
+    import boto3
+
+    monkeypatch.delenv("S3_ENDPOINT_URL", raising=False)
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with moto.mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket="test-bucket")
+        yield client
+
+
+@pytest.fixture
+def client(main, monkeypatch):
+    """A test client of the app, with the models reported as loaded."""
+    from fastapi.testclient import TestClient
+
+    startup = main.Startup()
+    startup.ready.set()
+    monkeypatch.setattr(main, "startup", startup)
+    # Without the `with` block the lifespan, which loads the models, does not run.
+    return TestClient(main.app)
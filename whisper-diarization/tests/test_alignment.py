@@ -0,0 +1,265 @@
+import numpy as np
+import pytest
+
+from alignment import (
+    assign_speakers,
+    cluster_speakers,
+    diarization_turns,
+    diarization_windows,
+    nearest_speakers,
+    restore_turns,
+    speaker_overlaps,
+    stitch_windows,
+)
+
+
+def word(start, end, text):
+    return {"start": start, "end": end, "word": f" {text}"}
+
+
+def segment(start, end, words, text=None):
+    if text is None:
+        text = "".join(w["word"] for w in words)
+    return {
+        "start": start,
+        "end": end,
+        "text": text,
+        "avg_logprob": -0.2,
+        "words": words,
+    }
+
+
+def test_speaker_overlaps_with_overlapping_turns():
+    starts, ends, speakers, labels = diarization_turns(
+        [(0.0, 10.0, "A"), (5.0, 15.0, "B"), (6.0, 7.0, "A")]
+    )
+    overlaps = speaker_overlaps(
+        starts,
+        ends,
+        speakers,
+        len(labels),
+        np.array([4.0, 8.0, 20.0]),
+        np.array([6.5, 12.0, 21.0]),
+    )
+    # A's own overlapping turns count once.
+    np.testing.assert_allclose(overlaps, [[2.5, 1.5], [2.0, 4.0], [0.0, 0.0]])
+
+
+def test_nearest_speakers_uses_the_turn_that_ends_last():
+    starts, ends, speakers, _ = diarization_turns(
+        [(0.0, 10.0, "A"), (1.0, 2.0, "B"), (20.0, 21.0, "B")]
+    )
+    nearest = nearest_speakers(
+        starts, ends, speakers, np.array([11.0, 18.0]), np.array([12.0, 19.0])
+    )
+    # B's short turn starts after A's but A is still talking when it ends.
+    assert nearest.tolist() == [0, 1]
+
+
+def test_words_go_to_the_speaker_they_overlap_most():
+    segments = [
+        segment(0.0, 12.0, [word(4.0, 6.5, "one"), word(8.0, 12.0, "two")]),
+    ]
+    turns = [(0.0, 10.0, "A"), (5.0, 15.0, "B")]
+    result, num_speakers = assign_speakers(segments, turns, margin=0)
+
+    assert num_speakers == 2
+    assert [(s["speaker"], s["text"]) for s in result] == [("A", "one"), ("B", "two")]
+    # The segment is split, its pieces keep the outer segment boundaries.
+    assert (result[0]["start"], result[0]["end"]) == (0.0, 6.5)
+    assert (result[1]["start"], result[1]["end"]) == (8.0, 12.0)
+
+
+def test_words_in_gaps_go_to_the_nearest_speaker():
+    segments = [
+        segment(
+            0.0,
+            8.0,
+            [
+                word(0.5, 1.5, "one"),
+                word(2.5, 2.8, "two"),
+                word(4.5, 4.8, "three"),
+                word(5.5, 6.5, "four"),
+                word(7.5, 8.0, "five"),
+            ],
+        )
+    ]
+    turns = [(0.0, 2.0, "A"), (5.0, 7.0, "B")]
+    result, _ = assign_speakers(segments, turns, margin=0)
+
+    assert sum(len(s["words"]) for s in result) == 5
+    assert [(s["speaker"], s["text"]) for s in result] == [
+        ("A", "one two"),
+        ("B", "three four five"),
+    ]
+
+
+def test_segments_without_word_timestamps_are_assigned_as_a_whole():
+    segments = [
+        segment(0.0, 3.0, [], text=" Hello there."),
+        segment(3.0, 9.0, [], text=" General Kenobi."),
+    ]
+    turns = [(0.0, 4.0, "A"), (4.0, 10.0, "B")]
+    result, _ = assign_speakers(segments, turns)
+
+    assert result == [
+        {
+            "avg_logprob": -0.2,
+            "start": 0.0,
+            "end": 3.0,
+            "speaker": "A",
+            "text": "Hello there.",
+            "words": [],
+        },
+        {
+            "avg_logprob": -0.2,
+            "start": 3.0,
+            "end": 9.0,
+            "speaker": "B",
+            "text": "General Kenobi.",
+            "words": [],
+        },
+    ]
+
+
+def test_offset_seconds_is_removed_from_whisper_timestamps():
+    # Whisper timestamps of a clip starting at 100 s, turns relative to the clip.
+    segments = [
+        segment(100.0, 104.0, [word(100.5, 101.5, "one"), word(102.5, 103.5, "two")])
+    ]
+    turns = [(0.0, 2.0, "A"), (2.0, 4.0, "B")]
+    result, _ = assign_speakers(segments, turns, offset_seconds=100.0)
+
+    assert [(s["speaker"], s["text"]) for s in result] == [("A", "one"), ("B", "two")]
+    assert (result[0]["start"], result[-1]["end"]) == (100.0, 104.0)
+    assert result[1]["words"][0] == {"start": 102.5, "end": 103.5, "word": "two"}
+
+
+def test_without_turns_segments_are_kept_without_speaker():
+    segments = [segment(0.0, 2.0, [word(0.0, 1.0, "one"), word(1.0, 2.0, "two")])]
+    result, num_speakers = assign_speakers(segments, [])
+
+    assert num_speakers == 0
+    assert [(s["speaker"], s["text"]) for s in result] == [(None, "one two")]
+
+
+@pytest.mark.parametrize("turns", [[], [(0.0, 1.0, "A")]])
+def test_no_segments(turns):
+    assert assign_speakers([], turns) == ([], len(turns))
+
+
+# Speech regions of 2, 1 and 4 seconds: the concatenated audio is 7 seconds long
+# and the regions start at 0, 2 and 3 seconds in it.
+REGIONS = [(1.0, 3.0), (5.0, 6.0), (10.0, 14.0)]
+
+
+def test_restore_turns_splits_turns_spanning_several_regions():
+    assert restore_turns([[1.0, 5.0, "A"]], REGIONS) == [
+        [2.0, 3.0, "A"],
+        [5.0, 6.0, "A"],
+        [10.0, 12.0, "A"],
+    ]
+
+
+def test_restore_turns_on_region_boundaries():
+    turns = [[0.0, 2.0, "A"], [2.0, 3.0, "B"], [3.0, 7.0, "A"]]
+    # No empty pieces in the neighbouring regions.
+    assert restore_turns(turns, REGIONS) == [
+        [1.0, 3.0, "A"],
+        [5.0, 6.0, "B"],
+        [10.0, 14.0, "A"],
+    ]
+
+
+def test_restore_turns_clips_turns_past_the_speech():
+    assert restore_turns([[6.0, 9.0, "A"]], REGIONS) == [[13.0, 14.0, "A"]]
+
+
+def test_restore_turns_without_regions():
+    assert restore_turns([[0.0, 1.0, "A"]], []) == []
+    assert restore_turns([], REGIONS) == []
+
+
+@pytest.mark.parametrize(
+    "duration, window, overlap",
+    [
+        (100.0, 40.0, 10.0),
+        (3600.0, 600.0, 30.0),
+        (601.0, 600.0, 30.0),
+        (10.0, 600.0, 0),
+    ],
+)
+def test_window_cores_tile_the_recording(duration, window, overlap):
+    windows = diarization_windows(duration, window, overlap)
+
+    assert windows[0][2] == 0.0
+    assert windows[-1][3] == duration
+    for (_, _, _, core_end), (_, _, next_core_start, _) in zip(windows, windows[1:]):
+        assert core_end == next_core_start
+    for start, end, core_start, core_end in windows:
+        assert start <= core_start < core_end <= end <= duration
+        assert end - start <= window
+
+
+def test_windows_overlap_must_be_shorter_than_the_window():
+    with pytest.raises(ValueError):
+        diarization_windows(100.0, 40.0, 40.0)
+
+
+# Two windows of [0, 40] and [30, 70] with their cores meeting at 35.
+WINDOWS = diarization_windows(70.0, 40.0, 10.0)
+ALICE = np.array([1.0, 0.1, 0.0])
+BOB = np.array([0.0, 0.2, 1.0])
+
+
+def test_speakers_are_matched_across_windows():
+    # pyannote numbers the speakers of each window on its own.
+    window_turns = [
+        [[0.0, 20.0, "SPEAKER_00"], [20.0, 40.0, "SPEAKER_01"]],
+        [[30.0, 50.0, "SPEAKER_01"], [50.0, 70.0, "SPEAKER_00"]],
+    ]
+    window_embeddings = [
+        {"SPEAKER_00": ALICE, "SPEAKER_01": BOB},
+        {"SPEAKER_00": ALICE * 2 + 0.05, "SPEAKER_01": BOB},
+    ]
+    turns = stitch_windows(WINDOWS, window_turns, window_embeddings, threshold=0.5)
+
+    assert [(start, end) for start, end, _ in turns] == [
+        (0.0, 20.0),
+        (20.0, 35.0),
+        (35.0, 50.0),
+        (50.0, 70.0),
+    ]
+    speakers = [speaker for _, _, speaker in turns]
+    assert speakers[0] == speakers[3] != speakers[1] == speakers[2]
+
+
+@pytest.mark.parametrize("missing", [np.zeros(3), np.full(3, np.nan)])
+def test_speakers_without_embedding_are_skipped(missing):
+    window_turns = [
+        [[0.0, 40.0, "SPEAKER_00"]],
+        [[30.0, 60.0, "SPEAKER_00"], [60.0, 70.0, "SPEAKER_01"]],
+    ]
+    window_embeddings = [
+        {"SPEAKER_00": ALICE},
+        {"SPEAKER_00": ALICE, "SPEAKER_01": missing},
+    ]
+    turns = stitch_windows(WINDOWS, window_turns, window_embeddings, threshold=0.5)
+
+    assert turns == [[0.0, 35.0, "SPEAKER_00"], [35.0, 60.0, "SPEAKER_00"]]
+
+
+def test_num_speakers_cuts_the_dendrogram_into_that_many_clusters():
+    embeddings = [ALICE, ALICE + 0.3, BOB]
+    # Every embedding is within the threshold of the others...
+    assert cluster_speakers(embeddings, threshold=2.0).tolist() == [0, 0, 0]
+    # ...unless the number of speakers is given.
+    clusters = cluster_speakers(embeddings, threshold=2.0, num_speakers=2).tolist()
+    assert clusters[0] == clusters[1] != clusters[2]
+
+    window_turns = [[[0.0, 40.0, "SPEAKER_00"]], [[30.0, 70.0, "SPEAKER_00"]]]
+    window_embeddings = [{"SPEAKER_00": ALICE}, {"SPEAKER_00": BOB}]
+    turns = stitch_windows(
+        WINDOWS, window_turns, window_embeddings, threshold=2.0, num_speakers=2
+    )
+    assert len({speaker for _, _, speaker in turns}) == 2
@@ -0,0 +1,88 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException
+
+URLS = [
+    "https://example.com/slow.wav",
+    "https://example.com/missing.wav",
+    "https://example.com/fast.wav",
+    "https://example.com/broken.wav",
+]
+
+
+@pytest.fixture
+def predictions(main, monkeypatch):
+    """Replaces run_prediction; records the inputs, fails missing and broken files."""
+    inputs = []
+
+    async def run_prediction(input_data, predict_request, timings, wait=False):
+        inputs.append(input_data)
+        url = input_data["file_url"]
+        await asyncio.sleep(0.2 if "slow" in url else 0.01)
+        if "missing" in url:
+            raise HTTPException(status_code=400, detail="Failed to download file")
+        if "broken" in url:
+            raise RuntimeError("ffmpeg failed")
+        return main.Output(segments=[{"text": url}], language=input_data["language"])
+
+    monkeypatch.setattr(main, "run_prediction", run_prediction)
+    return inputs
+
+
+def batch(client, urls, **params):
+    body = {"input": {"file_urls": urls, "language": "en"}}
+    return client.post("/predict/batch", json=body, params=params)
+
+
+def test_batch_items_are_returned_in_order(client, predictions):
+    response = batch(client, URLS)
+
+    assert response.status_code == 200
+    output = response.json()
+    assert (output["completed"], output["failed"]) == (2, 2)
+    assert [item["file_url"] for item in output["results"]] == URLS
+    slow, missing, fast, broken = output["results"]
+    assert slow["status"] == fast["status"] == "completed"
+    assert fast["result"]["segments"] == [{"text": URLS[2]}]
+    assert (missing["status"], missing["status_code"]) == ("failed", 400)
+    assert missing["error"] == "Failed to download file"
+    assert (broken["status"], broken["status_code"]) == ("failed", 500)
+    assert broken["error"] == "ffmpeg failed"
+    # Every file gets the shared options.
+    assert all(input_data["language"] == "en" for input_data in predictions)
+
+
+def test_streamed_batch_items_come_as_they_complete(client, predictions):
+    response = batch(client, URLS, stream="true")
+
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = response.text.splitlines()
+    items = [json.loads(line) for line in lines]
+    assert len(items) == len(URLS)
+    # The slow file finishes last but keeps its index.
+    assert (items[-1]["index"], items[-1]["status"]) == (0, "completed")
+    assert sorted(item["index"] for item in items) == [0, 1, 2, 3]
+    assert {item["index"]: item["status_code"] for item in items} == {
+        0: 200,
+        1: 400,
+        2: 200,
+        3: 500,
+    }
+
+
+@pytest.mark.parametrize("urls", [[], "https://example.com/a.wav", [1]])
+def test_batch_needs_a_list_of_urls(client, predictions, urls):
+    response = batch(client, urls)
+
+    assert response.status_code == 400
+    assert predictions == []
+
+
+def test_batch_size_is_limited(main, client, predictions, monkeypatch):
+    monkeypatch.setattr(main, "batch_max_files", 2)
+    response = batch(client, URLS[:3])
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "A batch holds at most 2 files"
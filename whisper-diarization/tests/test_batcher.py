@@ -0,0 +1,117 @@
+import threading
+import time
+import types
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import pytest
+
+
+@dataclass(frozen=True)
+class Options:
+    beam_size: int = 5
+    clip_timestamps: Optional[list] = None
+
+
+class StubPipeline:
+    """Decodes every chunk to its first feature value and records the batches."""
+
+    batches = []
+
+    def __init__(self, model):
+        self.last_speech_timestamp = 0.0
+
+    def forward(self, features, tokenizer, chunks_metadata, options):
+        if options.beam_size < 1:
+            raise ValueError("beam_size must be positive")
+        StubPipeline.batches.append(len(features))
+        return [float(row[0]) for row in features]
+
+
+@pytest.fixture
+def batcher(main, monkeypatch):
+    StubPipeline.batches = []
+    monkeypatch.setattr(main, "BatchedInferencePipeline", StubPipeline)
+    batchers = []
+
+    def create(batch_size=4, window_ms=10_000):
+        batcher = main.WhisperBatcher(None, batch_size, window_ms)
+        batchers.append(batcher)
+        return batcher
+
+    yield create
+    for batcher in batchers:
+        batcher.stop()
+
+
+def decode(batcher, first, rows, language="en", **options):
+    """Runs `rows` chunks numbered from `first` through the batcher in a thread."""
+    features = np.arange(first, first + rows, dtype=np.float32)[:, None]
+    tokenizer = types.SimpleNamespace(language_code=language, task="transcribe")
+    options = Options(clip_timestamps=[{"start": first}], **options)
+    call = types.SimpleNamespace(result=None, error=None)
+
+    def run():
+        try:
+            call.result = batcher.forward(features, tokenizer, [{}] * rows, options)
+        except Exception as e:
+            call.error = e
+
+    call.thread = threading.Thread(target=run)
+    call.thread.start()
+    return call
+
+
+def test_full_batches_are_decoded_without_waiting(batcher):
+    batcher = batcher(batch_size=4, window_ms=10_000)
+    start = time.monotonic()
+    first, second = decode(batcher, 0, 2), decode(batcher, 10, 2)
+    first.thread.join(5)
+    second.thread.join(5)
+
+    assert time.monotonic() - start < 5
+    # One batch for both requests, and each gets its own chunks back.
+    assert StubPipeline.batches == [4]
+    assert first.result == [0.0, 1.0]
+    assert second.result == [10.0, 11.0]
+
+
+def test_partial_batches_are_decoded_after_the_window(batcher):
+    batcher = batcher(batch_size=4, window_ms=200)
+    start = time.monotonic()
+    call = decode(batcher, 0, 1)
+    call.thread.join(5)
+
+    assert time.monotonic() - start >= 0.2
+    assert StubPipeline.batches == [1]
+    assert call.result == [0.0]
+
+
+def test_batches_are_split_at_the_batch_size(batcher):
+    batcher = batcher(batch_size=4, window_ms=200)
+    calls = [decode(batcher, 0, 3), decode(batcher, 10, 3)]
+    for call in calls:
+        call.thread.join(5)
+
+    assert StubPipeline.batches == [3, 3]
+    assert [call.result for call in calls] == [[0.0, 1.0, 2.0], [10.0, 11.0, 12.0]]
+
+
+def test_incompatible_options_are_not_batched_together(batcher):
+    batcher = batcher(batch_size=4, window_ms=200)
+    calls = [decode(batcher, 0, 2), decode(batcher, 10, 2, language="nb")]
+    for call in calls:
+        call.thread.join(5)
+
+    assert StubPipeline.batches == [2, 2]
+    assert [call.result for call in calls] == [[0.0, 1.0], [10.0, 11.0]]
+
+
+def test_decoding_errors_reach_every_request_of_the_batch(batcher):
+    batcher = batcher(batch_size=2, window_ms=10_000)
+    calls = [decode(batcher, 0, 1, beam_size=0), decode(batcher, 10, 1, beam_size=0)]
+    for call in calls:
+        call.thread.join(5)
+
+    assert [type(call.error) for call in calls] == [ValueError, ValueError]
@@ -0,0 +1,101 @@
+import asyncio
+import json
+
+import numpy as np
+import pytest
+
+
+def test_s3_cache_round_trip(main, s3):
+    cache = main.S3Cache("test-bucket", "cache/")
+    value = [[0.0, 1.5, "SPEAKER_00"], [1.5, 3.0, "SPEAKER_01"]]
+    cache.put("hash-diarize-0123", value)
+
+    assert cache.get("hash-diarize-0123") == value
+    stored = s3.get_object(Bucket="test-bucket", Key="cache/hash-diarize-0123.json")
+    assert json.loads(stored["Body"].read()) == value
+
+
+def test_s3_cache_missing_key(main, s3):
+    cache = main.S3Cache("test-bucket", "cache/")
+
+    assert cache.get("unknown") is None
+
+
+def test_shared_hits_are_copied_to_the_local_cache(main, s3, tmp_path):
+    local = main.DiskCache(str(tmp_path), max_bytes=2**20)
+    shared = main.S3Cache("test-bucket", "cache/")
+    shared.put("key", {"language": "en"})
+    cache = main.ResultCache(local, shared)
+
+    assert local.get("key") is None
+    assert cache.has("key")
+    assert cache.get("key") == {"language": "en"}
+    assert local.get("key") == {"language": "en"}
+
+
+def test_puts_go_to_both_caches(main, s3, tmp_path):
+    local = main.DiskCache(str(tmp_path), max_bytes=2**20)
+    shared = main.S3Cache("test-bucket", "cache/")
+    main.ResultCache(local, shared).put("key", [1, 2, 3])
+
+    assert local.get("key") == [1, 2, 3]
+    assert shared.get("key") == [1, 2, 3]
+
+
+def test_shared_cache_errors_are_misses(main, s3, tmp_path):
+    # Without the bucket every S3 call fails.
+    shared = main.S3Cache("missing-bucket", "cache/")
+    cache = main.ResultCache(main.DiskCache(str(tmp_path), max_bytes=2**20), shared)
+
+    cache.put("key", {"language": "en"})
+    assert cache.get("key") == {"language": "en"}
+    assert cache.get("other") is None
+    assert main.ResultCache(None, shared).get("key") is None
+
+
+class EvictedCache:
+    """A cache whose entries are evicted between has() and get()."""
+
+    def has(self, key):
+        return True
+
+    def get(self, key):
+        return None
+
+    def put(self, key, value):
+        pass
+
+
+def test_uncached_stages_raise_cache_miss(main, monkeypatch):
+    monkeypatch.setattr(main, "result_cache", EvictedCache())
+
+    with pytest.raises(main.CacheMiss):
+        main.transcribe(None, cache_key="hash-transcribe")
+    with pytest.raises(main.CacheMiss):
+        main.diarize(None, cache_key="hash-diarize")
+
+
+def test_entries_evicted_after_the_lookup_are_recomputed(main, monkeypatch, tmp_path):
+    def speech_to_text(audio, **kwargs):
+        if audio is None:
+            raise main.CacheMiss(kwargs["diarization_cache_key"])
+        return [{"text": "hello"}], 1, "en"
+
+    monkeypatch.setattr(main, "result_cache", EvictedCache())
+    monkeypatch.setattr(main, "speech_to_text", speech_to_text)
+    monkeypatch.setattr(main, "decode_audio", lambda path: np.zeros(main.SAMPLE_RATE))
+    path = tmp_path / "clip.wav"
+    path.write_bytes(b"audio")
+
+    async def run():
+        queue = main.GPUWorkQueue(maxsize=1, workers=1)
+        monkeypatch.setattr(main, "gpu_queue", queue)
+        queue.start()
+        try:
+            request = main.PredictRequest(model=main.whisper_models.default)
+            return await main.process_download(str(path), request, {})
+        finally:
+            await queue.stop()
+
+    output = asyncio.run(run())
+    assert (output.segments, output.language) == ([{"text": "hello"}], "en")
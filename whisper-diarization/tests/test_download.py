@@ -0,0 +1,67 @@
+import asyncio
+import os
+
+import pytest
+from fastapi import HTTPException
+
+DATA = os.urandom(10_000)
+
+
+@pytest.fixture
+def s3_input(main, s3, monkeypatch, tmp_path):
+    """An s3:// input object, downloaded in 1 KiB ranges into tmp_path."""
+    s3.put_object(Bucket="test-bucket", Key="audio/clip.wav", Body=DATA)
+    # The shared client must be created inside the moto mock.
+    monkeypatch.setattr(main, "s3_client", None)
+    monkeypatch.setattr(main, "download_part_bytes", 1024)
+    monkeypatch.setattr(main, "download_dir", str(tmp_path))
+    return "s3://test-bucket/audio/clip.wav"
+
+
+def test_download_s3(main, s3_input, tmp_path):
+    path = str(tmp_path / "clip.wav")
+    open(path, "wb").close()
+    main.download_s3(s3_input, path)
+
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+
+
+def test_download_input_from_s3(main, s3_input, tmp_path):
+    timings = {}
+    path = asyncio.run(main.download_input({"file_url": s3_input}, timings))
+
+    assert os.path.dirname(path) == str(tmp_path)
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert "download" in timings
+
+
+def test_download_input_missing_s3_object(main, s3_input, tmp_path):
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main.download_input({"file_url": s3_input + ".missing"}, {}))
+
+    assert error.value.status_code == 400
+    assert os.listdir(tmp_path) == []
+
+
+def test_download_input_too_large_s3_object(main, s3_input, monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "max_download_bytes", len(DATA) - 1)
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main.download_input({"file_url": s3_input}, {}))
+
+    assert error.value.status_code == 413
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize(
+    "value, total",
+    [
+        ("bytes 0-1023/10000", 10000),
+        ("bytes 0-1023/*", None),
+        ("bytes 0-1023", None),
+        (None, None),
+    ],
+)
+def test_content_range_total(main, value, total):
+    assert main.content_range_total(value) == total
@@ -0,0 +1,86 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+
+async def fill(queue, release: threading.Event):
+    """Occupies the worker of `queue` and fills the queue behind it."""
+    started = threading.Event()
+
+    def job(name):
+        started.set()
+        release.wait(5)
+        return name
+
+    running = asyncio.create_task(queue.submit(job, "running"))
+    while not started.is_set():
+        await asyncio.sleep(0.01)
+    queued = asyncio.create_task(queue.submit(job, "queued"))
+    await asyncio.sleep(0.01)
+    return running, queued
+
+
+def test_full_queue_rejects_with_retry_after(main):
+    async def run():
+        queue = main.GPUWorkQueue(maxsize=1, workers=1)
+        queue.start()
+        release = threading.Event()
+        try:
+            running, queued = await fill(queue, release)
+            assert (queue.depth, queue.full()) == (1, True)
+
+            with pytest.raises(HTTPException) as rejected:
+                await queue.submit(lambda: "rejected")
+            release.set()
+            assert await asyncio.gather(running, queued) == ["running", "queued"]
+        finally:
+            release.set()
+            await queue.stop()
+        return rejected.value
+
+    rejected = asyncio.run(run())
+    assert rejected.status_code == 429
+    # The queued job and the rejected one, at the default 30 s per job.
+    assert rejected.headers == {"Retry-After": "60"}
+
+
+def test_retry_after_scales_with_workers_and_job_duration(main):
+    queue = main.GPUWorkQueue(maxsize=8, workers=4)
+    queue.avg_job_seconds = 10.0
+    assert queue.retry_after() == 3
+    queue.avg_job_seconds = 0.01
+    assert queue.retry_after() == 1
+
+
+def test_waiting_submissions_are_not_rejected(main):
+    async def run():
+        queue = main.GPUWorkQueue(maxsize=1, workers=1)
+        queue.start()
+        release = threading.Event()
+        try:
+            running, queued = await fill(queue, release)
+            waiting = asyncio.create_task(queue.submit(lambda: "waited", wait=True))
+            await asyncio.sleep(0.05)
+            assert not waiting.done()
+            release.set()
+            return await asyncio.gather(running, queued, waiting)
+        finally:
+            release.set()
+            await queue.stop()
+
+    assert asyncio.run(run()) == ["running", "queued", "waited"]
+
+
+def test_job_errors_reach_the_caller(main):
+    async def run():
+        queue = main.GPUWorkQueue(maxsize=1, workers=1)
+        queue.start()
+        try:
+            await queue.submit(lambda: 1 / 0)
+        finally:
+            await queue.stop()
+
+    with pytest.raises(ZeroDivisionError):
+        asyncio.run(run())
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+from fastapi import WebSocketDisconnect
+
+
+class Transcriber:
+    """Stands in for LiveTranscriber; reports the samples it got when done."""
+
+    def __init__(self, **options):
+        self.options = options
+        self.samples = []
+
+    def append(self, samples):
+        self.samples.append(samples)
+
+    def process(self, final):
+        if not final:
+            return []
+        samples = np.concatenate(self.samples) if self.samples else np.zeros(0)
+        return [{"type": "final", "samples": len(samples), **self.options}]
+
+
+@pytest.fixture
+def live(main, client, monkeypatch):
+    monkeypatch.setattr(main, "LiveTranscriber", Transcriber)
+    monkeypatch.setattr(main, "live_max_sessions", 1)
+    return client
+
+
+def closed_with(websocket):
+    with pytest.raises(WebSocketDisconnect) as closed:
+        websocket.receive_json()
+    return closed.value.code, closed.value.reason
+
+
+def test_live_session(main, live):
+    with live.websocket_connect("/live?language=no&num_speakers=2") as websocket:
+        # 0.5 s of 16 kHz PCM, split mid-sample.
+        pcm = np.zeros(8000, dtype="<i2").tobytes()
+        websocket.send_bytes(pcm[:1001])
+        websocket.send_bytes(pcm[1001:])
+        websocket.send_text("stop")
+
+        final = websocket.receive_json()
+        assert (final["type"], final["samples"]) == ("final", 8000)
+        assert (final["language"], final["num_speakers"]) == ("no", 2)
+        assert websocket.receive_json() == {"type": "done"}
+    assert main.live_sessions == 0
+
+
+def test_live_sessions_are_limited(main, live):
+    with live.websocket_connect("/live") as first:
+        with live.websocket_connect("/live") as second:
+            assert closed_with(second) == (1013, "Too many live sessions")
+        first.send_text("stop")
+        assert first.receive_json()["type"] == "final"
+        assert first.receive_json() == {"type": "done"}
+    # The rejected session did not count, the finished one no longer does.
+    assert main.live_sessions == 0
+    with live.websocket_connect("/live") as websocket:
+        websocket.send_text("stop")
+        assert websocket.receive_json()["type"] == "final"
+
+
+@pytest.mark.parametrize("sample_rate", ["0", "abc", "-8000"])
+def test_live_rejects_invalid_sample_rates(main, live, sample_rate):
+    with live.websocket_connect(f"/live?sample_rate={sample_rate}") as websocket:
+        assert closed_with(websocket) == (1003, f"Invalid sample_rate: {sample_rate}")
+    assert main.live_sessions == 0
+
+
+def test_live_rejects_unsupported_formats(main, live):
+    with live.websocket_connect("/live?format=mp3") as websocket:
+        assert closed_with(websocket) == (1003, "Unsupported format: mp3")
+    assert main.live_sessions == 0
+
+
+def test_live_waits_for_the_models(main, live):
+    main.startup.ready.clear()
+    with live.websocket_connect("/live") as websocket:
+        assert closed_with(websocket) == (1013, "Models are still loading")
@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def models(main):
+    """WhisperModels over three names that loads stand-ins instead of Whisper."""
+
+    class Models(main.WhisperModels):
+        def __init__(self, max_loaded):
+            names = {"a": "model-a", "b": "model-b", "c": "model-c"}
+            super().__init__(names, "a", max_loaded, min_free_vram_mb=0)
+            self.loads = []
+
+        def _load(self, name):
+            self.loads.append(name)
+            return object(), None
+
+        def loaded(self):
+            return list(self._loaded)
+
+    return Models
+
+
+def use(models, name):
+    with models.use(name) as entry:
+        return entry
+
+
+def test_models_are_loaded_once(models):
+    cache = models(max_loaded=2)
+
+    assert use(cache, "b") is use(cache, "b")
+    assert use(cache, None) is use(cache, "a")
+    assert cache.loads == ["b", "a"]
+
+
+def test_least_recently_used_model_is_evicted(models):
+    cache = models(max_loaded=2)
+    for name in ["a", "b", "a", "c"]:
+        use(cache, name)
+
+    assert cache.loaded() == ["a", "c"]
+    use(cache, "b")
+    assert cache.loaded() == ["c", "b"]
+    assert cache.loads == ["a", "b", "c", "b"]
+
+
+def test_models_in_use_are_not_evicted(models):
+    cache = models(max_loaded=1)
+    loaded = threading.Event()
+
+    def load_b():
+        use(cache, "b")
+        loaded.set()
+
+    with cache.use("a"):
+        thread = threading.Thread(target=load_b)
+        thread.start()
+        # b waits for a to be released instead of evicting it.
+        assert not loaded.wait(0.2)
+        assert cache.loaded() == ["a"]
+    thread.join(5)
+
+    assert loaded.is_set()
+    assert cache.loaded() == ["b"]
+
+
+def test_unknown_models_are_rejected(models):
+    with pytest.raises(ValueError, match="Unknown model 'd', available: a, b, c"):
+        use(models(max_loaded=2), "d")
+
+
+def test_parse_models(main):
+    assert main.parse_models(" small, no=NbAiLab/nb-whisper-large,") == {
+        "small": "small",
+        "no": "NbAiLab/nb-whisper-large",
+    }
@@ -0,0 +1,43 @@
+import json
+
+
+def test_s3_result_store_round_trip(main, s3):
+    store = main.S3ResultStore("test-bucket", "jobs/")
+    record = {"status": "completed", "output": {"segments": [], "language": "en"}}
+    store.put("job-1", record)
+
+    assert store.get("job-1") == record
+    stored = s3.get_object(Bucket="test-bucket", Key="jobs/job-1.json")
+    assert stored["ContentType"] == "application/json"
+    assert json.loads(stored["Body"].read()) == record
+
+
+def test_s3_result_store_overwrites_records(main, s3):
+    store = main.S3ResultStore("test-bucket", "jobs/")
+    store.put("job-1", {"status": "queued"})
+    store.put("job-1", {"status": "completed"})
+
+    assert store.get("job-1") == {"status": "completed"}
+
+
+def test_s3_result_store_missing_job(main, s3):
+    store = main.S3ResultStore("test-bucket", "jobs/")
+
+    assert store.get("unknown") is None
+
+
+def test_create_result_store_from_environment(main, s3, monkeypatch):
+    monkeypatch.setenv("RESULT_STORE", "s3")
+    monkeypatch.setenv("RESULT_STORE_BUCKET", "test-bucket")
+    store = main.create_result_store()
+
+    assert isinstance(store, main.S3ResultStore)
+    assert (store.bucket, store.prefix) == ("test-bucket", "jobs/")
+
+
+def test_local_result_store_round_trip(main, tmp_path):
+    store = main.LocalResultStore(str(tmp_path / "results"))
+    store.put("job-1", {"status": "completed"})
+
+    assert store.get("job-1") == {"status": "completed"}
+    assert store.get("unknown") is None
@@ -0,0 +1,80 @@
+import json
+
+import pytest
+from fastapi import HTTPException
+
+
+def parse_events(text):
+    """Splits a Server-Sent Events body into (event, data) pairs."""
+    events = []
+    for block in text.split("\n\n")[:-1]:
+        event, data = block.split("\n")
+        assert event.startswith("event: ") and data.startswith("data: ")
+        events.append((event[len("event: ") :], json.loads(data[len("data: ") :])))
+    return events
+
+
+@pytest.fixture
+def prediction(main, monkeypatch):
+    """Replaces run_prediction with one that decodes a single segment."""
+
+    async def run_prediction(input_data, predict_request, timings, **callbacks):
+        if input_data["file_url"].endswith("missing.wav"):
+            raise HTTPException(status_code=400, detail="Failed to download file")
+        callbacks["progress"]("transcribing", 0.0)
+        callbacks["progress"]("transcribing", 50.0)
+        words = [{"start": 0.0, "end": 0.5, "word": " hello", "probability": 0.9}]
+        segment = {"start": 0.0, "end": 0.5, "avg_logprob": -0.1, "text": " hello"}
+        callbacks["on_segment"](dict(segment, words=words))
+        callbacks["progress"]("diarizing", 100.0)
+        return main.Output(segments=[dict(segment, speaker="SPEAKER_00")])
+
+    monkeypatch.setattr(main, "run_prediction", run_prediction)
+
+
+def stream(client, file_url, **options):
+    body = {"input": {"file_url": file_url, **options}}
+    return client.post("/predict/stream", json=body)
+
+
+def test_stream_events(client, prediction):
+    response = stream(client, "https://example.com/a.wav", offset_seconds=10)
+
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.headers["cache-control"] == "no-cache"
+    events = parse_events(response.text)
+    assert [event for event, _ in events] == [
+        "progress",
+        "segment",
+        "progress",
+        "result",
+    ]
+    # Progress is only reported when the stage changes.
+    assert events[0][1] == {"stage": "transcribing"}
+    assert events[2][1] == {"stage": "diarizing"}
+    # Segments are shifted by the offset and stripped, like the final output.
+    segment = events[1][1]
+    assert (segment["index"], segment["start"], segment["end"]) == (0, 10.0, 10.5)
+    assert segment["text"] == "hello"
+    assert segment["words"][0] == {
+        "start": 10.0,
+        "end": 10.5,
+        "word": "hello",
+        "probability": 0.9,
+    }
+    assert events[3][1]["segments"][0]["speaker"] == "SPEAKER_00"
+
+
+def test_stream_failures_end_with_an_error_event(client, prediction):
+    response = stream(client, "https://example.com/missing.wav")
+
+    assert response.status_code == 200
+    assert parse_events(response.text) == [
+        ("error", {"status_code": 400, "detail": "Failed to download file"})
+    ]
+
+
+def test_format_event(main):
+    assert main.format_event("progress", {"stage": "queued"}) == (
+        'event: progress\ndata: {"stage": "queued"}\n\n'
+    )
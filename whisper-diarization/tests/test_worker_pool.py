@@ -0,0 +1,206 @@
+import multiprocessing
+import threading
+import time
+import types
+
+import pytest
+from fastapi import HTTPException
+
+
+class ChildConnection:
+    """The worker's end of the pipe, which the API process cannot close for it."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def close(self):
+        pass
+
+
+class ThreadProcess:
+    """Runs a model worker in a thread instead of a spawned process."""
+
+    _pids = iter(range(1000, 2000))
+
+    def __init__(self, target, args, name, daemon):
+        self.pid = next(self._pids)
+        self.exitcode = None
+        self._target, (self._connection,) = target, args
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def _run(self):
+        connection = self._connection.connection
+        try:
+            self.exitcode = self._target(connection)
+        finally:
+            connection.close()
+
+    def start(self):
+        self._thread.start()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def kill(self):
+        pass
+
+
+def stub_worker(connection):
+    """
+    A model worker without models. Calls answer after `seconds`, or never with
+    `hang`; `crash` exits the worker and `fail_to_load` fails its startup.
+    """
+    if stub_worker.fail_to_load:
+        connection.send(("failed", "No GPU"))
+        return 1
+    connection.send(("ready", {"load": 0.1}))
+    device = threading.current_thread().name
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return 0
+        if message is None:
+            return 0
+        call_id, audio, kwargs, report_progress, stream = message
+        if kwargs.get("crash"):
+            return 1
+        if kwargs.get("hang"):
+            continue
+        if report_progress:
+            connection.send(("progress", call_id, "transcribing", 50.0))
+        result = ([{"device": device, "samples": len(audio)}], 1, "en")
+        memory = {"peak_rss_mb": 100.0}
+        connection.send(("result", call_id, result, {"transcribe": 0.1}, memory))
+
+
+def pipe():
+    parent, child = multiprocessing.Pipe()
+    return parent, ChildConnection(child)
+
+
+@pytest.fixture
+def pool(main, monkeypatch):
+    context = types.SimpleNamespace(Pipe=pipe, Process=ThreadProcess)
+    monkeypatch.setattr(
+        main,
+        "multiprocessing",
+        types.SimpleNamespace(get_context=lambda method: context),
+    )
+    monkeypatch.setattr(main, "run_model_worker", stub_worker)
+    stub_worker.fail_to_load = False
+    pools = []
+
+    def create(devices):
+        pool = main.ModelWorkerPool(devices)
+        pools.append(pool)
+        return pool
+
+    yield create
+    for pool in pools:
+        pool.stop()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def call(pool, **kwargs):
+    """Runs pool.speech_to_text in a thread."""
+    outcome = types.SimpleNamespace(result=None, error=None)
+
+    def run():
+        try:
+            outcome.result = pool.speech_to_text([0.0] * 16, **kwargs)
+        except Exception as e:
+            outcome.error = e
+
+    outcome.thread = threading.Thread(target=run)
+    outcome.thread.start()
+    return outcome
+
+
+def test_calls_return_the_worker_timings_and_memory(pool):
+    pool = pool([0])
+    pool.start()
+    timings, memory, progress = {}, {}, []
+
+    result = pool.speech_to_text(
+        [0.0] * 16,
+        timings=timings,
+        memory=memory,
+        progress=lambda *args: progress.append(args),
+    )
+
+    assert result == ([{"device": "model-worker-0", "samples": 16}], 1, "en")
+    assert timings == {"transcribe": 0.1}
+    assert memory == {"peak_rss_mb": 100.0}
+    assert progress == [("transcribing", 50.0)]
+
+
+def test_calls_go_to_the_least_busy_worker(pool):
+    pool = pool([0, 1])
+    pool.start()
+    busy = pool.workers[0]
+    hanging = call(pool, hang=True)
+    wait_for(lambda: busy.load == 1 or pool.workers[1].load == 1)
+    idle = pool.workers[1] if busy.load else busy
+
+    result = pool.speech_to_text([0.0])
+
+    assert result[0][0]["device"] == f"model-worker-{idle.device}"
+    assert hanging.thread.is_alive()
+
+
+def test_worker_exit_fails_the_calls_in_flight(main, pool, monkeypatch):
+    monkeypatch.setattr(main, "model_worker_max_restarts", 0)
+    pool = pool([0])
+    pool.start()
+    (worker,) = pool.workers
+    hanging = call(pool, hang=True)
+    wait_for(lambda: worker.load == 1)
+
+    crashing = call(pool, crash=True)
+    for outcome in (hanging, crashing):
+        outcome.thread.join(5)
+        assert isinstance(outcome.error, HTTPException)
+        assert outcome.error.status_code == 503
+        assert outcome.error.headers == {"Retry-After": "30"}
+
+    # Past the restart cap the worker stays down and new calls are refused.
+    wait_for(lambda: worker.report()["state"] == "failed")
+    assert worker.report()["error"] == "Exited 1 times in a row, last code 1"
+    with pytest.raises(HTTPException) as refused:
+        pool.speech_to_text([0.0])
+    assert refused.value.status_code == 503
+
+
+def test_crashed_worker_is_restarted(pool):
+    pool = pool([0])
+    pool.start()
+    (worker,) = pool.workers
+
+    crashing = call(pool, crash=True)
+    crashing.thread.join(5)
+    assert crashing.error.status_code == 503
+
+    # The first restart comes after a second of backoff.
+    wait_for(lambda: worker.report()["state"] == "restarting")
+    wait_for(lambda: worker.report()["state"] == "ready")
+    assert worker.restarts == 1
+    assert pool.speech_to_text([0.0])[2] == "en"
+
+
+def test_workers_that_fail_to_load_fail_the_startup(pool):
+    stub_worker.fail_to_load = True
+    pool = pool([0])
+
+    with pytest.raises(RuntimeError, match="cuda:0: No GPU"):
+        pool.start()
+    assert pool.report()[0]["state"] == "failed"
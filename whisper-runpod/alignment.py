@@ -0,0 +1,302 @@
+import itertools
+import re
+
+import numpy as np
+from scipy.cluster.hierarchy import fcluster, linkage
+
+
+def diarization_turns(turns):
+    """
+    Flattens a list of (start, end, speaker) turns into NumPy arrays of turn
+    boundaries and speaker indices, plus the list of speaker labels the indices
+    refer to.
+    """
+    labels = sorted({speaker for _, _, speaker in turns})
+    speaker_index = {label: i for i, label in enumerate(labels)}
+    starts = np.array([start for start, _, _ in turns], dtype=np.float64)
+    ends = np.array([end for _, end, _ in turns], dtype=np.float64)
+    speakers = np.array([speaker_index[s] for _, _, s in turns], dtype=np.int64)
+    return starts, ends, speakers, labels
+
+
+def speaker_overlaps(starts, ends, speakers, num_speakers, word_starts, word_ends):
+    """
+    Returns a (num_words, num_speakers) matrix with the time each speaker talks
+    during each word interval.
+
+    Turn boundaries split the timeline into elementary intervals. For every
+    speaker, its (possibly overlapping) turns are integrated into a cumulative
+    speaking-time curve over those boundaries, so the overlap with any interval is
+    the difference of two interpolated lookups: O((n + m) log m) per speaker for n
+    words and m turns.
+    """
+    boundaries = np.unique(np.concatenate([starts, ends]))
+    start_idx = np.searchsorted(boundaries, starts)
+    end_idx = np.searchsorted(boundaries, ends)
+    widths = np.diff(boundaries)
+
+    overlaps = np.zeros((len(word_starts), num_speakers))
+    for speaker in range(num_speakers):
+        mask = speakers == speaker
+        active = np.zeros(len(boundaries))
+        np.add.at(active, start_idx[mask], 1)
+        np.add.at(active, end_idx[mask], -1)
+        covered = np.cumsum(active)[:-1] > 0
+        speaking_time = np.concatenate([[0.0], np.cumsum(covered * widths)])
+        overlaps[:, speaker] = np.interp(
+            word_ends, boundaries, speaking_time
+        ) - np.interp(word_starts, boundaries, speaking_time)
+    return overlaps
+
+
+def nearest_speakers(starts, ends, speakers, word_starts, word_ends):
+    """
+    For intervals that overlap no turn, returns the speaker of the closest turn:
+    either the next turn to start or the latest turn to end before the interval.
+    """
+    order = np.argsort(starts, kind="stable")
+    starts, ends, speakers = starts[order], ends[order], speakers[order]
+    # For every prefix of turns sorted by start, the turn that ends last.
+    latest_end = np.maximum.accumulate(ends)
+    latest_idx = np.maximum.accumulate(
+        np.where(ends >= latest_end, np.arange(len(ends)), 0)
+    )
+
+    next_idx = np.searchsorted(starts, (word_starts + word_ends) / 2)
+    previous_idx = np.maximum(next_idx - 1, 0)
+    following_idx = np.minimum(next_idx, len(starts) - 1)
+
+    next_gap = np.where(
+        next_idx < len(starts), starts[following_idx] - word_ends, np.inf
+    )
+    previous_gap = np.where(
+        next_idx > 0, word_starts - latest_end[previous_idx], np.inf
+    )
+    return np.where(
+        previous_gap <= next_gap,
+        speakers[latest_idx[previous_idx]],
+        speakers[following_idx],
+    )
+
+
+def assign_speakers(segments, turns, offset_seconds=0, margin=0.1):
+    """
+    Labels every word with the speaker whose turns overlap it the most, and
+    splits Whisper segments wherever the speaker changes.
+
+    Words that fall into gaps between turns go to the nearest turn instead of
+    being dropped; segments without word timestamps are assigned as a whole.
+    Returns the speaker-labelled segments and the number of detected speakers.
+    """
+    starts, ends, speakers, labels = diarization_turns(turns)
+
+    # One unit per word, or per segment when it has no word timestamps.
+    units = []
+    for segment_index, segment in enumerate(segments):
+        for word in segment["words"] or [None]:
+            units.append((segment_index, word))
+    if not units:
+        return [], len(labels)
+
+    intervals = [word or segments[i] for i, word in units]
+    # Whisper timestamps include offset_seconds, diarization turns do not.
+    unit_starts = np.array([u["start"] for u in intervals]) - offset_seconds - margin
+    unit_ends = np.array([u["end"] for u in intervals]) - offset_seconds + margin
+
+    if labels:
+        overlaps = speaker_overlaps(
+            starts, ends, speakers, len(labels), unit_starts, unit_ends
+        )
+        unit_speakers = overlaps.argmax(axis=1)
+        silent = overlaps.max(axis=1) <= 0
+        if silent.any():
+            unit_speakers[silent] = nearest_speakers(
+                starts, ends, speakers, unit_starts[silent], unit_ends[silent]
+            )
+        unit_labels = [labels[speaker] for speaker in unit_speakers]
+    else:
+        unit_labels = [None] * len(units)
+
+    final_segments = []
+    segment_indices = []
+    pieces = itertools.groupby(
+        zip(units, unit_labels), key=lambda unit: (unit[0][0], unit[1])
+    )
+    for (segment_index, speaker), group in pieces:
+        segment = segments[segment_index]
+        words = [word for (_, word), _ in group if word is not None]
+        if words:
+            text = re.sub("  ", " ", "".join(w["word"] for w in words)).strip()
+            for word in words:
+                word["word"] = word["word"].strip()
+            start, end = words[0]["start"], words[-1]["end"]
+        else:
+            text, start, end = segment["text"].strip(), segment["start"], segment["end"]
+        final_segments.append(
+            {
+                "avg_logprob": segment["avg_logprob"],
+                "start": start,
+                "end": end,
+                "speaker": speaker,
+                "text": text,
+                "words": words,
+            }
+        )
+        segment_indices.append(segment_index)
+
+    # The first and last piece of each segment keep the segment boundaries.
+    for i, segment_index in enumerate(segment_indices):
+        if i == 0 or segment_indices[i - 1] != segment_index:
+            final_segments[i]["start"] = segments[segment_index]["start"]
+        if i == len(segment_indices) - 1 or segment_indices[i + 1] != segment_index:
+            final_segments[i]["end"] = segments[segment_index]["end"]
+    return final_segments, len(labels)
+
+
+def diarization_windows(duration, window, overlap):
+    """
+    Splits [0, duration] into windows of `window` seconds overlapping by `overlap`
+    seconds. Returns (start, end, core_start, core_end) tuples; the core regions
+    tile the timeline and give each window the half of an overlap closest to it.
+    """
+    if not 0 <= overlap < window:
+        raise ValueError("The window overlap must be shorter than the window")
+    step = window - overlap
+    starts = [0.0]
+    while starts[-1] + window < duration:
+        starts.append(starts[-1] + step)
+
+    windows = []
+    for i, start in enumerate(starts):
+        core_start = 0.0 if i == 0 else start + overlap / 2
+        core_end = duration if i == len(starts) - 1 else start + window - overlap / 2
+        windows.append((start, min(start + window, duration), core_start, core_end))
+    return windows
+
+
+def restore_turns(turns, regions):
+    """
+    Maps [start, end, speaker] turns found on the concatenation of the speech
+    `regions`, (start, end) pairs in seconds, back to the original timeline. Turns
+    that span several regions are split at the region boundaries.
+    """
+    if not regions:
+        return []
+    region_starts = np.array([start for start, _ in regions], dtype=np.float64)
+    region_ends = np.array([end for _, end in regions], dtype=np.float64)
+    # Where each region starts and ends in the concatenated audio.
+    offsets = np.concatenate([[0.0], np.cumsum(region_ends - region_starts)])
+
+    restored = []
+    for start, end, speaker in turns:
+        first = max(int(np.searchsorted(offsets, start, side="right")) - 1, 0)
+        last = min(int(np.searchsorted(offsets, end, side="left")), len(regions))
+        for i in range(first, last):
+            piece_start = max(start, offsets[i])
+            piece_end = min(end, offsets[i + 1])
+            if piece_start < piece_end:
+                shift = region_starts[i] - offsets[i]
+                restored.append(
+                    [float(piece_start + shift), float(piece_end + shift), speaker]
+                )
+    return restored
+
+
+def cluster_speakers(embeddings, threshold, method="centroid", num_speakers=None):
+    """
+    Groups speaker embeddings with agglomerative clustering of the unit-normalized
+    embeddings, as pyannote does within a file. With `num_speakers` the dendrogram
+    is cut into that many clusters instead of at `threshold`. Returns one cluster
+    index per embedding, numbered from 0.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float64)
+    if len(embeddings) < 2:
+        return np.zeros(len(embeddings), dtype=np.int64)
+    normalized = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    dendrogram = linkage(normalized, method=method, metric="euclidean")
+    if num_speakers:
+        clusters = fcluster(dendrogram, num_speakers, criterion="maxclust")
+    else:
+        clusters = fcluster(dendrogram, threshold, criterion="distance")
+    return np.unique(clusters, return_inverse=True)[1]
+
+
+def stitch_windows(
+    windows,
+    window_turns,
+    window_embeddings,
+    threshold,
+    method="centroid",
+    num_speakers=None,
+):
+    """
+    Combines per-window diarization into [start, end, speaker] turns over the
+    whole recording.
+
+    `window_turns[i]` holds the turns of window i in absolute time and
+    `window_embeddings[i]` maps each of its speakers to an embedding. Speakers are
+    matched across windows by clustering their embeddings, and each window only
+    contributes its turns cropped to its core region.
+    """
+    keys, vectors = [], []
+    for i, embeddings in enumerate(window_embeddings):
+        for speaker, embedding in embeddings.items():
+            # pyannote pads the embeddings of speakers it could not embed with zeros.
+            if np.all(np.isfinite(embedding)) and np.any(embedding):
+                keys.append((i, speaker))
+                vectors.append(embedding)
+    clusters = cluster_speakers(vectors, threshold, method, num_speakers)
+    labels = {key: f"SPEAKER_{cluster:02d}" for key, cluster in zip(keys, clusters)}
+
+    turns = []
+    for i, (_, _, core_start, core_end) in enumerate(windows):
+        for start, end, speaker in window_turns[i]:
+            # Speakers without an embedding cannot be matched across windows; their
+            # words go to the nearest matched speaker during alignment.
+            if (i, speaker) not in labels:
+                continue
+            start, end = max(start, core_start), min(end, core_end)
+            if start < end:
+                turns.append([start, end, labels[i, speaker]])
+    turns.sort(key=lambda turn: turn[0])
+    return turns
+
+
+class OnlineSpeakers:
+    """
+    Labels a stream of utterance embeddings with speakers. An embedding joins the
+    closest known speaker when it lies within `threshold` of its centroid (euclidean
+    distance between unit-normalized embeddings, as in cluster_speakers) and starts
+    a new speaker otherwise, unless `max_speakers` are known already.
+    """
+
+    def __init__(self, threshold, max_speakers=None):
+        self.threshold = threshold
+        self.max_speakers = max_speakers
+        self.centroids = []
+        self.counts = []
+
+    def assign(self, embedding):
+        """Returns the speaker label of `embedding`, or None if it is unusable."""
+        embedding = np.asarray(embedding, dtype=np.float64)
+        if not np.all(np.isfinite(embedding)) or not np.any(embedding):
+            return None
+        embedding = embedding / np.linalg.norm(embedding)
+
+        if self.centroids:
+            centroids = np.array(self.centroids)
+            centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+            distances = np.linalg.norm(centroids - embedding, axis=1)
+            nearest = int(distances.argmin())
+            full = self.max_speakers and len(self.centroids) >= self.max_speakers
+            if distances[nearest] <= self.threshold or full:
+                # Running mean of the embeddings assigned to the speaker.
+                self.counts[nearest] += 1
+                self.centroids[nearest] += (
+                    embedding - self.centroids[nearest]
+                ) / self.counts[nearest]
+                return f"SPEAKER_{nearest:02d}"
+
+        self.centroids.append(embedding)
+        self.counts.append(1)
+        return f"SPEAKER_{len(self.centroids) - 1:02d}"
@@ -1,10 +1,16 @@
+import asyncio
 import logging
 import subprocess
 import os
+import resource
 import requests
+import tempfile
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import torch
-import re
 import sys
 import json
 
@@ -12,11 +18,18 @@ from pydantic import BaseModel
 from typing import Optional
 
 from faster_whisper import WhisperModel
+from faster_whisper.vad import SpeechTimestampsMap, VadOptions, get_speech_timestamps
 from pyannote.audio import Pipeline
-import torchaudio
+
+from alignment import (
+    assign_speakers,
+    diarization_windows,
+    restore_turns,
+    stitch_windows,
+)
 
 # Configure logging
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
 
@@ -26,11 +39,34 @@ if not hugging_face_token:
     raise ValueError("The HUGGING_FACE_TOKEN environment variable is not set.")
 
 
+# Downloads are streamed to temporary files in DOWNLOAD_DIR and capped at
+# MAX_DOWNLOAD_MB. Files larger than one DOWNLOAD_PART_MB part are fetched as ranges,
+# DOWNLOAD_CONCURRENCY at a time, when the origin (or S3) supports it.
+max_download_bytes = int(float(os.getenv("MAX_DOWNLOAD_MB", "4096")) * 2**20)
+download_part_bytes = int(float(os.getenv("DOWNLOAD_PART_MB", "16")) * 2**20)
+download_concurrency = int(os.getenv("DOWNLOAD_CONCURRENCY", "8"))
+download_dir = os.getenv("DOWNLOAD_DIR") or None
+# Connect and read timeouts; the read timeout applies between chunks, not to the
+# whole transfer.
+download_timeout = (10, float(os.getenv("DOWNLOAD_READ_TIMEOUT", "30")))
+# One pooled session, so connections are kept alive across invocations of a worker.
+http_session = requests.Session()
+http_session.mount(
+    "https://", requests.adapters.HTTPAdapter(pool_maxsize=download_concurrency)
+)
+http_session.mount(
+    "http://", requests.adapters.HTTPAdapter(pool_maxsize=download_concurrency)
+)
+s3_client = None
+
+
 # Models
 class Output(BaseModel):
     segments: list
     language: Optional[str] = None
     num_speakers: Optional[int] = None
+    timings: Optional[dict] = None
+    memory: Optional[dict] = None
 
 
 class PredictRequest(BaseModel):
@@ -45,95 +81,326 @@ class PredictRequest(BaseModel):
     language: Optional[str] = None
     prompt: Optional[str] = None
     offset_seconds: int = 0
+    # Silero VAD options, see vad_parameters.
+    vad_filter: bool = True
+    vad_threshold: float = 0.5
+    vad_min_silence_ms: int = 1000
+    vad_speech_pad_ms: int = 400
 
 
+SAMPLE_RATE = 16000
+
+# Run transcription (CTranslate2) and diarization (PyTorch) side by side instead of
+# one after the other. Set CONCURRENT_STAGES=0 to fall back to sequential execution.
+concurrent_stages = os.getenv("CONCURRENT_STAGES", "1") != "0"
+# Jobs the serverless worker may run at once, see concurrency_modifier.
+worker_max_concurrency = int(os.getenv("WORKER_MAX_CONCURRENCY", "1"))
+stage_executor = ThreadPoolExecutor(
+    max_workers=2 * worker_max_concurrency, thread_name_prefix="stage"
+)
+
 # Model initializations
-model_name = "NbAiLab/nb-whisper-large"
+# Model precision and placement are configurable at startup. On GPU-less boxes the
+# defaults switch to CPU with int8 quantization.
+model_name = os.getenv("WHISPER_MODEL", "NbAiLab/nb-whisper-large")
+whisper_device = os.getenv(
+    "WHISPER_DEVICE", "cuda" if torch.cuda.is_available() else "cpu"
+)
+whisper_device_index = int(os.getenv("WHISPER_DEVICE_INDEX", "0"))
+whisper_compute_type = os.getenv(
+    "WHISPER_COMPUTE_TYPE", "float32" if whisper_device == "cuda" else "int8"
+)
 whisper_model = WhisperModel(
     model_name,
-    device="cuda" if torch.cuda.is_available() else "cpu",
-    compute_type="float32",
+    device=whisper_device,
+    device_index=whisper_device_index,
+    compute_type=whisper_compute_type,
+    cpu_threads=int(os.getenv("WHISPER_CPU_THREADS", "0")),
+    num_workers=int(os.getenv("WHISPER_NUM_WORKERS", "1")),
+)
+logger.info(
+    "Loaded %s on %s:%d with compute type %s",
+    model_name,
+    whisper_device,
+    whisper_device_index,
+    whisper_compute_type,
 )
 
+diarization_device = os.getenv(
+    "DIARIZATION_DEVICE",
+    f"cuda:{whisper_device_index}" if whisper_device == "cuda" else "cpu",
+)
+# pyannote pipelines are not guaranteed to be thread-safe.
+diarization_lock = threading.Lock()
 diarization_model = Pipeline.from_pretrained(
     "pyannote/speaker-diarization-3.1",
     use_auth_token=hugging_face_token,
-).to(torch.device("cuda"))
+).to(torch.device(diarization_device))
 
 
-def predict(event: dict, predict_request: PredictRequest) -> Output:
-    logger.debug("Received predict event")
-    temp_wav_filename = f"temp-{time.time_ns()}.wav"
-    temp_input_filename = None
-    try:
-        # Instead of awaiting request.json(), we simply use the provided event dict.
-        body = event
-        logger.debug("Received event: %s", body)
+# Recordings longer than LONG_FORM_DIARIZATION_SECONDS are diarized in overlapping
+# windows, so the memory used by pyannote depends on the window length instead of
+# the recording length; 0 disables the long-form mode. Speakers are matched across
+# windows by clustering their embeddings, by default with the pipeline's own
+# clustering threshold.
+long_form_diarization_seconds = float(
+    os.getenv("LONG_FORM_DIARIZATION_SECONDS", "1800")
+)
+diarization_window_seconds = float(os.getenv("DIARIZATION_WINDOW_SECONDS", "600"))
+diarization_window_overlap_seconds = float(
+    os.getenv("DIARIZATION_WINDOW_OVERLAP_SECONDS", "30")
+)
+diarization_cluster_threshold = float(
+    os.getenv(
+        "DIARIZATION_CLUSTER_THRESHOLD", str(diarization_model.clustering.threshold)
+    )
+)
 
-        if "input" not in body:
-            raise ValueError("Missing 'input' field in event body")
 
-        input_data = body["input"]
-        file_url = input_data.get("file_url")
-        file_from_json = input_data.get(
-            "file"
-        )  # if 'file' is a URL, handle it like file_url
+class PeakMemory:
+    """
+    Samples the resident set size of the process and the memory in use on the CUDA
+    devices of the models while the block runs, and keeps the peaks. Both are
+    process (or device) wide: with several GPU workers they include concurrent
+    requests, and the VRAM figure includes the loaded models.
+    """
 
-        logger.debug("file_url: %s", file_url)
-        logger.debug("file (from JSON): %s", file_from_json)
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_vram = 0
+        devices = (f"{whisper_device}:{whisper_device_index}", diarization_device)
+        self._devices = {
+            torch.device(device) for device in devices if device.startswith("cuda")
+        }
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
 
-        temp_input_filename = f"temp-{time.time_ns()}.input"
+    def _rss(self) -> int:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError:
+            # Lifetime peak of the process (in KiB on Linux) where /proc is missing.
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
 
-        if file_url or file_from_json:
-            download_url = file_url if file_url else file_from_json
-            logger.debug("Downloading file from URL: %s", download_url)
+    def _vram(self) -> int:
+        used = 0
+        for device in self._devices:
+            free, total = torch.cuda.mem_get_info(device)
+            used += total - free
+        return used
 
-            headers = {"User-Agent": "File-Downloader"}
-            response = requests.get(
-                download_url, headers=headers, timeout=10, allow_redirects=True
-            )
+    def _sample(self):
+        self.peak_rss = max(self.peak_rss, self._rss())
+        self.peak_vram = max(self.peak_vram, self._vram())
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self._sample()
 
-            if response.status_code != 200:
-                logger.error("Failed to download file from URL: %s", download_url)
+    def __enter__(self):
+        self._sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+        self._sample()
+
+    def report(self) -> dict:
+        report = {"peak_rss_mb": round(self.peak_rss / 2**20, 1)}
+        if self._devices:
+            report["peak_vram_mb"] = round(self.peak_vram / 2**20, 1)
+        return report
+
+
+def check_download_size(size: Optional[int]):
+    if size is not None and size > max_download_bytes:
+        raise ValueError(f"File is larger than {max_download_bytes // 2**20} MB")
+
+
+def write_body(response, fd: int, offset: int = 0) -> int:
+    """Streams a response body into `fd` at `offset`; returns the end offset."""
+    for chunk in response.iter_content(1 << 20):
+        os.pwrite(fd, chunk, offset)
+        offset += len(chunk)
+        check_download_size(offset)
+    return offset
+
+
+def fetch_range(url: str, fd: int, start: int, end: int, headers: dict):
+    with http_session.get(
+        url,
+        headers={**headers, "Range": f"bytes={start}-{end}"},
+        stream=True,
+        timeout=download_timeout,
+    ) as response:
+        if response.status_code != 206:
+            raise ValueError("Failed to download file from URL")
+        if write_body(response, fd, start) != end + 1:
+            raise ValueError("Incomplete download from URL")
+
+
+def content_range_total(value: Optional[str]) -> Optional[int]:
+    """The length in a Content-Range header, None if missing or unknown (`*`)."""
+    total = (value or "").rsplit("/", 1)[-1].strip()
+    return int(total) if total.isdigit() else None
+
+
+def download_http(url: str, path: str):
+    """
+    Streams `url` to `path`. The first request only asks for the first part: if
+    the origin answers with a range, the remaining parts are fetched in parallel,
+    otherwise the whole body is streamed from that first response.
+    """
+    headers = {"User-Agent": "File-Downloader"}
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        with http_session.get(
+            url,
+            headers={**headers, "Range": f"bytes=0-{download_part_bytes - 1}"},
+            stream=True,
+            timeout=download_timeout,
+            allow_redirects=True,
+        ) as response:
+            if response.status_code == 200:
+                content_length = response.headers.get("Content-Length")
+                check_download_size(int(content_length) if content_length else None)
+                write_body(response, fd)
+                return
+            if response.status_code != 206:
+                logger.error("Failed to download file from URL: %s", url)
                 raise ValueError("Failed to download file from URL")
+            total = content_range_total(response.headers.get("Content-Range"))
+            if total is not None:
+                check_download_size(total)
+                # Ranged requests go to the final URL of a redirect (e.g. presigned).
+                url = response.url
+                write_body(response, fd)
 
-            with open(temp_input_filename, "wb") as f:
-                f.write(response.content)
-            logger.debug("File downloaded and saved as %s", temp_input_filename)
-
-            result = subprocess.run(
-                [
-                    "ffmpeg",
-                    "-i",
-                    temp_input_filename,
-                    "-ar",
-                    "16000",
-                    "-ac",
-                    "1",
-                    "-c:a",
-                    "pcm_s16le",
-                    temp_wav_filename,
-                ],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-            )
-            logger.debug("ffmpeg output: %s", result.stdout)
-            logger.debug("ffmpeg error: %s", result.stderr)
-            if result.returncode != 0:
-                raise RuntimeError(
-                    f"ffmpeg failed with return code {result.returncode}"
+        if total is None:
+            # The size is unknown, so download the whole file in a single request.
+            with http_session.get(
+                url,
+                headers=headers,
+                stream=True,
+                timeout=download_timeout,
+                allow_redirects=True,
+            ) as response:
+                if response.status_code != 200:
+                    raise ValueError("Failed to download file from URL")
+                write_body(response, fd)
+            return
+
+        starts = range(download_part_bytes, total, download_part_bytes)
+        with ThreadPoolExecutor(max_workers=download_concurrency) as pool:
+            futures = [
+                pool.submit(
+                    fetch_range,
+                    url,
+                    fd,
+                    start,
+                    min(start + download_part_bytes, total) - 1,
+                    headers,
                 )
-            if os.path.exists(temp_input_filename):
-                os.remove(temp_input_filename)
-                logger.debug("Temporary audio file removed")
+                for start in starts
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        os.close(fd)
+
+
+def get_s3_client():
+    global s3_client
+    if s3_client is None:
+        import boto3
+
+        s3_client = boto3.client("s3", endpoint_url=os.getenv("S3_ENDPOINT_URL"))
+    return s3_client
+
+
+def download_s3(url: str, path: str):
+    """Downloads an s3://bucket/key object with parallel ranged GETs."""
+    from boto3.s3.transfer import TransferConfig
+
+    bucket, _, key = url[len("s3://") :].partition("/")
+    client = get_s3_client()
+    check_download_size(client.head_object(Bucket=bucket, Key=key)["ContentLength"])
+    client.download_file(
+        bucket,
+        key,
+        path,
+        Config=TransferConfig(
+            multipart_threshold=download_part_bytes,
+            multipart_chunksize=download_part_bytes,
+            max_concurrency=download_concurrency,
+        ),
+    )
+
+
+def download_input(input_data: dict, timings: dict) -> str:
+    """
+    Downloads the file referenced by `file_url` (or `file`) to a temporary file
+    and returns its path; the caller removes it. http(s) and s3:// URLs are
+    supported, both capped at MAX_DOWNLOAD_MB.
+    """
+    file_url = input_data.get("file_url")
+    file_from_json = input_data.get(
+        "file"
+    )  # if 'file' is a URL, handle it like file_url
+
+    logger.debug("file_url: %s", file_url)
+    logger.debug("file (from JSON): %s", file_from_json)
+
+    if not (file_url or file_from_json):
+        raise ValueError("Either 'file', 'file_url', or uploaded file must be provided")
+
+    download_url = file_url if file_url else file_from_json
+    logger.debug("Downloading file from URL: %s", download_url)
+    time_download_start = time.time()
+
+    fd, path = tempfile.mkstemp(dir=download_dir, suffix=".download")
+    os.close(fd)
+    try:
+        if download_url.startswith("s3://"):
+            download_s3(download_url, path)
         else:
-            raise ValueError(
-                "Either 'file', 'file_url', or uploaded file must be provided"
-            )
+            download_http(download_url, path)
+    except BaseException:
+        os.remove(path)
+        raise
+    logger.debug("File downloaded (%d bytes)", os.path.getsize(path))
+    timings["download"] = time.time() - time_download_start
+    return path
 
-        logger.debug("Starting speech-to-text processing")
+
+def load_audio(input_data: dict, timings: dict) -> np.ndarray:
+    """Downloads and decodes the input file."""
+    try:
+        path = download_input(input_data, timings)
+    except requests.exceptions.RequestException as req_err:
+        logger.error("Request error while downloading file: %s", req_err)
+        raise ValueError("Error downloading file: " + str(req_err))
+    try:
+        time_decode_start = time.time()
+        audio = decode_audio(path)
+    finally:
+        os.remove(path)
+    timings["decode"] = time.time() - time_decode_start
+    logger.debug("Decoded %.2f seconds of audio", len(audio) / SAMPLE_RATE)
+    return audio
+
+
+def process_audio(
+    audio, predict_request: PredictRequest, timings: dict, on_segment=None
+) -> Output:
+    logger.debug("Starting speech-to-text processing")
+    with PeakMemory() as memory:
         segments, detected_num_speakers, detected_language = speech_to_text(
-            temp_wav_filename,
+            audio,
             predict_request.num_speakers,
             predict_request.prompt,
             predict_request.offset_seconds,
@@ -142,150 +409,343 @@ def predict(event: dict, predict_request: PredictRequest) -> Output:
             word_timestamps=True,
             transcript_output_format=predict_request.transcript_output_format,
             translate=predict_request.translate,
+            timings=timings,
+            on_segment=on_segment,
+            vad_parameters=vad_parameters(predict_request),
         )
-        logger.debug("Speech-to-text processing completed")
+    logger.debug("Speech-to-text processing completed")
+    logger.info("Peak memory: %s", memory.report())
 
-        return Output(
-            segments=segments,
-            language=detected_language,
-            num_speakers=detected_num_speakers,
-        )
+    return Output(
+        segments=segments,
+        language=detected_language,
+        num_speakers=detected_num_speakers,
+        timings=timings,
+        memory=memory.report(),
+    )
+
+
+def predict(event: dict, predict_request: PredictRequest, on_segment=None) -> Output:
+    logger.debug("Received predict event")
+    timings = {}
+    try:
+        # Instead of awaiting request.json(), we simply use the provided event dict.
+        body = event
+
+        if "input" not in body:
+            raise ValueError("Missing 'input' field in event body")
+
+        audio = load_audio(body["input"], timings)
+        return process_audio(audio, predict_request, timings, on_segment)
 
-    except requests.exceptions.RequestException as req_err:
-        logger.error("Request error while downloading file: %s", req_err)
-        raise ValueError("Error downloading file: " + str(req_err))
     except Exception as e:
         logger.error("Error processing file: %s", e)
         raise e
-    finally:
-        if temp_input_filename and os.path.exists(temp_input_filename):
-            os.remove(temp_input_filename)
-            logger.debug("Temporary input file removed")
 
 
-def speech_to_text(
-    audio_file_wav,
-    num_speakers=None,
+# Batches: an input with `file_urls` processes every file with the shared options.
+# The next BATCH_PREFETCH files are downloaded and decoded while the GPU works on
+# the current one, so it runs the files back to back.
+batch_max_files = int(os.getenv("BATCH_MAX_FILES", "100"))
+batch_prefetch = int(os.getenv("BATCH_PREFETCH", "2"))
+batch_executor = ThreadPoolExecutor(
+    max_workers=max(1, batch_prefetch), thread_name_prefix="batch"
+)
+
+
+def predict_batch(input_data: dict, predict_request: PredictRequest):
+    """
+    Yields one item per URL in `file_urls`, in order. A file that fails is
+    reported in its item and does not fail the batch.
+    """
+    file_urls = input_data["file_urls"]
+    if not isinstance(file_urls, list) or not file_urls:
+        raise ValueError("'file_urls' must be a non-empty list of URLs")
+    if len(file_urls) > batch_max_files:
+        raise ValueError(f"A batch holds at most {batch_max_files} files")
+
+    def load(file_url: str):
+        timings = {}
+        return load_audio({"file_url": file_url}, timings), timings
+
+    loading = deque()
+    for index, file_url in enumerate(file_urls):
+        # Keep the next files loading while this one is processed.
+        while len(loading) <= batch_prefetch and len(loading) + index < len(file_urls):
+            loading.append(
+                batch_executor.submit(load, file_urls[index + len(loading)])
+            )
+        future = loading.popleft()
+        item = {"index": index, "file_url": file_url}
+        try:
+            audio, timings = future.result()
+            output = process_audio(audio, predict_request, timings)
+            del audio
+            item.update(status="completed", result=output.dict())
+        except Exception as e:
+            logger.error("Error processing %s: %s", file_url, e)
+            item.update(status="failed", error=str(e))
+        yield item
+
+
+def decode_audio(path: str) -> np.ndarray:
+    """
+    Decodes an audio/video file to 16 kHz mono float32 PCM in memory. The raw
+    samples are read from ffmpeg's stdout; the input is a file rather than a pipe
+    because some containers (e.g. MP4 with the moov atom at the end) need seeking.
+    """
+    command = [
+        "ffmpeg",
+        "-nostdin",
+        "-threads",
+        "0",
+        "-i",
+        path,
+        "-f",
+        "f32le",
+        "-ac",
+        "1",
+        "-ar",
+        str(SAMPLE_RATE),
+        "pipe:1",
+    ]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        logger.debug("ffmpeg error: %s", result.stderr)
+        raise RuntimeError(f"ffmpeg failed with return code {result.returncode}")
+
+    # Copy into a writable buffer; the same array is shared by Whisper and pyannote.
+    return np.frombuffer(result.stdout, dtype=np.float32).copy()
+
+
+# Speech regions are detected once per request with Silero VAD and shared by both
+# stages: Whisper decodes only the speech and pyannote diarizes the concatenated
+# speech, whose turns are mapped back to the original timeline.
+WHISPER_CHUNK_SECONDS = 30
+DEFAULT_VAD_PARAMETERS = dict(
+    threshold=0.5, min_silence_duration_ms=1000, speech_pad_ms=400
+)
+
+
+def vad_parameters(predict_request: PredictRequest) -> Optional[dict]:
+    """The VAD options of a request, None if it disables the VAD."""
+    if not predict_request.vad_filter:
+        return None
+    return dict(
+        threshold=predict_request.vad_threshold,
+        min_silence_duration_ms=predict_request.vad_min_silence_ms,
+        speech_pad_ms=predict_request.vad_speech_pad_ms,
+    )
+
+
+def detect_speech(audio, vad_parameters: dict) -> list:
+    """Returns the speech regions of the audio as start and end sample offsets."""
+    options = VadOptions(**vad_parameters, max_speech_duration_s=WHISPER_CHUNK_SECONDS)
+    return get_speech_timestamps(audio, options)
+
+
+def speech_audio(audio, speech: list) -> np.ndarray:
+    """Concatenates the speech regions of the audio."""
+    if not speech:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate([audio[region["start"] : region["end"]] for region in speech])
+
+
+def restore_segment(segment: dict, timestamps: SpeechTimestampsMap):
+    """
+    Moves the timestamps of a segment decoded from concatenated speech back to the
+    original timeline, in place. Like faster-whisper's own VAD filter, both ends of
+    a word are resolved against the region of its middle.
+    """
+    words = segment["words"]
+    for word in words:
+        region = timestamps.get_chunk_index((word["start"] + word["end"]) / 2)
+        word["start"] = timestamps.get_original_time(word["start"], region)
+        word["end"] = timestamps.get_original_time(word["end"], region)
+    if words:
+        segment["start"], segment["end"] = words[0]["start"], words[-1]["end"]
+    else:
+        segment["start"] = timestamps.get_original_time(segment["start"])
+        segment["end"] = timestamps.get_original_time(segment["end"])
+
+
+def transcribe(
+    audio,
     prompt="",
-    offset_seconds=0,
-    group_segments=True,
     language=None,
     word_timestamps=True,
-    transcript_output_format="both",
     translate=False,
+    timings=None,
+    on_segment=None,
+    speech=None,
 ):
+    """
+    Runs Whisper over the audio and returns the segments as plain dicts together
+    with the detected language. The stage duration is recorded in `timings`.
+    `on_segment(segment)` receives every segment dict as soon as it is decoded.
+    `speech` holds the speech regions from detect_speech; only those are decoded,
+    and None decodes the whole audio.
+    """
     time_start = time.time()
     logger.debug("Starting transcription")
 
     options = dict(
-        vad_filter=True,
-        vad_parameters=dict(min_silence_duration_ms=1000),
+        vad_filter=False,
         initial_prompt=prompt,
         word_timestamps=word_timestamps,
         language=language,
         task="translate" if translate else "transcribe",
         hotwords=prompt,
     )
-    segments, transcript_info = whisper_model.transcribe(audio_file_wav, **options)
-    segments = list(segments)
-    segments = [
-        {
+    timestamps = None
+    if speech == []:
+        # Nothing to decode; the language cannot be detected either.
+        segments, transcript_info = [], None
+    elif speech:
+        timestamps = SpeechTimestampsMap(speech, SAMPLE_RATE)
+        segments, transcript_info = whisper_model.transcribe(
+            speech_audio(audio, speech), **options
+        )
+    else:
+        segments, transcript_info = whisper_model.transcribe(audio, **options)
+    # Consume the generator segment by segment so that partial results are
+    # reported while Whisper is still decoding.
+    decoded_segments = []
+    for s in segments:
+        segment = {
             "avg_logprob": s.avg_logprob,
-            "start": float(s.start + offset_seconds),
-            "end": float(s.end + offset_seconds),
+            "start": float(s.start),
+            "end": float(s.end),
             "text": s.text,
             "words": [
                 {
-                    "start": float(w.start + offset_seconds),
-                    "end": float(w.end + offset_seconds),
+                    "start": float(w.start),
+                    "end": float(w.end),
                     "word": w.word,
                     "probability": w.probability,
                 }
                 for w in s.words
             ],
         }
-        for s in segments
-    ]
+        if timestamps:
+            restore_segment(segment, timestamps)
+        decoded_segments.append(segment)
+        if on_segment:
+            on_segment(segment)
+    segments = decoded_segments
 
-    time_transcribing_end = time.time()
-    logger.debug(
-        "Transcription completed in %.5f seconds", time_transcribing_end - time_start
-    )
+    elapsed = time.time() - time_start
+    if timings is not None:
+        timings["transcribe"] = elapsed
+    logger.debug("Transcription completed in %.5f seconds", elapsed)
+    return segments, transcript_info and transcript_info.language
 
+
+def diarize(audio, num_speakers=None, timings=None, speech=None):
+    """
+    Runs the pyannote pipeline over the audio and returns the speaker turns as
+    [start, end, speaker] lists. The stage duration is recorded in `timings`.
+    With the `speech` regions from detect_speech, only the concatenated speech is
+    diarized and the turns are mapped back to the original timeline.
+    """
+    time_start = time.time()
     logger.debug("Starting diarization")
-    waveform, sample_rate = torchaudio.load(audio_file_wav)
-    diarization = diarization_model(
-        {"waveform": waveform, "sample_rate": sample_rate},
-        num_speakers=num_speakers,
-    )
 
-    time_diarization_end = time.time()
-    logger.debug(
-        "Diarization completed in %.5f seconds",
-        time_diarization_end - time_transcribing_end,
+    if speech is not None:
+        audio = speech_audio(audio, speech)
+    duration = len(audio) / SAMPLE_RATE
+    if not duration:
+        turns = []
+    elif long_form_diarization_seconds and duration > long_form_diarization_seconds:
+        turns = diarize_long_form(audio, num_speakers)
+    else:
+        waveform = torch.from_numpy(audio).unsqueeze(0)
+        with diarization_lock:
+            diarization = diarization_model(
+                {"waveform": waveform, "sample_rate": SAMPLE_RATE},
+                num_speakers=num_speakers,
+            )
+        turns = [
+            [turn.start, turn.end, speaker]
+            for turn, _, speaker in diarization.itertracks(yield_label=True)
+        ]
+    if speech is not None:
+        regions = [
+            (region["start"] / SAMPLE_RATE, region["end"] / SAMPLE_RATE)
+            for region in speech
+        ]
+        turns = restore_turns(turns, regions)
+
+    elapsed = time.time() - time_start
+    if timings is not None:
+        timings["diarize"] = elapsed
+    logger.debug("Diarization completed in %.5f seconds", elapsed)
+    return turns
+
+
+def diarize_long_form(audio, num_speakers=None):
+    """
+    Diarizes the audio in overlapping windows, one window at a time, and matches
+    speakers across windows by clustering the speaker embeddings pyannote returns
+    for each window. Returns the turns as [start, end, speaker] lists.
+    """
+    windows = diarization_windows(
+        len(audio) / SAMPLE_RATE,
+        diarization_window_seconds,
+        diarization_window_overlap_seconds,
     )
+    logger.debug("Diarizing %d windows", len(windows))
+    window_turns = []
+    window_embeddings = []
+    for start, end, _, _ in windows:
+        # A window may not contain every speaker, so num_speakers only caps the
+        # per-window count; the global count is enforced by the clustering.
+        chunk = audio[int(start * SAMPLE_RATE) : int(end * SAMPLE_RATE)]
+        waveform = torch.from_numpy(chunk).unsqueeze(0)
+        with diarization_lock:
+            diarization, embeddings = diarization_model(
+                {"waveform": waveform, "sample_rate": SAMPLE_RATE},
+                max_speakers=num_speakers,
+                return_embeddings=True,
+            )
+        window_turns.append(
+            [
+                [start + turn.start, start + turn.end, speaker]
+                for turn, _, speaker in diarization.itertracks(yield_label=True)
+            ]
+        )
+        if embeddings is None:
+            embeddings = []
+        window_embeddings.append(dict(zip(diarization.labels(), embeddings)))
 
-    margin = 0.1
-    final_segments = []
-    diarization_list = list(diarization.itertracks(yield_label=True))
-    unique_speakers = {
-        speaker for _, _, speaker in diarization.itertracks(yield_label=True)
-    }
-    detected_num_speakers = len(unique_speakers)
+    return stitch_windows(
+        windows,
+        window_turns,
+        window_embeddings,
+        diarization_cluster_threshold,
+        diarization_model.clustering.method,
+        num_speakers,
+    )
 
-    speaker_idx = 0
-    n_speakers = len(diarization_list)
 
+def shift_segments(segments, offset_seconds):
+    """Moves segment and word timestamps by `offset_seconds`, in place."""
+    if not offset_seconds:
+        return
     for segment in segments:
-        segment_start = segment["start"] + offset_seconds
-        segment_end = segment["end"] + offset_seconds
-        segment_text = []
-        segment_words = []
-
+        segment["start"] += offset_seconds
+        segment["end"] += offset_seconds
         for word in segment["words"]:
-            word_start = word["start"] + offset_seconds - margin
-            word_end = word["end"] + offset_seconds + margin
-
-            while speaker_idx < n_speakers:
-                turn, _, speaker = diarization_list[speaker_idx]
-
-                if turn.start <= word_end and turn.end >= word_start:
-                    segment_text.append(word["word"])
-                    word["word"] = word["word"].strip()
-                    segment_words.append(word)
-
-                    if turn.end <= word_end:
-                        speaker_idx += 1
-
-                    break
-                elif turn.end < word_start:
-                    speaker_idx += 1
-                else:
-                    break
-
-        if segment_text:
-            combined_text = "".join(segment_text)
-            cleaned_text = re.sub("  ", " ", combined_text).strip()
-            new_segment = {
-                "avg_logprob": segment["avg_logprob"],
-                "start": segment_start - offset_seconds,
-                "end": segment_end - offset_seconds,
-                "speaker": speaker,
-                "text": cleaned_text,
-                "words": segment_words,
-            }
-            final_segments.append(new_segment)
-
-    time_merging_end = time.time()
-    logger.debug(
-        "Merging completed in %.5f seconds", time_merging_end - time_diarization_end
-    )
+            word["start"] += offset_seconds
+            word["end"] += offset_seconds
 
-    if not final_segments:
-        logger.debug("No final segments found")
-        return [], detected_num_speakers, transcript_info.language
 
-    segments = final_segments
+def group_by_speaker(segments, transcript_output_format="both", group_segments=True):
+    """
+    Joins consecutive segments of the same speaker that are at most 2 seconds apart,
+    unless `group_segments` is false, and keeps the text and/or the words of every
+    group depending on `transcript_output_format`.
+    """
     output = []
 
     current_group = {
@@ -327,35 +787,254 @@ def speech_to_text(
                 current_group["words"] = segments[i]["words"]
 
     output.append(current_group)
+    return output
+
+
+def speech_to_text(
+    audio,
+    num_speakers=None,
+    prompt="",
+    offset_seconds=0,
+    group_segments=True,
+    language=None,
+    word_timestamps=True,
+    transcript_output_format="both",
+    translate=False,
+    timings=None,
+    on_segment=None,
+    vad_parameters=DEFAULT_VAD_PARAMETERS,
+):
+    time_start = time.time()
+    if timings is None:
+        timings = {}
+
+    speech = None
+    if vad_parameters is not None:
+        speech = detect_speech(audio, vad_parameters)
+        timings["vad"] = time.time() - time_start
+        logger.debug("VAD found %d speech regions", len(speech))
+
+    if concurrent_stages:
+        logger.debug("Starting transcription and diarization concurrently")
+        transcription_future = stage_executor.submit(
+            transcribe,
+            audio,
+            prompt,
+            language,
+            word_timestamps,
+            translate,
+            timings,
+            on_segment,
+            speech,
+        )
+        diarization_future = stage_executor.submit(
+            diarize, audio, num_speakers, timings, speech
+        )
+        try:
+            segments, detected_language = transcription_future.result()
+        except BaseException:
+            # Do not leave diarization holding the GPU with nobody waiting on it.
+            if not diarization_future.cancel():
+                diarization_future.exception()
+            raise
+        turns = diarization_future.result()
+    else:
+        segments, detected_language = transcribe(
+            audio,
+            prompt,
+            language,
+            word_timestamps,
+            translate,
+            timings,
+            on_segment,
+            speech,
+        )
+        turns = diarize(audio, num_speakers, timings, speech)
+
+    time_diarization_end = time.time()
+
+    shift_segments(segments, offset_seconds)
+    final_segments, detected_num_speakers = assign_speakers(
+        segments, turns, offset_seconds
+    )
+
+    time_merging_end = time.time()
+    timings["merge"] = time_merging_end - time_diarization_end
+    logger.debug(
+        "Merging completed in %.5f seconds", time_merging_end - time_diarization_end
+    )
+
+    if not final_segments:
+        logger.debug("No final segments found")
+        return [], detected_num_speakers, detected_language
+
+    output = group_by_speaker(final_segments, transcript_output_format, group_segments)
 
     time_cleaning_end = time.time()
+    timings["group"] = time_cleaning_end - time_merging_end
     logger.debug(
         "Cleaning completed in %.5f seconds", time_cleaning_end - time_merging_end
     )
     time_end = time.time()
+    timings["speech_to_text"] = time_end - time_start
     logger.debug("Total processing time: %.5f seconds", time_end - time_start)
 
-    return output, detected_num_speakers, transcript_info.language
+    return output, detected_num_speakers, detected_language
 
 
-def handler(event: dict) -> dict:
+def handler(event: dict, emit=None) -> dict:
     """
     Entry point for serverless usage.
     Expects `event` to be a dict with an "input" key containing the parameters.
+    `emit(event, data)` receives partial results: a `segment` event for every
+    transcription segment as it is decoded, without speakers, or an `item` event
+    for every file of a batch as it completes.
     """
     try:
         predict_request = PredictRequest(**event["input"])
     except Exception as e:
         raise ValueError("Invalid input parameters: " + str(e))
-    result = predict(event, predict_request)
+    if "file_urls" in event["input"]:
+        items = []
+        for item in predict_batch(event["input"], predict_request):
+            items.append(item)
+            if emit:
+                emit("item", item)
+        completed = sum(1 for item in items if item["status"] == "completed")
+        return {
+            "results": items,
+            "completed": completed,
+            "failed": len(items) - completed,
+        }
+
+    offset_seconds = predict_request.offset_seconds
+    segment_index = 0
+
+    def on_segment(segment: dict):
+        nonlocal segment_index
+        emit(
+            "segment",
+            {
+                "index": segment_index,
+                "start": segment["start"] + offset_seconds,
+                "end": segment["end"] + offset_seconds,
+                "avg_logprob": segment["avg_logprob"],
+                "text": segment["text"].strip(),
+                "words": [
+                    dict(
+                        word,
+                        start=word["start"] + offset_seconds,
+                        end=word["end"] + offset_seconds,
+                        word=word["word"].strip(),
+                    )
+                    for word in segment["words"]
+                ],
+            },
+        )
+        segment_index += 1
+
+    result = predict(event, predict_request, on_segment if emit else None)
     return result.dict()
 
 
+# Serverless worker. `python main.py` runs the RunPod worker loop, which takes jobs
+# until the worker is scaled down, so the models loaded above are reused by every
+# job. With WORKER_MAX_CONCURRENCY > 1 the worker takes several jobs at once while
+# the GPU has WORKER_JOB_VRAM_MB free for each additional one.
+worker_job_vram_mb = float(os.getenv("WORKER_JOB_VRAM_MB", "3072"))
+running_jobs = 0
+
+
+def concurrency_modifier(current_concurrency: int) -> int:
+    """Number of jobs the worker should run at once, polled by the RunPod SDK."""
+    if whisper_device != "cuda" or worker_max_concurrency <= 1:
+        return worker_max_concurrency
+    free, _ = torch.cuda.mem_get_info(torch.device(f"cuda:{whisper_device_index}"))
+    # The memory of the running jobs is already in use, so only count new ones.
+    headroom = int(free / 2**20 // worker_job_vram_mb)
+    return max(1, min(worker_max_concurrency, running_jobs + headroom))
+
+
+# The RunPod SDK streams every job of a generator handler, and /run and /runsync
+# then return the list of its chunks instead of the output. Streaming is therefore
+# a deployment choice: WORKER_STREAMING=1 serves jobs with stream_worker_handler,
+# otherwise worker_handler returns the same output as handler.
+worker_streaming = os.getenv("WORKER_STREAMING", "0") != "0"
+
+
+async def worker_handler(job: dict) -> dict:
+    """Handler of the RunPod worker, returns the output of `handler`."""
+    global running_jobs
+    running_jobs += 1
+    try:
+        # Jobs run on their own threads so the worker loop can take others.
+        return await asyncio.get_running_loop().run_in_executor(None, handler, job)
+    finally:
+        running_jobs -= 1
+
+
+async def stream_worker_handler(job: dict):
+    """
+    Streaming handler of the RunPod worker. Yields a final `result` chunk holding
+    the output of `handler`. With `"stream": true` in the input it first yields the
+    `segment` (or, for batches, `item`) chunks emitted while the job runs, which
+    RunPod's /stream endpoint returns as they arrive. /run and /runsync return the
+    list of all chunks, a single `result` chunk for jobs that do not stream.
+    """
+    global running_jobs
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+
+    def emit(event: str, data):
+        chunk = {"event": event, "data": data}
+        loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+
+    def run():
+        try:
+            result = handler(job, emit if job["input"].get("stream") else None)
+            loop.call_soon_threadsafe(
+                chunks.put_nowait, {"event": "result", "data": result}
+            )
+        finally:
+            loop.call_soon_threadsafe(chunks.put_nowait, None)
+
+    running_jobs += 1
+    try:
+        # Jobs run on their own threads so the worker loop can take others.
+        task = loop.run_in_executor(None, run)
+        while True:
+            chunk = await chunks.get()
+            if chunk is None:
+                break
+            yield chunk
+        # Raises the job's error, which the SDK reports as the job's failure.
+        await task
+    finally:
+        running_jobs -= 1
+
+
 if __name__ == "__main__":
-    # For local testing, read the event JSON from a command-line argument or standard input.
-    if len(sys.argv) > 1:
-        event = json.loads(sys.argv[1])
+    if len(sys.argv) > 1 and not sys.argv[1].startswith("--"):
+        # Run a single event given as a JSON argument, or read from standard input
+        # with "-", and print its output.
+        if sys.argv[1] == "-":
+            event = json.load(sys.stdin)
+        else:
+            event = json.loads(sys.argv[1])
+        print(json.dumps(handler(event)))
     else:
-        event = json.load(sys.stdin)
-    output = handler(event)
-    print(json.dumps(output))
+        import runpod
+
+        # Flags such as --rp_serve_api (a local test server on port 8000) or
+        # --test_input '{"input": {...}}' are read by the SDK.
+        if worker_streaming:
+            worker = stream_worker_handler
+        else:
+            worker = worker_handler
+        runpod.serverless.start(
+            {
+                "handler": worker,
+                "concurrency_modifier": concurrency_modifier,
+                "return_aggregate_stream": worker_streaming,
+            }
+        )
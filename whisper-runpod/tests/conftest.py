@@ -0,0 +1,73 @@
+import os
+import sys
+import types
+from unittest import mock
+
+import numpy as np
+import pytest
+
+# The worker module is not a package; import it from the worker directory.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# main.py requires a Hugging Face token on import, and reads the default clustering
+# threshold from the pipeline unless it is set. The stand-in models need neither.
+os.environ.setdefault("HUGGING_FACE_TOKEN", "test")
+os.environ.setdefault("DIARIZATION_CLUSTER_THRESHOLD", "0.7")
+
+
+@pytest.fixture(scope="session")
+def main():
+    """
+    The worker module, skipping the test without the model dependencies. It loads
+    its models on import; the tests replace them, so none are downloaded.
+    """
+    for module in ("torch", "faster_whisper", "pyannote.audio"):
+        pytest.importorskip(module)
+    with mock.patch("faster_whisper.WhisperModel"), mock.patch(
+        "pyannote.audio.Pipeline.from_pretrained"
+    ):
+        import main
+
+    return main
+
+
+class Whisper:
+    """Stands in for the WhisperModel; records the options of every call."""
+
+    def __init__(self):
+        self.calls = []
+
+    def transcribe(self, audio, **options):
+        self.calls.append(options)
+        words = [
+            types.SimpleNamespace(start=0.0, end=0.5, word=" hello", probability=0.9)
+        ]
+        segments = [
+            types.SimpleNamespace(
+                start=0.0, end=0.5, text=" hello", avg_logprob=-0.1, words=words
+            )
+        ]
+        return iter(segments), types.SimpleNamespace(language=options["language"])
+
+
+class Diarization:
+    """A pyannote result with a single speaker turn over the whole clip."""
+
+    def itertracks(self, yield_label=False):
+        yield types.SimpleNamespace(start=0.0, end=1.0), None, "SPEAKER_00"
+
+
+@pytest.fixture
+def whisper(main, monkeypatch):
+    """A stubbed worker: one second of audio for any input, stand-in models."""
+    model = Whisper()
+    monkeypatch.setattr(main, "whisper_model", model)
+    monkeypatch.setattr(
+        main, "diarization_model", lambda *args, **kwargs: Diarization()
+    )
+    monkeypatch.setattr(
+        main,
+        "load_audio",
+        lambda input_data, timings: np.zeros(main.SAMPLE_RATE, dtype=np.float32),
+    )
+    return model
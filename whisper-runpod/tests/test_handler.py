@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+
+def job(**options):
+    return {
+        "id": "job-1",
+        "input": {
+            "file_url": "https://example.com/meeting.mp3",
+            "vad_filter": False,
+            **options,
+        },
+    }
+
+
+def stream(main, job):
+    async def collect():
+        return [chunk async for chunk in main.stream_worker_handler(job)]
+
+    return asyncio.run(collect())
+
+
+def test_worker_passes_the_request_options_to_whisper(main, whisper):
+    output = asyncio.run(
+        main.worker_handler(job(language="de", translate=True, prompt="Hallo"))
+    )
+
+    [options] = whisper.calls
+    assert options["language"] == "de"
+    assert options["task"] == "translate"
+    assert options["initial_prompt"] == "Hallo"
+    assert options["word_timestamps"] is True
+    assert (output["language"], output["num_speakers"]) == ("de", 1)
+    assert output["segments"]
+
+
+def test_worker_transcribes_by_default(main, whisper):
+    asyncio.run(main.worker_handler(job()))
+
+    [options] = whisper.calls
+    assert (options["language"], options["task"]) == (None, "transcribe")
+
+
+def test_streaming_worker_yields_segments_then_the_result(main, whisper):
+    chunks = stream(main, job(language="en", stream=True, offset_seconds=10))
+
+    assert [chunk["event"] for chunk in chunks] == ["segment", "result"]
+    segment = chunks[0]["data"]
+    assert (segment["index"], segment["start"], segment["text"]) == (0, 10.0, "hello")
+    result = chunks[1]["data"]
+    assert (result["language"], result["num_speakers"]) == ("en", 1)
+    assert result["segments"][0]["start"] == 10.0
+
+
+def test_streaming_worker_returns_a_single_chunk_without_stream(main, whisper):
+    chunks = stream(main, job(language="en"))
+
+    assert [chunk["event"] for chunk in chunks] == ["result"]
+
+
+def test_streaming_worker_raises_the_job_error(main, whisper, monkeypatch):
+    def fail(input_data, timings):
+        raise ValueError("Failed to download file from URL")
+
+    monkeypatch.setattr(main, "load_audio", fail)
+    with pytest.raises(ValueError, match="Failed to download"):
+        stream(main, job(stream=True))